@@ -0,0 +1,270 @@
+import os, math, time, random, asyncio, threading, logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Deque, Dict, Optional
+
+from app import metrics
+
+log = logging.getLogger("invest-soul.admission")
+
+# Admission control in front of Azure OpenAI: bounded concurrency, a token bucket sized to this
+# worker's share of the deployment's TPM/RPM quota, a bounded fair queue, and 429 backoff.
+AOAI_MAX_CONCURRENCY  = int(os.getenv("AOAI_MAX_CONCURRENCY", "8"))     # in-flight chat turns per worker
+AOAI_TPM_LIMIT        = int(os.getenv("AOAI_TPM_LIMIT", "0"))           # tokens/min for this worker; 0 = unmetered
+AOAI_RPM_LIMIT        = int(os.getenv("AOAI_RPM_LIMIT", "0"))           # requests/min for this worker; 0 = unmetered
+ADMISSION_QUEUE_MAX   = int(os.getenv("ADMISSION_QUEUE_MAX", "32"))     # waiting turns before we shed load
+ADMISSION_MAX_WAIT    = float(os.getenv("ADMISSION_MAX_WAIT", "15"))    # seconds a turn may wait for a slot
+ADMISSION_SESSION_MAX = int(os.getenv("ADMISSION_SESSION_MAX", "2"))    # in-flight + queued turns per session
+AOAI_MAX_RETRIES      = int(os.getenv("AOAI_MAX_RETRIES", "3"))         # upstream 429 retries per call
+AOAI_RETRY_BASE       = float(os.getenv("AOAI_RETRY_BASE", "0.5"))
+AOAI_RETRY_MAX_WAIT   = float(os.getenv("AOAI_RETRY_MAX_WAIT", "20"))   # longer upstream hints are passed to the client
+
+class Rejected(Exception):
+    """Raised instead of queueing further; surfaced to the client as 429 with Retry-After."""
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason, self.retry_after = reason, retry_after
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to one minute's worth; callers hold the admission lock."""
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.rate = per_minute / 60.0
+        self.t = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.capacity:
+            return 0.0
+        self.level = min(self.capacity, self.level + (now - self.t) * self.rate)
+        self.t = now
+        amount = min(amount, self.capacity)  # an oversized turn waits for a full bucket, never forever
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.level -= amount
+
+    def credit(self, amount: float):
+        # Negative credit (turn used more than estimated) is allowed to drive the level below zero
+        if self.capacity:
+            self.level = min(self.capacity, self.level + amount)
+
+class Ticket:
+    __slots__ = ("session", "tokens", "used", "granted", "released", "wake", "t0")
+
+    def __init__(self, session: str, tokens: int, wake: Callable[[], None]):
+        self.session, self.tokens, self.wake = session, tokens, wake
+        self.used: Optional[int] = None  # set by the caller to reconcile the bucket with actual usage
+        self.granted = self.released = False
+        self.t0 = 0.0
+
+class Admission:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tpm, self.rpm = TokenBucket(AOAI_TPM_LIMIT), TokenBucket(AOAI_RPM_LIMIT)
+        self.active = 0
+        self.queued = 0
+        self.per_session: Dict[str, int] = {}
+        # One FIFO per session, served round-robin so a chatty session cannot starve the others
+        self.queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self.paused_until = 0.0   # set from upstream retry-after hints
+        self.next_check = 0.0     # when the bucket will next have room for the head of the queue
+        self.hold_ewma = 2.0      # seconds a turn holds its slot, for Retry-After estimates
+        self._stats = {"admitted": 0, "queued": 0, "rejectedQueue": 0, "rejectedSession": 0, "timedOut": 0,
+                       "upstream429": 0, "retries": 0, "gaveUp": 0}
+
+    # ---------- slots ----------
+    # Waiting happens on the event loop only: a sync waiter would pin one of the threadpool's threads, and a
+    # full queue (ADMISSION_QUEUE_MAX + AOAI_MAX_CONCURRENCY) would starve every other sync route
+    @asynccontextmanager
+    async def aslot(self, session: str, tokens: int):
+        ticket = await self.acquire(session, tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    async def acquire(self, session: str, tokens: int) -> Ticket:
+        """Async wait for a slot; the caller must release() the returned ticket."""
+        loop, ev = asyncio.get_running_loop(), asyncio.Event()
+        ticket = self._enqueue(session, tokens, lambda: loop.call_soon_threadsafe(ev.set))
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + ADMISSION_MAX_WAIT
+        try:
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._abandon(ticket)
+                    break
+                try:
+                    await asyncio.wait_for(ev.wait(), self._poll_interval(remaining))
+                except asyncio.TimeoutError:
+                    pass
+                ev.clear()
+                self._redispatch()
+        except asyncio.CancelledError:
+            # Client went away while queued: give the place (or a just-granted slot) back
+            with self._lock:
+                if not ticket.granted:
+                    self._remove(ticket)
+            self.release(ticket)
+            raise
+        metrics.record("admission", time.perf_counter() - t0)
+        return ticket
+
+    def release(self, ticket: Ticket):
+        with self._lock:
+            if ticket.released or not ticket.granted:
+                return
+            ticket.released = True
+            self.active -= 1
+            self._leave(ticket.session)
+            if ticket.used is not None:
+                self.tpm.credit(ticket.tokens - ticket.used)
+            self.hold_ewma = 0.8 * self.hold_ewma + 0.2 * (time.monotonic() - ticket.t0)
+            self._dispatch(time.monotonic())
+
+    def charge(self, tokens: int):
+        """Account for completions made outside a slot (background summaries) without waiting."""
+        with self._lock:
+            self.tpm.take(tokens); self.rpm.take(1)
+
+    # ---------- upstream 429s ----------
+    # openai.RateLimitError is matched by status code so this module doesn't import the SDK
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        for attempt in range(AOAI_MAX_RETRIES + 1):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if getattr(e, "status_code", None) != 429:
+                    raise
+                time.sleep(self._throttled(e, attempt))
+
+    async def acall(self, fn: Callable, *args, **kwargs) -> Any:
+        for attempt in range(AOAI_MAX_RETRIES + 1):
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if getattr(e, "status_code", None) != 429:
+                    raise
+                await asyncio.sleep(self._throttled(e, attempt))
+
+    def _throttled(self, err: Exception, attempt: int) -> float:
+        """Delay before retrying an upstream 429, or Rejected once retries are spent."""
+        hint = retry_hint(err)
+        now = time.monotonic()
+        with self._lock:
+            self._stats["upstream429"] += 1
+            if hint:
+                # Hold the queue too, so waiting turns don't walk into the same throttle
+                self.paused_until = max(self.paused_until, now + hint)
+            if attempt >= AOAI_MAX_RETRIES or (hint or 0) > AOAI_RETRY_MAX_WAIT:
+                self._stats["gaveUp"] += 1
+                raise Rejected("upstream", max(1, math.ceil(hint or self._retry_after(now))))
+            self._stats["retries"] += 1
+        cap = min(AOAI_RETRY_MAX_WAIT, AOAI_RETRY_BASE * 2 ** attempt)
+        delay = hint + random.uniform(0, AOAI_RETRY_BASE) if hint is not None else random.uniform(0, cap)
+        log.warning("aoai 429 attempt=%d retry_in=%.2fs hinted=%s", attempt + 1, delay, hint)
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            return dict(self._stats, active=self.active, waiting=self.queued, sessionsWaiting=len(self.queues),
+                        maxConcurrency=AOAI_MAX_CONCURRENCY, queueMax=ADMISSION_QUEUE_MAX,
+                        tpmAvailable=round(self.tpm.level) if self.tpm.capacity else None,
+                        rpmAvailable=round(self.rpm.level) if self.rpm.capacity else None,
+                        pausedFor=round(max(0.0, self.paused_until - now), 2),
+                        holdSecondsEwma=round(self.hold_ewma, 3), retryAfter=self._retry_after(now))
+
+    # ---------- internals (callers hold the lock unless noted) ----------
+    def _enqueue(self, session: str, tokens: int, wake: Callable[[], None]) -> Ticket:
+        ticket = Ticket(session, tokens, wake)
+        with self._lock:
+            now = time.monotonic()
+            if self.per_session.get(session, 0) >= ADMISSION_SESSION_MAX:
+                self._stats["rejectedSession"] += 1
+                raise Rejected("session", self._retry_after(now))
+            self.per_session[session] = self.per_session.get(session, 0) + 1
+            self.queues.setdefault(session, deque()).append(ticket)
+            self.queued += 1
+            self._dispatch(now)
+            if not ticket.granted:
+                if self.queued > ADMISSION_QUEUE_MAX:
+                    self._remove(ticket)
+                    self._stats["rejectedQueue"] += 1
+                    raise Rejected("queue", self._retry_after(now))
+                self._stats["queued"] += 1
+        return ticket
+
+    def _poll_interval(self, remaining: float) -> float:
+        # Wake when the bucket or an upstream pause should have cleared; grants wake us earlier
+        wait = max(self.next_check, self.paused_until) - time.monotonic()
+        return max(0.01, min(remaining, wait if wait > 0 else remaining))
+
+    def _redispatch(self):
+        with self._lock:
+            self._dispatch(time.monotonic())
+
+    def _dispatch(self, now: float):
+        while self.queues and self.active < AOAI_MAX_CONCURRENCY:
+            if now < self.paused_until:
+                return
+            session, queue = next(iter(self.queues.items()))
+            ticket = queue[0]
+            wait = max(self.tpm.wait_time(ticket.tokens, now), self.rpm.wait_time(1, now))
+            if wait > 0:
+                self.next_check = now + wait
+                return
+            queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.queues.move_to_end(session)
+            else:
+                del self.queues[session]
+            self.tpm.take(ticket.tokens); self.rpm.take(1)
+            self.active += 1
+            self._stats["admitted"] += 1
+            ticket.granted, ticket.t0 = True, now
+            ticket.wake()
+
+    def _abandon(self, ticket: Ticket):
+        with self._lock:
+            if ticket.granted:  # granted while we were timing out: keep it
+                return
+            self._remove(ticket)
+            self._stats["timedOut"] += 1
+            raise Rejected("timeout", self._retry_after(time.monotonic()))
+
+    def _remove(self, ticket: Ticket):
+        queue = self.queues.get(ticket.session)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self.queued -= 1
+            if not queue:
+                del self.queues[ticket.session]
+        self._leave(ticket.session)
+
+    def _leave(self, session: str):
+        n = self.per_session.get(session, 0) - 1
+        if n > 0:
+            self.per_session[session] = n
+        else:
+            self.per_session.pop(session, None)
+
+    def _retry_after(self, now: float) -> int:
+        backlog = (self.queued + 1) * self.hold_ewma / max(1, AOAI_MAX_CONCURRENCY)
+        return max(1, math.ceil(max(backlog, self.paused_until - now, self.next_check - now)))
+
+def retry_hint(err: Exception) -> Optional[float]:
+    """Seconds from Azure's retry-after-ms / retry-after headers, if present."""
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return max(0.0, float(headers[name]) * scale)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+admission = Admission()
@@ -0,0 +1,95 @@
+from typing import Any, Dict, List
+
+from app.market_search import curated_four, sector_label
+
+CTS = "Cognizant (CTS)"
+CTS_SHARE = 0.40  # of the direct-stock budget; the rest is split equally among the 4 alternates
+
+def calc_allocation(risk: str, liabilities: float, period_years: int, net_surplus: float):
+    risk_l = (risk or "").lower()
+    # Asset allocation
+    if risk_l.startswith("aggr"):
+        equity_pct, savings_pct = 85, 15
+    elif risk_l.startswith("mod"):
+        equity_pct, savings_pct = 60, 40
+    else:
+        equity_pct, savings_pct = 30, 70
+    funds_equity = round(net_surplus * (equity_pct/100.0), 2)
+    funds_saving = round(net_surplus - funds_equity, 2)
+
+    # Equity split defaults
+    ds, mf, debt = 50, 30, 20
+
+    # Overrides
+    low_liab = (liabilities or 0) <= (0.2 * net_surplus if net_surplus>0 else 0)
+    med_liab = (liabilities or 0) > (0.2 * net_surplus) and (liabilities or 0) <= (0.5 * net_surplus)
+    if risk_l.startswith("aggr") and low_liab:
+        ds, mf, debt = 70, 20, 10
+    elif risk_l.startswith("mod") or med_liab:
+        ds, mf, debt = 50, 30, 20
+    if risk_l.startswith("cons") or (period_years or 0) < 2:
+        ds, mf, debt = 30, 40, 30
+
+    return {
+        "equity_pct": equity_pct, "savings_pct": savings_pct,
+        "funds_equity": funds_equity, "funds_saving": funds_saving,
+        "eq_split": {"direct_stocks": ds, "mutual_funds": mf, "debt": debt}
+    }
+
+def format_currency(amount: float, symbol: str) -> str:
+    return f"{symbol}{amount:,.2f}"
+
+def _split_cents(total: float, weights: List[float]) -> List[float]:
+    # Round each share to cents and give the remainder to the last one, so sums always hold
+    cents = round(total * 100)
+    parts = [round(cents * w) for w in weights[:-1]]
+    parts.append(cents - sum(parts))
+    return [p / 100 for p in parts]
+
+def build_roadmap(cash_inflow: float, cash_outflow: float, liabilities: float, risk: str,
+                  sector: str, period_years: int, currency: str = "$") -> Dict[str, Any]:
+    """Fully computed roadmap: allocation, instrument distribution, stock amounts and ready-to-render tables."""
+    sector = sector_label(sector)
+    net_surplus = round((cash_inflow or 0) - (cash_outflow or 0), 2)
+    alloc = calc_allocation(risk, liabilities, period_years, net_surplus)
+    split = alloc["eq_split"]
+    ds_amt, mf_amt, debt_amt = _split_cents(alloc["funds_equity"], [split["direct_stocks"] / 100,
+                                                                    split["mutual_funds"] / 100, split["debt"] / 100])
+    alternates = curated_four(sector)
+    alt_share = (1 - CTS_SHARE) / len(alternates) if alternates else 0
+    stock_amts = _split_cents(ds_amt, [CTS_SHARE] + [alt_share] * len(alternates)) if alternates else [ds_amt]
+    stocks = [{"name": n, "amount": a} for n, a in zip([CTS] + alternates, stock_amts)]
+    alt_total = round(sum(s["amount"] for s in stocks[1:]), 2)
+    alt_pct = round(split["direct_stocks"] * (1 - CTS_SHARE), 2)
+    fc = lambda x: format_currency(x, currency)
+
+    roadmap_table = "\n".join([
+        "| Asset Class | Allocation | Monthly Amount | Strategy |",
+        "| :--- | :--- | :--- | :--- |",
+        f"| Equity | {alloc['equity_pct']}% | {fc(alloc['funds_equity'])} | Growth (Focus: {sector}) |",
+        f"| Savings | {alloc['savings_pct']}% | {fc(alloc['funds_saving'])} | Capital Preservation |",
+    ])
+    distribution_table = "\n".join([
+        "| Market/Instrument | Allocation % | Amount | Focus |",
+        "| :--- | :--- | :--- | :--- |",
+        f"| Direct Stocks | {split['direct_stocks']}% | {fc(ds_amt)} | {CTS} + {len(alternates)} Alternates |",
+        f"| Mutual Funds | {split['mutual_funds']}% | {fc(mf_amt)} | {sector} ETFs |",
+        f"| Debt Instruments | {split['debt']}% | {fc(debt_amt)} | Strategic Bonds |",
+    ])
+    stocks_table = "\n".join(["| Stock | Amount |", "| :--- | :--- |"] + [f"| {s['name']} | {fc(s['amount'])} |" for s in stocks])
+    return {
+        "netSurplus": net_surplus,
+        "currency": currency,
+        "allocation": alloc,
+        "distribution": {"direct_stocks": ds_amt, "mutual_funds": mf_amt, "debt": debt_amt},
+        "stocks": stocks,
+        "tables": {"roadmap": roadmap_table, "distribution": distribution_table, "stocks": stocks_table},
+        # Pre-formatted values for the Final Portfolio Summary / UpdatePortfolioTool
+        "summary": {
+            "investmentAmount": net_surplus,
+            "assetAllocation": f"Equity: {alloc['equity_pct']}% / Savings: {alloc['savings_pct']}%",
+            "equityRecommendation": f"{CTS}: {fc(stocks[0]['amount'])}",
+            "alternateEquities": f"{', '.join(alternates)}: {fc(alt_total)} ({alt_pct}%)",
+            "debtRecommendation": f"Strategic Bonds: {fc(debt_amt)} ({split['debt']}%)",
+        },
+    }
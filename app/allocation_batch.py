@@ -0,0 +1,95 @@
+import csv, io, json
+from typing import Any, Dict, Iterator, List, Sequence
+
+import numpy as np
+
+# Vectorised twin of allocation.calc_allocation for bulk what-if sweeps and backtests.
+OUTPUT_COLUMNS = ("equity_pct", "savings_pct", "funds_equity", "funds_saving", "direct_stocks", "mutual_funds", "debt")
+
+def _risk_masks(risk: Sequence[Any]):
+    # Classify each distinct label once, then broadcast back through the inverse index
+    arr = np.asarray(risk)
+    if arr.dtype.kind != "U":
+        arr = np.asarray(["" if r is None else str(r) for r in arr.tolist()], dtype=str)
+    labels, inverse = np.unique(arr, return_inverse=True)
+    lowered = [l.lower() for l in labels]
+    aggr = np.array([l.startswith("aggr") for l in lowered], dtype=bool)[inverse]
+    mod = np.array([l.startswith("mod") for l in lowered], dtype=bool)[inverse]
+    cons = np.array([l.startswith("cons") for l in lowered], dtype=bool)[inverse]
+    return aggr, mod, cons
+
+def calc_allocation_batch(risk: Sequence[Any], liabilities: Sequence[Any], period_years: Sequence[Any],
+                          net_surplus: Sequence[Any]) -> Dict[str, np.ndarray]:
+    """Same rules as calc_allocation over whole columns; missing liabilities/periods count as 0."""
+    aggr, mod, cons = _risk_masks(risk)
+    liab = np.nan_to_num(np.asarray(liabilities, dtype=float))
+    period = np.nan_to_num(np.asarray(period_years, dtype=float))
+    surplus = np.asarray(net_surplus, dtype=float)
+
+    equity_pct = np.where(aggr, 85, np.where(mod, 60, 30))
+    funds_equity = np.round(surplus * (equity_pct / 100.0), 2)
+    funds_saving = np.round(surplus - funds_equity, 2)
+
+    low_liab = liab <= np.where(surplus > 0, 0.2 * surplus, 0)
+    # Aggressive & low liabilities -> 70/20/10; "moderate or medium liabilities" keeps the 50/30/20 default
+    rich = aggr & low_liab
+    ds = np.where(rich, 70, 50); mf = np.where(rich, 20, 30); debt = np.where(rich, 10, 20)
+    safe = cons | (period < 2)
+    ds = np.where(safe, 30, ds); mf = np.where(safe, 40, mf); debt = np.where(safe, 30, debt)
+
+    return {"equity_pct": equity_pct, "savings_pct": 100 - equity_pct, "funds_equity": funds_equity,
+            "funds_saving": funds_saving, "direct_stocks": ds, "mutual_funds": mf, "debt": debt}
+
+# ---------- input decoding ----------
+def columns_from_mapping(cols: Dict[str, Sequence[Any]]) -> Dict[str, Sequence[Any]]:
+    """Accepts riskAppetite/liabilities/investmentPeriod plus netSurplus, or cashInflow and cashOutflow."""
+    if "netSurplus" not in cols:
+        if not ("cashInflow" in cols and "cashOutflow" in cols):
+            raise ValueError("Provide netSurplus, or cashInflow and cashOutflow")
+        cols = dict(cols, netSurplus=np.asarray(cols["cashInflow"], dtype=float) - np.asarray(cols["cashOutflow"], dtype=float))
+    if "riskAppetite" not in cols:
+        raise ValueError("riskAppetite column is required")
+    n = len(cols["riskAppetite"])
+    out = {"riskAppetite": cols["riskAppetite"], "netSurplus": cols["netSurplus"],
+           "liabilities": cols.get("liabilities", np.zeros(n)), "investmentPeriod": cols.get("investmentPeriod", np.zeros(n))}
+    if any(len(v) != n for v in out.values()):
+        raise ValueError("All columns must have the same length")
+    return out
+
+def columns_from_csv(data: bytes) -> Dict[str, Sequence[Any]]:
+    reader = csv.DictReader(io.StringIO(data.decode("utf-8-sig")))
+    cols: Dict[str, List[Any]] = {f: [] for f in reader.fieldnames or []}
+    for row in reader:
+        for f in cols:
+            cols[f].append(row.get(f))
+    numeric = {f: np.array([float(v) if v not in (None, "") else np.nan for v in vals]) for f, vals in cols.items() if f != "riskAppetite"}
+    return columns_from_mapping(dict(numeric, riskAppetite=cols.get("riskAppetite", [])))
+
+def columns_from_arrow(data: bytes) -> Dict[str, Sequence[Any]]:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ValueError("Arrow input requires pyarrow to be installed")
+    try:
+        table = pa.ipc.open_stream(data).read_all()
+    except pa.ArrowInvalid:
+        table = pa.ipc.open_file(data).read_all()
+    return columns_from_mapping({name: table.column(name).to_numpy(zero_copy_only=False) for name in table.column_names})
+
+# ---------- output encoding ----------
+def _chunk_columns(result: Dict[str, np.ndarray], start: int, stop: int) -> Dict[str, List[Any]]:
+    return {c: result[c][start:stop].tolist() for c in OUTPUT_COLUMNS}
+
+def stream_ndjson(result: Dict[str, np.ndarray], chunk_size: int) -> Iterator[bytes]:
+    """One columnar JSON object per chunk: {"offset": i, "equity_pct": [...], ...}."""
+    n = len(result["equity_pct"])
+    for start in range(0, n, chunk_size):
+        yield (json.dumps(dict(offset=start, **_chunk_columns(result, start, start + chunk_size))) + "\n").encode()
+
+def stream_csv(result: Dict[str, np.ndarray], chunk_size: int) -> Iterator[bytes]:
+    n = len(result["equity_pct"])
+    yield (",".join(OUTPUT_COLUMNS) + "\n").encode()
+    for start in range(0, n, chunk_size):
+        buf = io.StringIO()
+        csv.writer(buf).writerows(zip(*_chunk_columns(result, start, start + chunk_size).values()))
+        yield buf.getvalue().encode()
@@ -0,0 +1,132 @@
+import time, threading, logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+log = logging.getLogger("invest-soul.cache")
+
+class _Entry:
+    __slots__ = ("value", "stored", "ttl")
+    def __init__(self, value: Any, ttl: float):
+        self.value, self.stored, self.ttl = value, time.monotonic(), ttl
+
+class _Flight:
+    __slots__ = ("event", "value", "error")
+    def __init__(self):
+        self.event, self.value, self.error = threading.Event(), None, None
+
+class RefreshAheadCache:
+    """Bounded LRU cache with per-entry TTL, single-flight loads and background refresh.
+
+    - fresh hit (age < ttl * refresh_ahead): returned as-is
+    - late hit (age < ttl): returned, one background refresh is started
+    - stale (age < ttl + stale_while_revalidate): returned, one background refresh is started
+    - miss/expired: concurrent callers share one loader call
+    - loader failure: the last good value is served for up to stale_if_error seconds past ttl
+    """
+    def __init__(self, name: str, ttl: float, refresh_ahead: float = 1.0, stale_while_revalidate: float = 0.0,
+                 stale_if_error: float = 0.0, max_entries: int = 256, load_timeout: float = 30.0,
+                 ttl_of: Optional[Callable[[Any], Optional[float]]] = None):
+        self.name, self.ttl, self.refresh_ahead = name, ttl, refresh_ahead
+        self.stale_while_revalidate, self.stale_if_error = stale_while_revalidate, stale_if_error
+        self.max_entries, self.load_timeout, self.ttl_of = max_entries, load_timeout, ttl_of
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stale": 0, "refreshes": 0, "errors": 0, "evictions": 0}
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None:
+                age = time.monotonic() - e.stored
+                if age < e.ttl:
+                    self._entries.move_to_end(key); self._stats["hits"] += 1
+                    refresh = age >= e.ttl * self.refresh_ahead
+                elif age < e.ttl + self.stale_while_revalidate:
+                    self._entries.move_to_end(key); self._stats["stale"] += 1
+                    refresh = True
+                else:
+                    refresh = None
+                if refresh is not None:
+                    if refresh: self._refresh_in_background(key, loader)
+                    return e.value
+            self._stats["misses"] += 1
+        return self._load(key, loader)
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None or time.monotonic() - e.stored >= e.ttl:
+                return None
+            self._entries.move_to_end(key); self._stats["hits"] += 1
+            return e.value
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if ttl is None and self.ttl_of:
+            ttl = self.ttl_of(value)
+        with self._lock:
+            self._entries[key] = _Entry(value, self.ttl if ttl is None else ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False); self._stats["evictions"] += 1
+
+    def invalidate(self, key: Optional[Hashable] = None) -> int:
+        with self._lock:
+            if key is None:
+                n = len(self._entries); self._entries.clear(); return n
+            return 1 if self._entries.pop(key, None) is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["stale"] + self._stats["misses"]
+            served = self._stats["hits"] + self._stats["stale"]
+            return dict(self._stats, name=self.name, size=len(self._entries), maxEntries=self.max_entries,
+                        hitRate=round(served / lookups, 4) if lookups else None)
+
+    # ---------- internals ----------
+    def _load(self, key: Hashable, loader: Callable[[], Any], flight: Optional[_Flight] = None) -> Any:
+        if flight is None:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+            if not leader:
+                if not flight.event.wait(self.load_timeout):
+                    raise TimeoutError(f"{self.name}: timed out waiting for in-flight load")
+                if flight.error is not None:
+                    raise flight.error
+                return flight.value
+        try:
+            flight.value = value = loader()
+            self.put(key, value)
+            return value
+        except Exception as ex:
+            flight.error = ex
+            with self._lock:
+                self._stats["errors"] += 1
+                e = self._entries.get(key)
+                if e is not None and time.monotonic() - e.stored < e.ttl + self.stale_if_error:
+                    # Serve the last good value through a short upstream outage
+                    log.warning("%s: load failed for %r, serving last good value: %s", self.name, key, ex)
+                    self._stats["stale"] += 1
+                    flight.error, flight.value = None, e.value
+                    return e.value
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], Any]):
+        # Caller holds self._lock; an existing flight for the key means a load is already running.
+        if key in self._flights:
+            return
+        flight = self._flights[key] = _Flight()
+        self._stats["refreshes"] += 1
+        def run():
+            try:
+                self._load(key, loader, flight)
+            except Exception as ex:
+                log.warning("%s: background refresh failed for %r: %s", self.name, key, ex)
+        threading.Thread(target=run, name=f"{self.name}-refresh", daemon=True).start()
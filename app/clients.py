@@ -0,0 +1,91 @@
+import os, time, threading, inspect
+from typing import TYPE_CHECKING, Any, Callable, Dict
+
+import httpx
+
+from app import metrics, startup
+
+if TYPE_CHECKING:
+    import requests
+
+# One lazily created, keep-alive client per upstream per worker process.
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))   # distinct hosts kept per pool
+HTTP_POOL_MAXSIZE     = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))       # sockets per host
+HTTP_KEEPALIVE        = int(os.getenv("HTTP_KEEPALIVE", "10"))          # idle sockets kept (httpx)
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT  = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT     = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+
+_lock = threading.Lock()
+_clients: Dict[str, Any] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+
+def get_client(name: str, factory: Callable[[], Any]) -> Any:
+    """Return the shared client registered under `name`, building it with `factory` on first use."""
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+                _stats.setdefault(name, {"hits": 0, "misses": 0})["misses"] += 1
+                return client
+    with _lock:
+        _stats.setdefault(name, {"hits": 0, "misses": 0})["hits"] += 1
+    return client
+
+def httpx_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=HTTP_POOL_MAXSIZE, max_keepalive_connections=HTTP_KEEPALIVE,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+
+def httpx_timeout() -> httpx.Timeout:
+    return httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+def httpx_hooks(upstream: str, is_async: bool = False) -> Dict[str, list]:
+    """Event hooks that count every response (retries included) per upstream and status."""
+    def on_request(request: httpx.Request):
+        request.extensions["t0"] = time.perf_counter()
+    def on_response(response: httpx.Response):
+        t0 = response.request.extensions.get("t0")
+        metrics.upstream(upstream, response.status_code, time.perf_counter() - t0 if t0 else None)
+    if not is_async:
+        return {"request": [on_request], "response": [on_response]}
+    async def a_on_request(request): on_request(request)
+    async def a_on_response(response): on_response(response)
+    return {"request": [a_on_request], "response": [a_on_response]}
+
+def _build_session() -> "requests.Session":
+    requests = startup.lazy_import("requests")
+    s = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+    s.mount("https://", adapter); s.mount("http://", adapter)
+    # Only the Speech STS / avatar relay endpoints go through this session
+    s.hooks["response"].append(lambda r, *a, **kw: metrics.upstream("speech", r.status_code, r.elapsed.total_seconds()))
+    return s
+
+def http_session() -> "requests.Session":
+    """Pooled requests.Session for plain REST upstreams (Speech STS, avatar relay)."""
+    return get_client("http", _build_session)
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {"clients": {k: dict(v, live=k in _clients) for k, v in _stats.items()},
+                "config": {"poolConnections": HTTP_POOL_CONNECTIONS, "poolMaxsize": HTTP_POOL_MAXSIZE,
+                           "keepalive": HTTP_KEEPALIVE, "keepaliveExpiry": HTTP_KEEPALIVE_EXPIRY,
+                           "connectTimeout": HTTP_CONNECT_TIMEOUT, "readTimeout": HTTP_READ_TIMEOUT}}
+
+async def aclose_all():
+    """Close every registered client; async clients are awaited. Called on app shutdown."""
+    with _lock:
+        clients = list(_clients.items()); _clients.clear()
+    for name, client in clients:
+        closer = getattr(client, "aclose", None) or getattr(client, "close", None)
+        if not closer:
+            continue
+        try:
+            res = closer()
+            if inspect.isawaitable(res):
+                await res
+        except Exception:
+            pass
@@ -0,0 +1,138 @@
+import os, threading, logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app import startup
+from app.db import SessionLocal, SessionSummary
+from app.history import turn_digest
+from app.writer import writer
+
+log = logging.getLogger("invest-soul.context")
+
+# Prompt windowing: system prompt + rolling summary + the latest turns verbatim.
+CONTEXT_KEEP_TURNS   = int(os.getenv("CONTEXT_KEEP_TURNS", "12"))     # latest messages always sent word for word
+CONTEXT_FOLD_STEP    = int(os.getenv("CONTEXT_FOLD_STEP", "6"))       # fold once this many extra turns pile up
+CONTEXT_MAX_TOKENS   = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))   # hard budget for the windowed prompt
+SUMMARY_CACHE_SESSIONS = int(os.getenv("SUMMARY_CACHE_SESSIONS", "2000"))
+
+_enc: Any = None  # tiktoken encoding, loaded on first count (or by the startup prewarm); False if unavailable
+
+def encoder():
+    global _enc
+    if _enc is None:
+        try:
+            _enc = startup.lazy_import("tiktoken").get_encoding(os.getenv("TIKTOKEN_ENCODING", "o200k_base"))
+        except Exception:  # tiktoken missing or encoding unavailable offline
+            _enc = False
+    return _enc
+
+def count_tokens(text: str) -> int:
+    enc = _enc if _enc is not None else encoder()
+    return len(enc.encode(text or "", disallowed_special=())) if enc else (len(text or "") + 3) // 4
+
+def message_tokens(messages: List[Dict[str, Any]]) -> int:
+    # ~4 tokens of chat framing per message, plus 3 to prime the reply
+    return sum(count_tokens(m.get("content") or "") + 4 for m in messages) + 3
+
+Summarizer = Callable[[str, List[Dict[str, str]]], str]
+
+class ContextManager:
+    """Builds token-budgeted prompts and keeps an incrementally updated per-session summary."""
+    def __init__(self, summarize: Summarizer):
+        self.summarize = summarize
+        self._cache: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+        self._folding: set = set()
+        self._lock = threading.Lock()
+        self._totals = {"turns": 0, "fullTokens": 0, "windowedTokens": 0, "folds": 0, "foldErrors": 0}
+
+    def build(self, session_id: str, system_prompt: str, history: List[Dict[str, str]],
+              extra_system: Optional[List[str]] = None) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """Messages to send for this turn, and a {"full", "windowed"} prompt-token report."""
+        head = [{"role": "system", "content": system_prompt}]
+        head += [{"role": "system", "content": x} for x in (extra_system or [])]
+        full = message_tokens(head + history)
+
+        covered, summary = 0, None
+        if len(history) > CONTEXT_KEEP_TURNS:
+            state = self._summary(session_id)
+            # The summary only applies if this history still starts with the turns it folded
+            if state and 0 < state["coveredTurns"] < len(history):
+                last = history[state["coveredTurns"] - 1]
+                if turn_digest(last["role"], last["content"]) == state["coveredDigest"]:
+                    covered, summary = state["coveredTurns"], state["summary"]
+            if len(history) - covered > CONTEXT_KEEP_TURNS + CONTEXT_FOLD_STEP:
+                self._fold_in_background(session_id, history, covered, summary)
+
+        tail = history[covered:]
+        if summary:
+            head.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+        # Over budget: drop the oldest unsummarised turns, but always keep the latest exchange
+        while len(tail) > 2 and message_tokens(head + tail) > CONTEXT_MAX_TOKENS:
+            tail = tail[1:]
+        messages = head + tail
+        report = {"full": full, "windowed": message_tokens(messages)}
+        with self._lock:
+            self._totals["turns"] += 1
+            self._totals["fullTokens"] += report["full"]; self._totals["windowedTokens"] += report["windowed"]
+        return messages, report
+
+    def start(self, session_id: str):
+        """A freshly minted session has no summary; skip the DB lookup."""
+        with self._lock:
+            self._remember(session_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            t = dict(self._totals)
+        t["savedTokens"] = t["fullTokens"] - t["windowedTokens"]
+        t["tokenizer"] = "tiktoken" if _enc else "chars/4"
+        return t
+
+    # ---------- internals ----------
+    def _summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if session_id in self._cache:
+                self._cache.move_to_end(session_id)
+                return self._cache[session_id]
+        state = None
+        if SessionLocal:
+            db = SessionLocal()
+            try:
+                row = db.get(SessionSummary, session_id)
+                if row:
+                    state = {"summary": row.summary, "coveredTurns": row.coveredTurns, "coveredDigest": row.coveredDigest}
+            finally:
+                db.close()
+        with self._lock:
+            self._remember(session_id, state)
+        return state
+
+    def _fold_in_background(self, session_id: str, history: List[Dict[str, str]], covered: int, summary: Optional[str]):
+        with self._lock:
+            if session_id in self._folding:
+                return
+            self._folding.add(session_id)
+        upto = len(history) - CONTEXT_KEEP_TURNS
+        turns = [dict(m) for m in history[covered:upto]]
+        last = history[upto - 1]
+        def run():
+            try:
+                # Only the newly folded turns are sent, together with the previous summary
+                new_summary = self.summarize(summary or "", turns)
+                state = {"summary": new_summary, "coveredTurns": upto, "coveredDigest": turn_digest(last["role"], last["content"])}
+                with self._lock:
+                    self._remember(session_id, state); self._totals["folds"] += 1
+                writer.submit("summary", dict(state, sessionId=session_id, updatedAt=datetime.utcnow()))
+            except Exception:
+                log.exception("context: summarising session %s failed", session_id)
+                with self._lock: self._totals["foldErrors"] += 1
+            finally:
+                with self._lock: self._folding.discard(session_id)
+        threading.Thread(target=run, name="context-fold", daemon=True).start()
+
+    def _remember(self, session_id: str, state: Optional[Dict[str, Any]]):
+        self._cache[session_id] = state
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > SUMMARY_CACHE_SESSIONS:
+            self._cache.popitem(last=False)
@@ -1,10 +1,23 @@
-import os, urllib.parse, json
-from sqlalchemy import create_engine, String, Float, Boolean, Integer, DateTime, Text
+import os, re, sys, urllib.parse, json, logging, tempfile
+from contextlib import contextmanager
+from typing import Optional
+from sqlalchemy import create_engine, inspect, select, text, update, insert, Index, String, Float, Boolean, Integer, DateTime, Text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
 from datetime import datetime
 
 AZURE_SQL_ODBC_CONNSTR = os.getenv("AZURE_SQL_ODBC_CONNSTR")
 AZURE_SQL_SQLALCHEMY_URL = os.getenv("AZURE_SQL_SQLALCHEMY_URL")
+LOCAL_SQLITE_PATH = os.getenv("LOCAL_SQLITE_PATH")  # local stand-in for Azure SQL (tests, benchmarks)
+# Let a worker migrate if the one-time step was skipped; on by default only for the local SQLite stand-in,
+# Azure SQL deployments migrate once in startup.sh
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1" if LOCAL_SQLITE_PATH else "0") == "1"
+DB_MIGRATE_LOCK = os.getenv("DB_MIGRATE_LOCK") or os.path.join(tempfile.gettempdir(), "invest-soul-migrate.lock")
+
+# Bump whenever tables or indexes change; `python -m app.db migrate` brings the database up to it.
+SCHEMA_VERSION = 4  # 2: export keyset indexes; 3: UserSessions.updatedAt; 4: Messages (sessionId, createdAt, id)
+
+log = logging.getLogger("invest-soul.db")
 
 def build_sqlalchemy_url_from_odbc(odbc: str) -> str:
     return f"mssql+pyodbc:///?odbc_connect={urllib.parse.quote_plus(odbc)}"
@@ -13,16 +26,21 @@ if AZURE_SQL_SQLALCHEMY_URL:
     SQLALCHEMY_URL = AZURE_SQL_SQLALCHEMY_URL
 elif AZURE_SQL_ODBC_CONNSTR:
     SQLALCHEMY_URL = build_sqlalchemy_url_from_odbc(AZURE_SQL_ODBC_CONNSTR)
+elif LOCAL_SQLITE_PATH:
+    SQLALCHEMY_URL = f"sqlite:///{LOCAL_SQLITE_PATH}"
 else:
     SQLALCHEMY_URL = None
 
-engine = create_engine(SQLALCHEMY_URL, pool_pre_ping=True, pool_recycle=300) if SQLALCHEMY_URL else None
+_connect_args = {"check_same_thread": False} if (SQLALCHEMY_URL or "").startswith("sqlite") else {}
+engine = create_engine(SQLALCHEMY_URL, pool_pre_ping=True, pool_recycle=300, connect_args=_connect_args) if SQLALCHEMY_URL else None
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False) if engine else None
 
 class Base(DeclarativeBase): pass
 
 class SessionState(Base):
     __tablename__ = "UserSessions"
+    # Export keyset: ORDER BY updatedAt, sessionId (profile fields arrive after the row is created)
+    __table_args__ = (Index("ix_UserSessions_updatedAt_sessionId", "updatedAt", "sessionId"),)
     sessionId: Mapped[str] = mapped_column(String(64), primary_key=True)
     userName: Mapped[str | None] = mapped_column(String(100))
     userEmail: Mapped[str | None] = mapped_column(String(200))
@@ -38,9 +56,14 @@ class SessionState(Base):
     investmentPeriod: Mapped[int | None] = mapped_column(Integer)
     netSurplus: Mapped[float | None] = mapped_column(Float)
     createdAt: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # Set by the writer on insert and on every profile upsert; added in schema 3, backfilled from createdAt
+    updatedAt: Mapped[datetime | None] = mapped_column(DateTime, default=datetime.utcnow, info={"backfill": "createdAt"})
 
 class Portfolio(Base):
     __tablename__ = "Portfolios"
+    # Export keyset: ORDER BY createdAt, id (all rows, or one session's)
+    __table_args__ = (Index("ix_Portfolios_createdAt_id", "createdAt", "id"),
+                      Index("ix_Portfolios_sessionId_createdAt", "sessionId", "createdAt"))
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     sessionId: Mapped[str] = mapped_column(String(64), index=True)
     userName: Mapped[str] = mapped_column(String(100))
@@ -63,12 +86,119 @@ class Portfolio(Base):
 
 class MessageLog(Base):
     __tablename__ = "Messages"
+    # History reads are "WHERE sessionId = ? ORDER BY createdAt, id" (createdAt is stamped when a worker queues the
+    # turn, so it orders turns that different workers flushed out of order); exports page on (createdAt, id),
+    # optionally per session
+    __table_args__ = (Index("ix_Messages_sessionId_createdAt_id", "sessionId", "createdAt", "id"),
+                      Index("ix_Messages_createdAt_id", "createdAt", "id"))
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     sessionId: Mapped[str] = mapped_column(String(64), index=True)
     role: Mapped[str] = mapped_column(String(20))
     content: Mapped[str] = mapped_column(Text)
     createdAt: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
+class SessionSummary(Base):
+    __tablename__ = "SessionSummaries"
+    sessionId: Mapped[str] = mapped_column(String(64), primary_key=True)
+    summary: Mapped[str] = mapped_column(Text)
+    coveredTurns: Mapped[int] = mapped_column(Integer)        # leading turns folded into the summary
+    coveredDigest: Mapped[str] = mapped_column(String(40))    # digest of the last folded turn
+    updatedAt: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class SchemaVersion(Base):
+    __tablename__ = "SchemaVersion"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer)
+    appliedAt: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+_ALREADY_EXISTS = re.compile(r"already exists|already an object named", re.I)
+
+def ensure_columns():
+    """create_all doesn't alter existing tables, so add (nullable) columns declared since then."""
+    insp, quote = inspect(engine), engine.dialect.identifier_preparer.quote
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in have:
+                continue
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {quote(table.name)} ADD {quote(col.name)} {col.type.compile(engine.dialect)} NULL"))
+                if col.info.get("backfill"):
+                    conn.execute(text(f"UPDATE {quote(table.name)} SET {quote(col.name)} = {quote(col.info['backfill'])} "
+                                      f"WHERE {quote(col.name)} IS NULL"))
+            log.info("added column %s.%s", table.name, col.name)
+
+def ensure_indexes():
+    """create_all skips tables that already exist, so add indexes declared since then."""
+    insp = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        have = {ix["name"] for ix in insp.get_indexes(table.name)}
+        for ix in table.indexes:
+            if ix.name not in have:
+                try:
+                    ix.create(engine)
+                except SQLAlchemyError as e:
+                    # Another migrator got there first (SQLite: "already exists", SQL Server: "already an object")
+                    if not _ALREADY_EXISTS.search(str(e)):
+                        log.error("creating index %s on %s failed", ix.name, table.name)
+                        raise
+                    log.info("index %s already exists", ix.name)
+
+def schema_version() -> Optional[int]:
+    try:
+        with engine.connect() as conn:
+            return conn.scalar(select(SchemaVersion.version).where(SchemaVersion.id == 1))
+    except SQLAlchemyError:
+        return None  # no SchemaVersion table yet
+
+@contextmanager
+def migration_lock():
+    """Node-wide exclusive lock, so workers (or a worker and startup.sh) never run create_all side by side."""
+    import fcntl
+    with open(DB_MIGRATE_LOCK, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _apply():
+    Base.metadata.create_all(engine)
+    ensure_columns()
+    ensure_indexes()
+    with engine.begin() as conn:
+        values = {"version": SCHEMA_VERSION, "appliedAt": datetime.utcnow()}
+        if not conn.execute(update(SchemaVersion.__table__).where(SchemaVersion.id == 1).values(**values)).rowcount:
+            conn.execute(insert(SchemaVersion.__table__).values(id=1, **values))
+
+def migrate():
+    """Create missing tables and indexes, then record SCHEMA_VERSION. Safe to re-run."""
+    with migration_lock():
+        _apply()
+
 def init_db():
-    if engine:
-        Base.metadata.create_all(engine)
+    """Per-worker startup: one SELECT of the schema version instead of reflecting every table."""
+    if not engine:
+        return
+    current = schema_version()
+    if current is not None and current >= SCHEMA_VERSION:
+        return
+    if not DB_AUTO_MIGRATE:
+        log.warning("database schema is at %s, expected %d; run `python -m app.db migrate`", current, SCHEMA_VERSION)
+        return
+    with migration_lock():
+        current = schema_version()  # the worker that held the lock before us may have migrated already
+        if current is None or current < SCHEMA_VERSION:
+            _apply()
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        sys.exit("usage: python -m app.db migrate")
+    if not engine:
+        print("no database configured (AZURE_SQL_SQLALCHEMY_URL, AZURE_SQL_ODBC_CONNSTR or LOCAL_SQLITE_PATH); nothing to migrate")
+        sys.exit(0)
+    before = schema_version()
+    migrate()
+    print(f"schema version {before} -> {SCHEMA_VERSION}")
@@ -0,0 +1,234 @@
+import os, io, csv, sys, json, time, logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Boolean, DateTime, Float, Integer, and_, create_engine, or_, select
+from sqlalchemy.engine import Engine
+
+from app.db import engine, SessionState, Portfolio, MessageLog
+
+log = logging.getLogger("invest-soul.export")
+
+EXPORT_API_KEY        = os.getenv("EXPORT_API_KEY")                         # unset: HTTP export disabled (CLI still works)
+EXPORT_SQLALCHEMY_URL = os.getenv("EXPORT_SQLALCHEMY_URL")                  # e.g. a read replica (ApplicationIntent=ReadOnly)
+EXPORT_PAGE_SIZE      = int(os.getenv("EXPORT_PAGE_SIZE", "5000"))          # rows per keyset query
+EXPORT_FETCH_SIZE     = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))         # rows per server-side cursor fetch
+EXPORT_SAFETY_LAG     = float(os.getenv("EXPORT_SAFETY_LAG", "120"))        # seconds; newer rows wait for the next run
+
+# Export name -> model. Tables page on (timestamp, primary key), which the composite indexes in app.db cover.
+TABLES = {"sessions": SessionState, "portfolios": Portfolio, "messages": MessageLog}
+# Append-only tables key on createdAt. Sessions gain profile fields long after they're created, so they key on
+# updatedAt: an incremental run re-exports every session changed since the watermark, and consumers upsert by sessionId.
+KEY_COLUMNS = {"sessions": "updatedAt"}
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+export_engine: Optional[Engine] = (create_engine(EXPORT_SQLALCHEMY_URL, pool_pre_ping=True, pool_recycle=300)
+                                   if EXPORT_SQLALCHEMY_URL else engine)
+
+def _key(name: str) -> Tuple[Any, Any]:
+    table = TABLES[name].__table__
+    return table.c[KEY_COLUMNS.get(name, "createdAt")], next(iter(table.primary_key.columns))
+
+# ---------- Watermarks ----------
+# A watermark is the (timestamp, primary key) of the last exported row, as "2026-01-31T09:30:00.123456|<pk>"
+def encode_watermark(values: Sequence[Any]) -> str:
+    return f"{values[0].isoformat()}|{values[1]}"
+
+def decode_watermark(name: str, token: Optional[str]) -> Optional[Tuple[datetime, Any]]:
+    if not token:
+        return None
+    ts, _, pk = token.partition("|")
+    try:
+        return datetime.fromisoformat(ts), (int(pk) if isinstance(_key(name)[1].type, Integer) else pk)
+    except ValueError:
+        raise ValueError(f"invalid watermark {token!r}")
+
+def _after(cols, values):
+    # (a, b) > (x, y) spelled out: row-value comparison isn't available on SQL Server
+    return or_(cols[0] > values[0], and_(cols[0] == values[0], cols[1] > values[1]))
+
+def _at_most(cols, values):
+    return or_(cols[0] < values[0], and_(cols[0] == values[0], cols[1] <= values[1]))
+
+# ---------- Reading ----------
+class Export:
+    """One export run: rows after `after`, up to the newest row older than the safety lag, fixed at start.
+
+    Pages are short keyset queries (WHERE key > last ORDER BY key LIMIT n) over an index, each streamed
+    through a server-side cursor, so neither the database nor this process ever holds more than a page.
+    """
+    def __init__(self, table: str, after: Optional[str] = None, session_id: Optional[str] = None,
+                 page_size: int = EXPORT_PAGE_SIZE, db: Optional[Engine] = None):
+        if table not in TABLES:
+            raise ValueError(f"unknown table {table!r}; expected one of {', '.join(TABLES)}")
+        self.table, self.model, self.session_id = table, TABLES[table], session_id
+        self.db = db or export_engine
+        if self.db is None:
+            raise RuntimeError("no database configured")
+        self.columns = list(self.model.__table__.columns)
+        self.key = _key(table)
+        self.after = decode_watermark(table, after)
+        self._ts, self._pk = self.columns.index(self.key[0]), self.columns.index(self.key[1])
+        self.page_size, self.rows = page_size, 0
+        self.upto = self._upper_bound()
+
+    @property
+    def names(self) -> List[str]:
+        return [c.name for c in self.columns]
+
+    @property
+    def watermark(self) -> Optional[str]:
+        """Where the next incremental run starts: the upper bound, or the input watermark if nothing was newer."""
+        return encode_watermark(self.upto) if self.upto else (encode_watermark(self.after) if self.after else None)
+
+    def _filtered(self, stmt):
+        if self.session_id is not None:
+            stmt = stmt.where(self.model.__table__.c.sessionId == self.session_id)
+        return stmt
+
+    def _upper_bound(self) -> Optional[Tuple[datetime, Any]]:
+        cutoff = datetime.utcnow() - timedelta(seconds=EXPORT_SAFETY_LAG)
+        stmt = self._filtered(select(*self.key).where(self.key[0] <= cutoff)).order_by(self.key[0].desc(), self.key[1].desc()).limit(1)
+        with self.db.connect() as conn:
+            row = conn.execute(stmt).first()
+        if row is None or (self.after and tuple(row) <= self.after):
+            return None
+        return tuple(row)
+
+    def batches(self) -> Iterator[List[Tuple]]:
+        """Row batches in key order; the connection is held for one page at a time."""
+        if self.upto is None:
+            return
+        last, t0 = self.after, time.perf_counter()
+        while True:
+            stmt = self._filtered(select(*self.columns).where(_at_most(self.key, self.upto)))
+            if last is not None:
+                stmt = stmt.where(_after(self.key, last))
+            stmt = stmt.order_by(*self.key).limit(self.page_size)
+            got = 0
+            with self.db.connect() as conn:
+                result = conn.execution_options(stream_results=True, yield_per=EXPORT_FETCH_SIZE).execute(stmt)
+                for part in result.partitions():
+                    rows = [tuple(r) for r in part]
+                    got += len(rows)
+                    last = (rows[-1][self._ts], rows[-1][self._pk])  # key of the last row read
+                    self.rows += len(rows)
+                    yield rows
+            if got < self.page_size:
+                break
+        log.info("export %s: %d rows in %.1fs, watermark %s", self.table, self.rows, time.perf_counter() - t0, self.watermark)
+
+# ---------- Encoding ----------
+def _jsonable(v: Any) -> Any:
+    return v.isoformat() if isinstance(v, datetime) else v
+
+def stream_ndjson(export: Export) -> Iterator[bytes]:
+    names = export.names
+    for rows in export.batches():
+        yield "".join(json.dumps(dict(zip(names, map(_jsonable, r))), ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+
+def stream_csv(export: Export) -> Iterator[bytes]:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(export.names)
+    for rows in export.batches():
+        w.writerows([[_jsonable(v) for v in r] for r in rows])
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0); buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+class _Drain(io.RawIOBase):
+    """Write-only sink handing bytes back as they are produced; tell() keeps the absolute offset Parquet needs."""
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.pos = 0
+    def writable(self): return True
+    def write(self, b):
+        self.chunks.append(bytes(b)); self.pos += len(b)
+        return len(b)
+    def tell(self): return self.pos
+    def take(self) -> bytes:
+        out = b"".join(self.chunks); self.chunks.clear()
+        return out
+
+def stream_parquet(export: Export) -> Iterator[bytes]:
+    """One row group per page (EXPORT_PAGE_SIZE rows); needs pyarrow (checked by stream())."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    arrow_type = lambda t: (pa.timestamp("us") if isinstance(t, DateTime) else pa.int64() if isinstance(t, Integer)
+                            else pa.float64() if isinstance(t, Float) else pa.bool_() if isinstance(t, Boolean) else pa.string())
+    schema = pa.schema([(c.name, arrow_type(c.type)) for c in export.columns])
+    sink = _Drain()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression="zstd")
+    pending: List[Tuple] = []
+    flush = lambda: writer.write_table(pa.Table.from_pylist([dict(zip(export.names, r)) for r in pending], schema=schema))
+    try:
+        for rows in export.batches():
+            pending.extend(rows)
+            if len(pending) >= export.page_size:
+                flush(); pending.clear()
+                yield sink.take()
+        if pending:
+            flush()
+    finally:
+        writer.close()
+    yield sink.take()
+
+ENCODERS = {"ndjson": stream_ndjson, "csv": stream_csv, "parquet": stream_parquet}
+
+def stream(export: Export, fmt: str) -> Iterator[bytes]:
+    if fmt not in ENCODERS:
+        raise ValueError(f"unknown format {fmt!r}; expected one of {', '.join(ENCODERS)}")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401  (fail before any bytes are sent)
+        except ImportError:
+            raise ValueError("Parquet export requires pyarrow to be installed")
+    return ENCODERS[fmt](export)
+
+# ---------- CLI ----------
+def _load_state(path: Optional[str]) -> Dict[str, str]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_state(path: str, state: Dict[str, str]):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Stream a table export (keyset-paginated, constant memory)")
+    ap.add_argument("table", choices=list(TABLES))
+    ap.add_argument("--format", choices=list(ENCODERS), default="ndjson")
+    ap.add_argument("--out", default="-", help="file path, or - for stdout")
+    ap.add_argument("--after", help="watermark to start after (overrides --state)")
+    ap.add_argument("--state", help="JSON file holding per-table watermarks for incremental runs")
+    ap.add_argument("--session", help="only rows of one sessionId")
+    args = ap.parse_args()
+
+    state = _load_state(args.state)
+    try:
+        export = Export(args.table, after=args.after or state.get(args.table), session_id=args.session)
+        chunks = stream(export, args.format)
+    except (ValueError, RuntimeError) as e:
+        sys.exit(f"export failed: {e}")
+    out = sys.stdout.buffer if args.out == "-" else open(args.out, "wb")
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    # The watermark only moves once the whole run has been written
+    if args.state and not args.session and export.watermark:
+        state[args.table] = export.watermark
+        _save_state(args.state, state)
+    print(f"{export.rows} rows, watermark {export.watermark}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import os, csv, time, threading, logging, unicodedata
+from collections import deque
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+log = logging.getLogger("invest-soul.gazetteer")
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+GAZETTEER_CITIES_PATH    = os.getenv("GAZETTEER_CITIES_PATH") or os.path.join(DATA_DIR, "cities.csv")  # or a GeoNames citiesN.txt dump
+GAZETTEER_COUNTRIES_PATH = os.getenv("GAZETTEER_COUNTRIES_PATH") or os.path.join(DATA_DIR, "countries.csv")
+GAZETTEER_MIN_POPULATION = int(os.getenv("GAZETTEER_MIN_POPULATION", "0"))      # drop small places from large dumps
+GAZETTEER_CACHE_SIZE     = int(os.getenv("GAZETTEER_CACHE_SIZE", "4096"))       # LRU of raw inputs -> resolved place
+GAZETTEER_MAX_EDITS      = int(os.getenv("GAZETTEER_MAX_EDITS", "2"))           # typo tolerance; 0 disables fuzzy
+
+# City names that are also everyday words: only trusted when they are the whole answer, not inside a sentence
+SCAN_STOPWORDS = frozenset({"nice", "reading", "bath", "victoria", "surrey", "hamilton", "richmond", "anand", "puri",
+                            "gaya", "salem", "kota", "rio", "sun city", "york", "derby", "edison", "irving", "madison"})
+SCAN_MIN_CHARS = 3  # "us", "la", "uk" etc. only match as a whole answer
+GEONAMES_MAX_ALIASES = 8
+
+_ABBREVIATIONS = {"st": "saint", "ste": "sainte", "ft": "fort", "mt": "mount"}
+_TRANSLIT = str.maketrans({"ø": "o", "đ": "d", "ð": "d", "ł": "l", "æ": "ae", "œ": "oe", "ı": "i", "þ": "th",
+                           "'": "", "’": "", "`": ""})
+
+def normalize(text: str) -> str:
+    """Accent-, case- and punctuation-insensitive form: "São Paulo" -> "sao paulo", "St. Louis" -> "saint louis"."""
+    t = unicodedata.normalize("NFKD", text or "")
+    t = "".join(c for c in t if not unicodedata.combining(c)).casefold().translate(_TRANSLIT)
+    t = "".join(c if c.isalnum() else " " for c in t)
+    return " ".join(_ABBREVIATIONS.get(w, w) for w in t.split())
+
+# ---------- Data files ----------
+def read_countries(path: str = GAZETTEER_COUNTRIES_PATH) -> Dict[str, Tuple[str, str, str, List[str]]]:
+    """iso2 -> (name, currency code, symbol, aliases)."""
+    with open(path, encoding="utf-8", newline="") as f:
+        return {r["iso2"]: (r["name"], r["currency"], r["symbol"], _split(r.get("aliases")))
+                for r in csv.DictReader(f)}
+
+def read_cities(path: str = GAZETTEER_CITIES_PATH) -> Iterator[Tuple[str, str, int, List[str]]]:
+    """(name, iso2, population, aliases) from the bundled CSV or a tab-separated GeoNames dump."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            for r in csv.DictReader(f):
+                yield r["name"], r["country"], int(r["population"] or 0), _split(r.get("aliases"))
+            return
+        for line in f:  # geonameid, name, asciiname, alternatenames, ..., country code (8), ..., population (14)
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 15:
+                continue
+            aliases = [cols[2]] + [a for a in cols[3].split(",") if a.isascii() and not (a.isupper() and len(a) <= 4)]
+            yield cols[1], cols[8], int(cols[14] or 0), aliases[:GEONAMES_MAX_ALIASES]
+
+def _split(aliases: Optional[str]) -> List[str]:
+    return [a for a in (aliases or "").split("|") if a.strip()]
+
+# ---------- Index ----------
+class Gazetteer:
+    """City/country names compiled once into lookup structures whose cost doesn't grow with the dataset.
+
+    - exact: dict of normalized name/alias -> city ids (most populous first), O(1)
+    - contains: Aho-Corasick automaton over every name, one pass over the input finds all whole-word mentions
+      ("I live in Navi Mumbai, Maharashtra"), independent of how many names are loaded
+    - fuzzy: bounded Levenshtein walk of the same trie for typos ("Bangalor", "Hydrabad")
+    A country mentioned alongside a city disambiguates it ("Hyderabad, Pakistan"); a country alone resolves to
+    the country. Resolved inputs are kept in an LRU.
+    """
+    def __init__(self, cities: Iterable[Tuple[str, str, int, List[str]]],
+                 countries: Dict[str, Tuple[str, str, str, List[str]]], cache_size: int = GAZETTEER_CACHE_SIZE,
+                 min_population: int = GAZETTEER_MIN_POPULATION):
+        t0 = time.perf_counter()
+        self.countries = {iso: (name, currency, symbol) for iso, (name, currency, symbol, _) in countries.items()}
+        self.country_keys: Dict[str, str] = {}
+        for iso, (name, _, _, aliases) in countries.items():
+            for key in {normalize(a) for a in [name] + aliases} - {""}:
+                self.country_keys[key] = iso
+
+        self.city_name: List[str] = []
+        self.city_iso: List[str] = []
+        self.city_pop: List[int] = []
+        self.city_key: List[str] = []
+        self.exact: Dict[str, List[int]] = {}
+        for name, iso, pop, aliases in cities:
+            if pop < min_population:
+                continue
+            cid = len(self.city_name)
+            self.city_name.append(name); self.city_iso.append(iso); self.city_pop.append(pop)
+            self.city_key.append(normalize(name))
+            for key in {normalize(a) for a in [name] + aliases} - {""}:
+                self.exact.setdefault(key, []).append(cid)
+        for ids in self.exact.values():
+            ids.sort(key=lambda i: -self.city_pop[i])
+
+        self._build_automaton(set(self.exact) | set(self.country_keys))
+        self._cached = lru_cache(maxsize=cache_size)(self._lookup)
+        self._lock = threading.Lock()
+        self._stats = {"exact": 0, "alias": 0, "contains": 0, "fuzzy": 0, "country": 0, "miss": 0}
+        self.build_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+    def _build_automaton(self, keys: Iterable[str]):
+        # Trie (goto) + failure links; out[node] lists every key ending at node, including via suffix links
+        goto: List[Dict[str, int]] = [{}]
+        term: List[Optional[str]] = [None]
+        for key in keys:
+            node = 0
+            for ch in key:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto); goto[node][ch] = nxt
+                    goto.append({}); term.append(None)
+                node = nxt
+            term[node] = key
+        fail = [0] * len(goto)
+        out: List[Tuple[str, ...]] = [()] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            out[node] = ((term[node],) if term[node] else ()) + out[fail[node]]
+            for ch, child in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(ch, 0) if node else 0
+                queue.append(child)
+        self._goto, self._term, self._fail, self._out = goto, term, fail, out
+
+    # ---------- Matching ----------
+    def mentions(self, text: str) -> List[Tuple[int, str]]:
+        """(start, key) for every whole-word name in normalized text; one pass, dataset-size independent."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node, hits, last = 0, [], len(text) - 1
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for key in out[node]:
+                start = i - len(key) + 1
+                if (start == 0 or text[start - 1] == " ") and (i == last or text[i + 1] == " "):
+                    hits.append((start, key))
+        return hits
+
+    def fuzzy(self, word: str, max_edits: int) -> List[Tuple[int, str]]:
+        """(distance, key) for keys within max_edits of word: Levenshtein rows carried down the trie, pruned early.
+
+        The walk is bounded by the query, not the dataset: it is anchored on the first letter (the first two when
+        two edits are allowed; typos there are rare), and each row only fills the diagonal band of +-max_edits
+        cells, since anything outside it is already over the limit.
+        """
+        goto, term, found = self._goto, self._term, []
+        n, limit, over = len(word), max_edits, max_edits + 1
+        anchor = word[:2] if max_edits >= 2 and n > 2 else word[:1]
+        node = goto[0].get(anchor[0])
+        if node is None:
+            return []
+        row = list(range(n + 1))  # row for the empty prefix; the anchor letters are walked like any other node
+        stack = [(node, anchor[0], row, 1)]
+        while stack:
+            node, ch, prev, depth = stack.pop()
+            lo, hi = max(1, depth - limit), min(n, depth + limit)
+            row = [depth] + [over] * n
+            for j in range(lo, hi + 1):
+                row[j] = min(row[j - 1] + 1, prev[j] + 1, prev[j - 1] + (word[j - 1] != ch))
+            if term[node] is not None and row[n] <= limit:
+                found.append((row[n], term[node]))
+                limit = row[n]  # only as-good-or-better matches from here on
+            if min(row[lo - 1:hi + 1]) <= limit:
+                if depth < len(anchor):
+                    nxt = goto[node].get(anchor[depth])
+                    if nxt is not None:
+                        stack.append((nxt, anchor[depth], row, depth + 1))
+                else:
+                    stack.extend((c, k, row, depth + 1) for k, c in goto[node].items())
+        return [(d, k) for d, k in found if d <= limit]
+
+    def _best_city(self, key: str, iso: Optional[str] = None) -> Optional[int]:
+        return next((cid for cid in self.exact.get(key, ()) if iso is None or self.city_iso[cid] == iso), None)
+
+    def _lookup(self, query: str) -> Optional[Tuple[int, str, str, int]]:
+        """(city id or -1, iso2, match kind, edit distance) for a raw query."""
+        text = normalize(query)
+        if not text:
+            return None
+        cid = self._best_city(text)
+        if cid is not None:
+            return cid, self.city_iso[cid], "exact" if self.city_key[cid] == text else "alias", 0
+        if text in self.country_keys:
+            return -1, self.country_keys[text], "country", 0
+
+        hits = [(s, k) for s, k in self.mentions(text) if len(k) >= SCAN_MIN_CHARS and k not in SCAN_STOPWORDS]
+        hint = next((self.country_keys[k] for _, k in reversed(hits) if k in self.country_keys), None)
+        best = None
+        for _, key in hits:
+            cid = self._best_city(key, hint)
+            if cid is not None:
+                rank = (len(key), self.city_pop[cid])  # longest mention ("navi mumbai" over "mumbai"), then largest
+                if best is None or rank > best[0]:
+                    best = (rank, cid)
+        if best is not None:
+            return best[1], self.city_iso[best[1]], "contains", 0
+        if hint is not None:
+            return -1, hint, "country", 0
+
+        edits = min(GAZETTEER_MAX_EDITS, 0 if len(text) < 5 else 1 if len(text) < 9 else 2)
+        if edits and len(text.split()) <= 4:
+            matches = self.fuzzy(text, edits)
+            if matches:
+                dist = min(d for d, _ in matches)
+                ranked = [(self.city_pop[cid], cid) for d, k in matches if d == dist
+                          for cid in self.exact.get(k, ())[:1]]
+                if ranked:
+                    cid = max(ranked)[1]
+                    return cid, self.city_iso[cid], "fuzzy", dist
+                iso = next(self.country_keys[k] for d, k in matches if d == dist)
+                return -1, iso, "country", dist
+        return None
+
+    # ---------- API ----------
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Resolve a free-text city (or country) answer; None when nothing plausible matches."""
+        res = self._cached(query or "")
+        with self._lock:
+            self._stats[res[2] if res else "miss"] += 1
+        return self._place(query, res) if res else None
+
+    def lookup_many(self, queries: Iterable[str]) -> List[Optional[Dict[str, Any]]]:
+        """Batch form of lookup; repeated inputs are resolved once."""
+        resolved: Dict[str, Optional[Dict[str, Any]]] = {}
+        out = []
+        for q in queries:
+            if q not in resolved:
+                resolved[q] = self.lookup(q)
+            out.append(resolved[q])
+        return out
+
+    def country_currency(self, city: str) -> Optional[Tuple[str, str]]:
+        """(country, currency symbol) for the intake/allocation paths; None when the place is unknown.
+
+        There is no default country: the caller asks the user instead of filing them under the wrong currency.
+        """
+        place = self.lookup(city)
+        if not place or place["countryCode"] not in self.countries:
+            return None
+        name, _, symbol = self.countries[place["countryCode"]]
+        return name, symbol
+
+    def _place(self, query: str, res: Tuple[int, str, str, int]) -> Dict[str, Any]:
+        cid, iso, kind, dist = res
+        name, currency, symbol = self.countries.get(iso, (iso, None, None))
+        return {"query": query, "city": self.city_name[cid] if cid >= 0 else None, "country": name,
+                "countryCode": iso, "currency": currency, "symbol": symbol, "match": kind, "distance": dist}
+
+    def stats(self) -> Dict[str, Any]:
+        info = self._cached.cache_info()
+        with self._lock:
+            matches = dict(self._stats)
+        return {"cities": len(self.city_name), "countries": len(self.countries), "keys": len(self.exact) + len(self.country_keys),
+                "trieNodes": len(self._goto), "buildMs": self.build_ms, "matches": matches,
+                "cache": {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxSize": info.maxsize}}
+
+    @classmethod
+    def load(cls, cities_path: str = GAZETTEER_CITIES_PATH, countries_path: str = GAZETTEER_COUNTRIES_PATH) -> "Gazetteer":
+        g = cls(read_cities(cities_path), read_countries(countries_path))
+        log.info("gazetteer: %d cities, %d trie nodes compiled in %.0f ms", len(g.city_name), len(g._goto), g.build_ms)
+        return g
+
+_lock = threading.Lock()
+_gazetteer: Optional[Gazetteer] = None
+
+def gazetteer() -> Gazetteer:
+    """The worker's compiled gazetteer; built once, on first use or by the startup prewarm."""
+    global _gazetteer
+    if _gazetteer is None:
+        with _lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer.load()
+    return _gazetteer
+
+def lookup(query: str) -> Optional[Dict[str, Any]]:
+    return gazetteer().lookup(query)
+
+def lookup_many(queries: Iterable[str]) -> List[Optional[Dict[str, Any]]]:
+    return gazetteer().lookup_many(queries)
+
+def country_currency(city: str) -> Optional[Tuple[str, str]]:
+    return gazetteer().country_currency(city)
@@ -0,0 +1,233 @@
+import os, json, time, sqlite3, hashlib, threading, logging
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import select
+
+from app.db import SessionLocal, MessageLog
+from app.profiles import SESSION_CACHE_PATH, SESSION_CACHE_MAX_ENTRIES, SESSION_CACHE_PRUNE_EVERY
+from app.writer import writer
+
+log = logging.getLogger("invest-soul.history")
+
+# Per-worker LRU of recent conversations, used only when the node-local shared tier is disabled (SESSION_CACHE_PATH="")
+HISTORY_CACHE_SESSIONS = int(os.getenv("HISTORY_CACHE_SESSIONS", "2000"))
+# Lifetime of a session's turns in the shared tier, from when they were read from SQL; it does not slide with use,
+# so a node that a session left and came back to rebuilds from SQL instead of diffing against its old copy
+HISTORY_SHARED_TTL     = float(os.getenv("HISTORY_SHARED_TTL", "120"))
+
+_MISS = object()
+
+def turn_digest(role: str, content: str) -> str:
+    return hashlib.sha1(f"{role}\0{content}".encode("utf-8")).hexdigest()
+
+def _unstored(stored: List[Dict[str, str]], messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """The turns of a client-side history that aren't in `stored` yet."""
+    incoming = [turn_digest(m["role"], m["content"]) for m in messages]
+    known = [turn_digest(t["role"], t["content"]) for t in stored]
+    n = len(known)
+    if n <= len(incoming) and incoming[:n] == known:
+        # Common case: the client resends the stored conversation plus new turns at the end
+        return messages[n:]
+    # Client history diverged (edited, trimmed or legacy rows); fall back to content hashes
+    seen = Counter(known); new = []
+    for m, d in zip(messages, incoming):
+        if seen[d]: seen[d] -= 1
+        else: new.append(m)
+    return new
+
+class _SharedTurns:
+    """Stored turns per session in the node's session cache file, so every worker sees the same conversation.
+
+    Changes are read-modify-write under BEGIN IMMEDIATE: two workers handling turns of one session serialise
+    on the file, and the second one dedups against what the first appended. Entries expire `ttl` seconds after
+    they were seeded, however busy the session is.
+    """
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path, self.ttl, self.max_entries = path, ttl, max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._conn() as c:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("CREATE TABLE IF NOT EXISTS session_history (sessionId TEXT PRIMARY KEY, turns TEXT NOT NULL, expires REAL NOT NULL)")
+            c.execute("CREATE INDEX IF NOT EXISTS ix_session_history_expires ON session_history (expires)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        row = self._conn().execute("SELECT turns FROM session_history WHERE sessionId = ? AND expires > ?",
+                                   (session_id, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def transact(self, session_id: str, fn: Callable[[List[Dict[str, str]]], Any], seed: Optional[List[Dict[str, str]]] = None):
+        """Run fn on the stored turns (it may append to them) and save the result atomically.
+
+        Without a stored entry, `seed` stands in for it; with neither, returns _MISS and changes nothing.
+        """
+        c, now = self._conn(), time.time()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            row = c.execute("SELECT turns FROM session_history WHERE sessionId = ? AND expires > ?", (session_id, now)).fetchone()
+            turns = json.loads(row[0]) if row else seed
+            if turns is None:
+                c.execute("ROLLBACK")
+                return _MISS
+            out = fn(turns)
+            if row:
+                c.execute("UPDATE session_history SET turns = ? WHERE sessionId = ?", (json.dumps(turns), session_id))
+            else:
+                c.execute("INSERT OR REPLACE INTO session_history (sessionId, turns, expires) VALUES (?, ?, ?)",
+                          (session_id, json.dumps(turns), now + self.ttl))
+            c.execute("COMMIT")
+        except BaseException:
+            if c.in_transaction:
+                c.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % SESSION_CACHE_PRUNE_EVERY == 0:
+            self.prune()
+        return out
+
+    def prune(self) -> int:
+        c = self._conn()
+        n = c.execute("DELETE FROM session_history WHERE expires <= ?", (time.time(),)).rowcount
+        n += c.execute("DELETE FROM session_history WHERE sessionId IN (SELECT sessionId FROM session_history "
+                       "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+        return n
+
+    def size(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM session_history WHERE expires > ?", (time.time(),)).fetchone()[0]
+
+class ConversationStore:
+    """Stores each conversation turn once, as its own Messages row, and serves it back in order.
+
+    The node-local shared tier holds each session's turns for HISTORY_SHARED_TTL seconds, so a session's turns
+    can move between the node's workers without being recorded twice. SQL is read to seed a session the tier
+    doesn't have (after this session's queued writes land, for at most WRITE_SESSION_WAIT), or for every read
+    when the tier can't be opened.
+    """
+    def __init__(self, max_sessions: int = HISTORY_CACHE_SESSIONS, shared_path: Optional[str] = SESSION_CACHE_PATH):
+        self.max_sessions = max_sessions
+        self._cache: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"sharedHits": 0, "sqlReads": 0, "errors": 0}
+        self.shared: Optional[_SharedTurns] = None
+        if shared_path:
+            try:
+                self.shared = _SharedTurns(shared_path, HISTORY_SHARED_TTL, SESSION_CACHE_MAX_ENTRIES)
+            except sqlite3.Error:
+                log.exception("history: shared turn cache disabled")
+
+    def load(self, session_id: str) -> List[Dict[str, str]]:
+        """Stored turns for a session, oldest first."""
+        if self.shared:
+            try:
+                turns = self.shared.get(session_id)
+                if turns is not None:
+                    self._count("sharedHits")
+                    return turns
+                return self._in_shared(session_id, list)
+            except sqlite3.Error:
+                self._count("errors")
+                return self._read(session_id)
+        with self._lock:
+            turns = self._cache.get(session_id)
+            if turns is not None:
+                self._cache.move_to_end(session_id)
+                return [dict(t) for t in turns]
+        turns = self._read(session_id)
+        with self._lock:
+            # A concurrent record() may have populated the entry meanwhile; keep the longer view
+            if len(self._cache.get(session_id, ())) <= len(turns):
+                self._remember(session_id, turns)
+            return [dict(t) for t in self._cache[session_id]]
+
+    def start(self, session_id: str):
+        """Mark a freshly minted session as empty so its first turn needs no DB read."""
+        if self.shared:
+            try:
+                self.shared.transact(session_id, lambda turns: None, seed=[])
+                return
+            except sqlite3.Error:
+                self._count("errors")
+        with self._lock:
+            self._remember(session_id, [])
+
+    def record(self, session_id: str, role: str, content: str):
+        """Persist one turn and append it to the cached conversation."""
+        turn = {"role": role, "content": content}
+        self._append(session_id, lambda turns: turns.append(turn))
+        writer.submit("message", {"sessionId": session_id, "role": role, "content": content})
+
+    def append_new(self, session_id: str, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Persist only the turns of a client-side history that are not stored yet; returns them."""
+        def take(turns: List[Dict[str, str]]) -> List[Dict[str, str]]:
+            new = _unstored(turns, messages)
+            turns.extend({"role": m["role"], "content": m["content"]} for m in new)
+            return new
+        new = self._append(session_id, take)
+        for m in new:
+            writer.submit("message", {"sessionId": session_id, "role": m["role"], "content": m["content"]})
+        return new
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            st = dict(self._stats, sessions=len(self._cache), turns=sum(len(t) for t in self._cache.values()),
+                      maxSessions=self.max_sessions)
+        st["shared"] = None
+        if self.shared:
+            try:
+                st["shared"] = {"path": self.shared.path, "sessions": self.shared.size()}
+            except sqlite3.Error:
+                st["shared"] = {"path": self.shared.path, "error": True}
+        return st
+
+    def _append(self, session_id: str, fn: Callable[[List[Dict[str, str]]], Any]):
+        # Cache first, SQL second: a seed read from SQL must not already contain the turns being added
+        if self.shared:
+            try:
+                return self._in_shared(session_id, fn)
+            except sqlite3.Error:
+                self._count("errors")
+                return fn(self._read(session_id))
+        turns = self.load(session_id)
+        out = fn(turns)
+        with self._lock:
+            self._remember(session_id, turns)
+        return out
+
+    def _in_shared(self, session_id: str, fn: Callable[[List[Dict[str, str]]], Any]):
+        out = self.shared.transact(session_id, fn)
+        if out is _MISS:
+            out = self.shared.transact(session_id, fn, seed=self._read(session_id))
+        return out
+
+    def _read(self, session_id: str) -> List[Dict[str, str]]:
+        if not SessionLocal:
+            return []
+        writer.wait_session(session_id)  # this worker's queued turns would otherwise be missing from the read
+        self._count("sqlReads")
+        db = SessionLocal()
+        try:
+            # createdAt is stamped at submit time, so turns flushed by different workers still come back in order
+            rows = db.execute(select(MessageLog.role, MessageLog.content)
+                              .where(MessageLog.sessionId == session_id).order_by(MessageLog.createdAt, MessageLog.id))
+            return [{"role": r.role, "content": r.content} for r in rows]
+        finally:
+            db.close()
+
+    def _count(self, key: str):
+        with self._lock: self._stats[key] += 1
+
+    def _remember(self, session_id: str, turns: List[Dict[str, str]]):
+        self._cache[session_id] = turns
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.max_sessions:
+            self._cache.popitem(last=False)
+
+conversations = ConversationStore()
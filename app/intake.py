@@ -0,0 +1,213 @@
+import os, re, math, threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.market_search import CURATED_2026, SECTOR_LABELS, normalize_sector
+
+# Deterministic intake: structured profile answers are parsed locally and the next
+# scripted question is returned without a model round trip.
+INTAKE_FAST_PATH = os.getenv("INTAKE_FAST_PATH", "1") == "1"
+INTAKE_MAX_WORDS = int(os.getenv("INTAKE_MAX_WORDS", "12"))  # longer answers are treated as free text
+
+RISK_LEVELS = {
+    "Conservative": ("conservative", "low", "safe", "cautious", "minimal"),
+    "Moderate":     ("moderate", "medium", "balanced", "average", "mid"),
+    "Aggressive":   ("aggressive", "high", "risky", "growth"),
+}
+GREETINGS = {"hi", "hello", "hey", "hii", "hola", "namaste", "start", "good morning", "good evening", "good afternoon"}
+# Negations and hedges: with any of these in a risk answer, a keyword match can't be trusted
+NEGATIONS = {"not", "no", "never", "dont", "cant", "wont", "nothing", "without", "avoid", "less", "neither", "nor",
+             "hardly", "rather", "instead", "except", "but", "too"}
+NONE_WORDS = {"none", "no", "nil", "zero", "nothing", "na", "n/a", "no debt", "no loans", "no liabilities"}
+NOT_NAMES = {"i", "want", "to", "what", "how", "why", "invest", "investing", "help", "can", "you", "please",
+             "tell", "is", "the", "a", "my", "me", "money", "stocks", "portfolio", "yes", "no", "ok", "okay"}
+
+FILLERS = {"hi", "hii", "hello", "hey", "hola", "namaste", "hmm", "hmmm", "um", "umm", "uh", "er", "sure", "thanks",
+           "thank", "thx", "yeah", "yep", "yup", "nope", "nah", "fine", "good", "great", "cool", "nice", "alright",
+           "right", "there", "morning", "evening", "afternoon", "start", "skip", "later", "sorry", "test", "lol"}
+
+_MULTIPLIERS = {"k": 1e3, "thousand": 1e3, "l": 1e5, "lac": 1e5, "lacs": 1e5, "lakh": 1e5, "lakhs": 1e5,
+                "cr": 1e7, "crore": 1e7, "crores": 1e7, "m": 1e6, "mn": 1e6, "million": 1e6,
+                "b": 1e9, "bn": 1e9, "billion": 1e9}
+_NUMBER = re.compile(r"(\d[\d,]*(?:\.\d+)?)\s*(k|thousand|lakhs?|lacs?|l|crores?|cr|mn|m|million|bn|b|billion)?\b", re.I)
+_PERIOD = re.compile(r"(\d+(?:\.\d+)?)\s*(years?|yrs?|y|months?|mos?)?\b", re.I)
+_NAME_PREFIX = re.compile(r"^(?:hi[,!. ]*|hello[,!. ]*)?(?:my name is|my name's|name is|i am|i'm|im|this is|call me|it's|its)\s+", re.I)
+_CITY_PREFIX = re.compile(r"^(?:i\s+(?:live|stay|am|'m)\s+(?:in|at|from)|i'm\s+(?:in|from)|based in|living in|from|in)\s+", re.I)
+_NAME_LIKE = re.compile(r"^(?=.*[aeiouyà-ÿ])[a-zà-ÿ][a-zà-ÿ'\-]+$", re.I)  # two or more letters, with a vowel
+_WORDS = re.compile(r"^[A-Za-zÀ-ɏ][A-Za-zÀ-ɏ.'\- ]*$")
+
+# ---------- parsers: return the parsed value, or None when the answer is off-script ----------
+def parse_amount(text: str, allow_none: bool = False) -> Optional[float]:
+    t = text.strip().lower().rstrip(".!")
+    if allow_none and t in NONE_WORDS:
+        return 0.0
+    matches = _NUMBER.findall(t)
+    if len(matches) != 1:  # zero or several numbers: let the model disambiguate
+        return None
+    num, unit = matches[0]
+    value = float(num.replace(",", "")) * _MULTIPLIERS.get(unit.lower(), 1)
+    return value if value >= 0 else None
+
+def parse_name(text: str) -> Optional[str]:
+    t = _NAME_PREFIX.sub("", text.strip().rstrip(".!")).strip()
+    words = t.split()
+    if not 1 <= len(words) <= 4 or not _WORDS.match(t) or any(w.lower() in NOT_NAMES | FILLERS for w in words):
+        return None
+    if len(words) == 1 and not _NAME_LIKE.match(t):
+        return None  # "k", "hmm", "xyz": let the model ask again
+    return " ".join(w[:1].upper() + w[1:] for w in words)
+
+def parse_city(text: str) -> Optional[str]:
+    t = _CITY_PREFIX.sub("", text.strip().rstrip(".!")).strip()
+    head = t.split(",")[0].strip()
+    if not 1 <= len(head.split()) <= 4 or not _WORDS.match(head):
+        return None
+    return " ".join(w[:1].upper() + w[1:] for w in head.split())
+
+def parse_risk(text: str) -> Optional[str]:
+    words = re.findall(r"[a-z']+", text.lower())
+    if any(w in NEGATIONS or w.endswith("n't") for w in words):
+        return None  # "not too risky", "nothing aggressive": the model reads these better than a keyword match
+    hits = [w for w in words if any(w in keys for keys in RISK_LEVELS.values())]
+    if len(hits) != 1:
+        return None  # "low to medium", "high growth": ranges and doubled terms go to the model too
+    return next(level for level, keys in RISK_LEVELS.items() if hits[0] in keys)
+
+def parse_sector(text: str) -> Optional[str]:
+    t = re.sub(r"^(?:i (?:prefer|like|want)|prefer|probably|maybe)\s+", "", text.strip().lower().rstrip(".!"))
+    t = re.sub(r"\s+(?:sector|stocks|industry)$", "", t)
+    key = normalize_sector(t)
+    return SECTOR_LABELS.get(key) if key in CURATED_2026 else None
+
+def parse_goals(text: str) -> Optional[str]:
+    t = text.strip()
+    return t if len(t) >= 3 and not t.endswith("?") else None
+
+def parse_period(text: str) -> Optional[int]:
+    matches = _PERIOD.findall(text.lower())
+    if len(matches) != 1:
+        return None
+    num, unit = matches[0]
+    value = float(num)
+    years = math.ceil(value / 12) if unit.startswith("mo") else value
+    return int(round(years)) if 0 < years <= 60 else None
+
+# ---------- script ----------
+# (field, parser, words that show the last assistant turn asked for it)
+STEPS: List[Tuple[str, Callable[[str], Any], Tuple[str, ...]]] = [
+    ("userName",         parse_name,                          ("name",)),
+    ("userCity",         parse_city,                          ("city", "where")),
+    ("cashInflow",       parse_amount,                        ("inflow", "income", "earn")),
+    ("cashOutflow",      lambda t: parse_amount(t, True),     ("outflow", "expense", "spend")),
+    ("liabilities",      lambda t: parse_amount(t, True),     ("liabilit", "debt", "loan", "emi")),
+    ("riskAppetite",     parse_risk,                          ("risk",)),
+    ("preferredSector",  parse_sector,                        ("sector",)),
+    ("futureGoals",      parse_goals,                         ("goal",)),
+    ("investmentPeriod", parse_period,                        ("period", "horizon", "how long", "years")),
+]
+
+def question_for(field: str, p: Dict[str, Any]) -> str:
+    name, cur = p.get("userName") or "", p.get("currency") or ""
+    return {
+        "userName": "Hello, and welcome! I'm Innoviya, your financial consultant. "
+                    "I'll ask a few quick questions to build your investment roadmap. May I have your name?",
+        "userCity": f"Lovely to meet you, {name}! Which city are you based in?",
+        "cashInflow": f"Thank you. What is your total monthly cash inflow (income) in {cur}?",
+        "cashOutflow": "Got it. And what are your average monthly expenses (cash outflow)?",
+        "liabilities": "Do you have any outstanding liabilities such as loans, EMIs or credit card debt? "
+                       "Please share the total amount, or 0 if none.",
+        "riskAppetite": "How would you describe your risk appetite: Conservative, Moderate or Aggressive?",
+        "preferredSector": "Which sector would you most like to invest in: Tech, Finance, Energy, Healthcare or Consumer Goods?",
+        "futureGoals": "Great choice. Your future goals shape how we balance growth and safety, for example buying a home, "
+                       "your children's education, or retirement. What are your main financial goals?",
+        "investmentPeriod": "Thank you for sharing that. Finally, for how many years would you like to stay invested?",
+    }[field]
+
+def profile_summary(p: Dict[str, Any]) -> Optional[str]:
+    """System note telling the model which intake answers are already on file."""
+    known = {f: p.get(f) for f, _, _ in STEPS if p.get(f) is not None}
+    if not known:
+        return None
+    for f in ("userCountry", "currency", "netSurplus"):
+        if p.get(f) is not None: known[f] = p[f]
+    lines = "\n".join(f"- {k}: {v}" for k, v in known.items())
+    return f"Intake answers already collected (do not ask for these again):\n{lines}"
+
+class IntakeMachine:
+    def __init__(self, infer_country_currency: Callable[[str], Optional[Tuple[str, str]]]):
+        self.infer = infer_country_currency
+        self._lock = threading.Lock()
+        self._stats = {"fastPath": 0, "fallback": 0, "greetings": 0}
+
+    def next_field(self, p: Dict[str, Any]) -> Optional[str]:
+        return next((f for f, _, _ in STEPS if p.get(f) is None), None)
+
+    def asked_field(self, history: List[Dict[str, str]]) -> Optional[str]:
+        """The first step whose cue words appear in the latest assistant turn, if any."""
+        last = next((m["content"].lower() for m in reversed(history) if m["role"] == "assistant"), None)
+        if last is None:
+            return None
+        return next((f for f, _, cues in STEPS if any(c in last for c in cues)), None)
+
+    def stale(self, history: List[Dict[str, str]], profile: Dict[str, Any]) -> bool:
+        """True when the last question is for a later step than this profile's next one: the earlier answer
+        was recorded somewhere this copy hasn't seen (another worker whose cache isn't shared)."""
+        field, asked = self.next_field(profile), self.asked_field(history[:-1])
+        order = [f for f, _, _ in STEPS]
+        return field is not None and asked is not None and order.index(asked) > order.index(field)
+
+    def handle(self, history: List[Dict[str, str]], profile: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Returns (scripted reply or None to defer to the model, profile fields parsed this turn)."""
+        if not INTAKE_FAST_PATH or not history or history[-1]["role"] != "user":
+            return None, {}
+        answer = history[-1]["content"].strip()
+        field = self.next_field(profile)
+        last_asked = next((m["content"].lower() for m in reversed(history[:-1]) if m["role"] == "assistant"), None)
+
+        if last_asked is None:
+            # Opening turn: a bare greeting gets the scripted welcome
+            if field == "userName" and answer.lower().strip(" !.") in GREETINGS:
+                self._count("greetings")
+                return question_for("userName", profile), {}
+            return self._fallback()
+        if field is None or "?" in answer or (len(answer.split()) > INTAKE_MAX_WORDS and field != "futureGoals"):
+            return self._fallback()
+        _, parser, cues = next(s for s in STEPS if s[0] == field)
+        if not any(c in last_asked for c in cues):
+            return self._fallback()  # the model went off-script; don't guess which question this answers
+        value = parser(answer)
+        if value is None:
+            return self._fallback()
+
+        fields: Dict[str, Any] = {field: value}
+        if field == "userCity":
+            place = self.infer(value)
+            if place is None:
+                # Not a place we know ("not sure yet" parses as a city too): store nothing and let the model
+                # handle the turn, so the summary never tells it not to ask again
+                return self._fallback()
+            fields["userCountry"], fields["currency"] = place
+        if field == "cashOutflow" and profile.get("cashInflow") is not None:
+            fields["netSurplus"] = round(profile["cashInflow"] - value, 2)
+        if field == "preferredSector":
+            # The market step comes before goals: the same control reply the prompt has the model produce
+            self._count("fastPath")
+            return f"#fetch-top-stocks: {value}", fields
+        merged = dict(profile, **fields)
+        nxt = self.next_field(merged)
+        if nxt is None:
+            # Profile complete: the roadmap itself is the model's job
+            self._count("fallback")
+            return None, fields
+        self._count("fastPath")
+        return question_for(nxt, merged), fields
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _fallback(self):
+        self._count("fallback")
+        return None, {}
+
+    def _count(self, key: str):
+        with self._lock: self._stats[key] += 1
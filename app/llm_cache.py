@@ -0,0 +1,125 @@
+import os, json, time, sqlite3, hashlib, threading, logging
+from typing import Any, Dict, List, Optional
+
+from app.cache import RefreshAheadCache
+
+log = logging.getLogger("invest-soul.llm_cache")
+
+# Replays completions for identical low-temperature, tool-free turns (greeting, common intake answers).
+LLM_CACHE_ENABLED         = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.3"))
+LLM_CACHE_TTL             = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_ENTRIES     = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+LLM_CACHE_SQLITE_PATH     = os.getenv("LLM_CACHE_SQLITE_PATH")  # shared by all gunicorn workers on the node
+LLM_CACHE_PRUNE_EVERY     = int(os.getenv("LLM_CACHE_PRUNE_EVERY", "200"))  # disk puts between pruning passes
+
+def normalize(text: str) -> str:
+    return " ".join((text or "").lower().split()).strip(" .!")
+
+class _DiskTier:
+    """SQLite key/value table with expiry; WAL lets every worker on the node read while one writes."""
+    def __init__(self, path: str, max_entries: int):
+        self.path, self.max_entries = path, max_entries
+        self._local = threading.local()
+        self._puts = 0
+        with self._conn() as c:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+            c.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_expires ON llm_cache (expires)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT value, expires FROM llm_cache WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        return (json.loads(row[0]), row[1] - time.time()) if row else None
+
+    def put(self, key: str, value: Dict[str, Any], ttl: float):
+        c = self._conn()
+        c.execute("INSERT OR REPLACE INTO llm_cache (key, value, expires) VALUES (?, ?, ?)", (key, json.dumps(value), time.time() + ttl))
+        self._puts += 1
+        if self._puts % LLM_CACHE_PRUNE_EVERY == 0:
+            c.execute("DELETE FROM llm_cache WHERE expires <= ?", (time.time(),))
+            c.execute("DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def clear(self) -> int:
+        return self._conn().execute("DELETE FROM llm_cache").rowcount
+
+class LLMResponseCache:
+    def __init__(self):
+        self.memory = RefreshAheadCache("llm-response", ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES)
+        self.disk: Optional[_DiskTier] = None
+        if LLM_CACHE_SQLITE_PATH:
+            try:
+                self.disk = _DiskTier(LLM_CACHE_SQLITE_PATH, LLM_CACHE_MAX_ENTRIES)
+            except sqlite3.Error:
+                log.exception("llm cache: shared SQLite tier disabled")
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "memoryHits": 0, "diskHits": 0, "misses": 0, "stores": 0, "ineligible": 0, "errors": 0}
+
+    def key_for(self, messages: List[Dict[str, Any]], temperature: float, max_tokens: int, deployment: str,
+                prompt_version: str) -> Optional[str]:
+        """Cache key, or None when this turn must not be served from cache (temperature too high)."""
+        if not LLM_CACHE_ENABLED or temperature > LLM_CACHE_MAX_TEMPERATURE:
+            with self._lock: self._stats["ineligible"] += 1
+            return None
+        # The system prompt itself is covered by prompt_version; everything after it is normalised
+        body = [(m["role"], normalize(m.get("content") or "")) for m in messages[1:]]
+        raw = json.dumps([prompt_version, deployment, round(temperature, 3), max_tokens, body], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if key is None:
+            return None
+        with self._lock: self._stats["lookups"] += 1
+        value = self.memory.peek(key)
+        if value is not None:
+            with self._lock: self._stats["memoryHits"] += 1
+            return value
+        if self.disk:
+            try:
+                hit = self.disk.get(key)
+            except sqlite3.Error:
+                hit = None
+                with self._lock: self._stats["errors"] += 1
+            if hit:
+                value, remaining = hit
+                self.memory.put(key, value, ttl=remaining)
+                with self._lock: self._stats["diskHits"] += 1
+                return value
+        with self._lock: self._stats["misses"] += 1
+        return None
+
+    def put(self, key: Optional[str], content: Optional[str], finish_reason: Optional[str]):
+        """Store a tool-free completion; callers skip responses that requested tools."""
+        if key is None or not content:
+            return
+        value = {"content": content, "finish_reason": finish_reason}
+        self.memory.put(key, value)
+        if self.disk:
+            try:
+                self.disk.put(key, value, LLM_CACHE_TTL)
+            except sqlite3.Error:
+                with self._lock: self._stats["errors"] += 1
+        with self._lock: self._stats["stores"] += 1
+
+    def clear(self) -> int:
+        n = self.memory.invalidate()
+        if self.disk:
+            n += self.disk.clear()
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            st = dict(self._stats)
+        hits = st["memoryHits"] + st["diskHits"]
+        st["hitRate"] = round(hits / st["lookups"], 4) if st["lookups"] else None
+        st["memory"] = self.memory.stats()
+        st["shared"] = bool(self.disk)
+        return st
+
+llm_cache = LLMResponseCache()
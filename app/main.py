@@ -1,17 +1,39 @@
-import os, json, uuid, math, tempfile
-from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Request
+import os, json, uuid, hmac, time, asyncio, logging
+from typing import TYPE_CHECKING, List, Optional, Dict, Any, Literal
+from app import startup as boot  # first, so the startup report covers every import below
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse, HTMLResponse, Response
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
 
 from pydantic import BaseModel
-from openai import AzureOpenAI
-import requests
-import azure.cognitiveservices.speech as speechsdk
-
-from app.prompts import INNOVIYA_SYSTEM_PROMPT
-from app.db import init_db, SessionLocal, SessionState, MessageLog, Portfolio
-from app.market_search import search_top5, curated_four
+from sqlalchemy import text
+import httpx
+
+from app.prompts import INNOVIYA_SYSTEM_PROMPT, INNOVIYA_PROMPT_VERSION
+from app.db import init_db, engine
+from app.market_search import cached_top5, curated_four, normalize_sector, sector_cache, search_client, search_all
+from app.market_snapshot import snapshots, write_snapshot, MARKET_SNAPSHOT_DIR
+from app import clients
+from app.cache import RefreshAheadCache
+from app.writer import writer
+from app.history import conversations
+from app.context import ContextManager, count_tokens, encoder
+from app.profiles import profiles
+from app.intake import IntakeMachine, profile_summary
+from app.allocation import build_roadmap
+from app import stt as stt_engine
+from app import gazetteer
+from app.llm_cache import llm_cache
+from app.admission import admission, Rejected
+from app.tools import tools, followup_max_tokens, TOOL_MAX_DEPTH
+from app import export
+from app import metrics
+from app.metrics import stage
+
+if TYPE_CHECKING:  # the SDK is imported on first use, see aoai_client()
+    from openai import AzureOpenAI, AsyncAzureOpenAI
 
 # ---------- ENV ----------
 AZURE_OPENAI_ENDPOINT    = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -21,8 +43,24 @@ AZURE_OPENAI_DEPLOYMENT  = os.getenv("AZURE_OPENAI_DEPLOYMENT")  # chat deployme
 
 SPEECH_KEY    = os.getenv("SPEECH_KEY")
 SPEECH_REGION = os.getenv("SPEECH_REGION", "eastus2")  # Browser token region
+# Overridable so benchmarks and local runs can point at stand-ins
+SPEECH_TOKEN_URL = os.getenv("SPEECH_TOKEN_URL") or f"https://{SPEECH_REGION}.api.cognitive.microsoft.com/sts/v1.0/issueToken"
+SPEECH_RELAY_URL = os.getenv("SPEECH_RELAY_URL") or f"https://{SPEECH_REGION}.tts.speech.microsoft.com/cognitiveservices/avatar/relay/token/v1"
+
+# STS tokens live ~10 min; cache for 9 and start refreshing at 80% of that.
+SPEECH_TOKEN_LIFETIME     = int(os.getenv("SPEECH_TOKEN_LIFETIME", "600"))
+SPEECH_TOKEN_CACHE_TTL    = int(os.getenv("SPEECH_TOKEN_CACHE_TTL", "540"))
+RELAY_TOKEN_CACHE_MAX     = int(os.getenv("RELAY_TOKEN_CACHE_MAX", "3600"))
+RELAY_TOKEN_MIN_REMAINING = int(os.getenv("RELAY_TOKEN_MIN_REMAINING", "900"))
+TOKEN_REFRESH_AHEAD       = float(os.getenv("TOKEN_REFRESH_AHEAD", "0.8"))
+
+GEO_LOOKUP_MAX = int(os.getenv("GEO_LOOKUP_MAX", "5000"))  # cities per /geo/lookup call
+MARKET_TOP_MAX = int(os.getenv("MARKET_TOP_MAX", "20"))    # largest ?limit= on /market/top-stocks
 
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:5173,http://localhost:3000")
+ADMIN_API_KEY   = os.getenv("ADMIN_API_KEY")  # unset: admin-only endpoints answer 404
+
+log = logging.getLogger("invest-soul")
 
 app = FastAPI(title="invest-soul (Innoviya) API", version="1.0.0")
 app.add_middleware(
@@ -32,83 +70,130 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Shed load with a real 429 instead of letting turns queue behind the gunicorn timeout
+@app.exception_handler(Rejected)
+def admission_rejected(request: Request, exc: Rejected):
+    return JSONResponse({"detail": "Too many requests, please retry shortly.", "reason": exc.reason},
+                        status_code=429, headers={"Retry-After": str(exc.retry_after)})
+
+metrics.gauge("invest_soul_admission_active", "Chat turns holding an admission slot.", lambda: admission.active)
+metrics.gauge("invest_soul_admission_waiting", "Chat turns queued for a slot.", lambda: admission.queued)
+metrics.gauge("invest_soul_write_queue_depth", "Rows waiting in the write-behind queue.", lambda: writer.stats()["queueDepth"])
+metrics.gauge("invest_soul_llm_cache_hit_rate", "Completion cache hit rate.", lambda: llm_cache.stats()["hitRate"])
+
+boot.mark("imports")
 
 @app.on_event("startup")
 def startup():
-    init_db()
+    init_db()  # a version check; the schema itself is migrated once by startup.sh
+    writer.start()
+    boot.ready()
+    # Pay for the chat-path SDKs off the request path; the Speech SDK stays deferred until /stt
+    boot.prewarm([lambda: boot.lazy_import("openai"), lambda: boot.lazy_import("requests"), encoder,
+                  gazetteer.gazetteer, snapshots.current])
+
+@app.on_event("shutdown")
+async def shutdown():
+    await run_in_threadpool(writer.stop)
+    await clients.aclose_all()
 
 # ---------- Helpers ----------
-def aoai_client() -> AzureOpenAI:
+def require_admin(request: Request):
+    """Operations that spawn processes or change server state need X-Admin-Key (compared in constant time)."""
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="Admin endpoints are not enabled")
+    if not hmac.compare_digest(request.headers.get("x-admin-key", ""), ADMIN_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+def aoai_client() -> "AzureOpenAI":
     # Azure endpoint pattern with OpenAI SDK is the recommended approach for Azure OpenAI. [4](https://learn.microsoft.com/en-us/samples/azure/azure-sdk-for-python/openai-samples/)
     if not (AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY and AZURE_OPENAI_DEPLOYMENT):
         raise HTTPException(500, "Azure OpenAI is not configured.")
-    return AzureOpenAI(api_key=AZURE_OPENAI_API_KEY, api_version=AZURE_OPENAI_API_VERSION, azure_endpoint=AZURE_OPENAI_ENDPOINT)
+    return clients.get_client("aoai", lambda: boot.lazy_import("openai").AzureOpenAI(
+        api_key=AZURE_OPENAI_API_KEY, api_version=AZURE_OPENAI_API_VERSION, azure_endpoint=AZURE_OPENAI_ENDPOINT,
+        max_retries=0,  # 429s are retried by app.admission, which honours retry-after
+        http_client=httpx.Client(limits=clients.httpx_limits(), timeout=clients.httpx_timeout(),
+                                 event_hooks=clients.httpx_hooks("aoai"))))
+
+def aoai_async_client() -> "AsyncAzureOpenAI":
+    # Async twin of aoai_client() for the streaming route; keeps the event loop free while tokens arrive.
+    if not (AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY and AZURE_OPENAI_DEPLOYMENT):
+        raise HTTPException(500, "Azure OpenAI is not configured.")
+    return clients.get_client("aoai_async", lambda: boot.lazy_import("openai").AsyncAzureOpenAI(
+        api_key=AZURE_OPENAI_API_KEY, api_version=AZURE_OPENAI_API_VERSION, azure_endpoint=AZURE_OPENAI_ENDPOINT,
+        max_retries=0,  # 429s are retried by app.admission, which honours retry-after
+        http_client=httpx.AsyncClient(limits=clients.httpx_limits(), timeout=clients.httpx_timeout(),
+                                      event_hooks=clients.httpx_hooks("aoai", is_async=True))))
 
+@stage("session")
 def ensure_session(session_id: Optional[str]) -> str:
     sid = session_id or uuid.uuid4().hex
-    db = SessionLocal()
-    try:
-        s = db.get(SessionState, sid)
-        if not s:
-            s = SessionState(sessionId=sid)
-            db.add(s); db.commit()
-        return sid
-    finally:
-        db.close()
+    if not session_id:
+        conversations.start(sid); context_mgr.start(sid)
+    # Known sessions (node-wide, see SESSION_CACHE_PATH) skip even the queued insert-if-missing
+    profiles.ensure(sid, new=not session_id)
+    return sid
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a financial-advisory intake conversation. "
+    "Merge the new turns into the existing summary. Keep every stated fact (name, city, amounts, "
+    "risk appetite, sector, goals, period, decisions) and drop pleasantries. Reply with the summary only."
+)
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
 
-def save_message(session_id: str, role: str, content: str):
-    db = SessionLocal()
-    try:
-        db.add(MessageLog(sessionId=session_id, role=role, content=content)); db.commit()
-    finally:
-        db.close()
-
-def infer_country_currency(city: str) -> tuple[str, str]:
-    # Lightweight heuristic; extend via Azure Maps/AI Search if needed.
-    city_l = (city or "").lower()
-    if any(k in city_l for k in ["mumbai","delhi","bangalore","bengaluru","hyderabad","chennai","pune","kolkata"]):
-        return "India", "₹"
-    if any(k in city_l for k in ["new york","san francisco","austin","seattle","chicago","los angeles"]):
-        return "United States", "$"
-    if any(k in city_l for k in ["london","manchester"]):
-        return "United Kingdom", "£"
-    if any(k in city_l for k in ["paris","lyon","berlin","madrid","rome"]):
-        return "European Union", "€"
-    return "United States", "$"
-
-def calc_allocation(risk: str, liabilities: float, period_years: int, net_surplus: float):
-    risk_l = (risk or "").lower()
-    # Asset allocation
-    if risk_l.startswith("aggr"):
-        equity_pct, savings_pct = 85, 15
-    elif risk_l.startswith("mod"):
-        equity_pct, savings_pct = 60, 40
-    else:
-        equity_pct, savings_pct = 30, 70
-    funds_equity = round(net_surplus * (equity_pct/100.0), 2)
-    funds_saving = round(net_surplus - funds_equity, 2)
-
-    # Equity split defaults
-    ds, mf, debt = 50, 30, 20
-
-    # Overrides
-    low_liab = (liabilities or 0) <= (0.2 * net_surplus if net_surplus>0 else 0)
-    med_liab = (liabilities or 0) > (0.2 * net_surplus) and (liabilities or 0) <= (0.5 * net_surplus)
-    if risk_l.startswith("aggr") and low_liab:
-        ds, mf, debt = 70, 20, 10
-    elif risk_l.startswith("mod") or med_liab:
-        ds, mf, debt = 50, 30, 20
-    if risk_l.startswith("cons") or (period_years or 0) < 2:
-        ds, mf, debt = 30, 40, 30
-
-    return {
-        "equity_pct": equity_pct, "savings_pct": savings_pct,
-        "funds_equity": funds_equity, "funds_saving": funds_saving,
-        "eq_split": {"direct_stocks": ds, "mutual_funds": mf, "debt": debt}
-    }
+def summarize_turns(previous: str, turns: List[Dict[str, str]]) -> str:
+    transcript = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+    resp = admission.call(aoai_client().chat.completions.create,
+        model=AZURE_OPENAI_DEPLOYMENT,
+        messages=[{"role": "system", "content": SUMMARY_PROMPT},
+                  {"role": "user", "content": f"Existing summary:\n{previous or '(none)'}\n\nNew turns:\n{transcript}"}],
+        temperature=0,
+        max_tokens=SUMMARY_MAX_TOKENS
+    )
+    # Background folds don't queue for a chat slot, but they do spend the same quota
+    admission.charge(resp.usage.total_tokens if resp.usage else SUMMARY_MAX_TOKENS)
+    return (resp.choices[0].message.content or "").strip()
+
+context_mgr = ContextManager(summarize_turns)
 
-def format_currency(amount: float, symbol: str) -> str:
-    return f"{symbol}{amount:,.2f}"
+@stage("save_message")
+def save_message(session_id: str, role: str, content: str):
+    conversations.record(session_id, role, content)
+
+@stage("history")
+def conversation_for(req: "ChatRequest", session_id: str) -> List[Dict[str, str]]:
+    """Persist only the new turns of this request and return the full conversation for the model."""
+    incoming = [m.model_dump() for m in req.messages]
+    if req.history == "server":
+        # Client sends only its latest message(s); context is rebuilt from Messages
+        prior = conversations.load(session_id)
+        for m in incoming:
+            conversations.record(session_id, m["role"], m["content"])
+        return prior + incoming
+    conversations.append_new(session_id, incoming)
+    return incoming
+
+# City answers resolve through the compiled gazetteer (exact, alias, in-sentence and typo matches)
+intake = IntakeMachine(gazetteer.country_currency)
+
+@stage("intake")
+def intake_turn(session_id: str, history: List[Dict[str, str]]) -> tuple[Optional[str], Dict[str, Any]]:
+    """Run the deterministic intake step; returns (scripted reply or None, current profile)."""
+    profile = profiles.get(session_id)
+    if intake.stale(history, profile):
+        profile = profiles.get(session_id, fresh=True)
+    reply, fields = intake.handle(history, profile)
+    if fields:
+        profiles.update(session_id, fields); profile.update(fields)
+    if reply is not None:
+        save_message(session_id, "assistant", reply)
+    return reply, profile
+
+def profile_notes(profile: Dict[str, Any]) -> List[str]:
+    note = profile_summary(profile)
+    return [note] if note else []
 
 # ---------- Models ----------
 class ChatMessage(BaseModel):
@@ -120,210 +205,604 @@ class ChatRequest(BaseModel):
     temperature: float = 0.3
     max_tokens: int = 800
     sessionId: Optional[str] = None
+    history: Literal["client", "server"] = "client"  # "server": send only the latest message
 
 class ChatResponse(BaseModel):
     content: str
     sessionId: str
     finish_reason: Optional[str] = None
+    promptTokens: Optional[Dict[str, int]] = None  # {"full": ..., "windowed": ...} for this turn
 
 # ---------- Routes ----------
 @app.get("/", tags=["meta"])
 def root():
     return {"message": "Innoviya API (invest-soul)"}
 
+# SQL is probed on every call; paid upstreams are probed at most once per HEALTH_PROBE_TTL per worker
+HEALTH_PROBE_TTL = float(os.getenv("HEALTH_PROBE_TTL", "30"))
+health_probe_cache = RefreshAheadCache("health-probes", ttl=HEALTH_PROBE_TTL, max_entries=8)
+
+def timed_probe(fn) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    try:
+        fn()
+        return {"ok": True, "ms": round((time.perf_counter() - t0) * 1000, 1), "checkedAt": time.time()}
+    except Exception as e:
+        return {"ok": False, "ms": round((time.perf_counter() - t0) * 1000, 1), "checkedAt": time.time(), "error": str(e)[:200]}
+
+def probe_sql():
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+def probe_speech():
+    # A real STS round trip; the fresh token also refreshes the shared browser token
+    speech_token_cache.put("sts", _issue_speech_token())
+
 @app.get("/health", tags=["meta"])
 def health():
-    return {
-        "status": "healthy",
-        "deps": {
-            "aoai": bool(AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY and AZURE_OPENAI_DEPLOYMENT),
-            "speech": bool(SPEECH_KEY and SPEECH_REGION),
-            "sql": True,
-            "search": bool(os.getenv("AZURE_SEARCH_ENDPOINT"))
-        }
+    probes = {
+        "sql": (bool(engine), probe_sql, False),
+        "aoai": (bool(AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY and AZURE_OPENAI_DEPLOYMENT), lambda: aoai_client().models.list(), True),
+        "speech": (bool(SPEECH_KEY and SPEECH_REGION), probe_speech, True),
+        "search": (bool(os.getenv("AZURE_SEARCH_ENDPOINT")), lambda: search_client().get_document_count(), True),
     }
+    deps = {}
+    for name, (configured, fn, cached) in probes.items():
+        if not configured:
+            deps[name] = {"configured": False}
+        elif cached:
+            deps[name] = dict(health_probe_cache.get(name, lambda fn=fn: timed_probe(fn)), configured=True)
+        else:
+            deps[name] = dict(timed_probe(fn), configured=True)
+    ok = all(d.get("ok", True) for d in deps.values())
+    return {"status": "healthy" if ok else "degraded", "deps": deps}
 @app.get("/healthy")
 def health_check():
     return { "status":"healthy"}
 
+# Prometheus text exposition for this worker
+@app.get("/metrics", tags=["meta"])
+def prometheus_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Sampled cProfile runs (PROFILE_SAMPLE_PCT), newest last
+@app.get("/debug/profiles", tags=["meta"])
+def debug_profiles():
+    return metrics.profiles()
+
+# Worker cold start: phases since import, deferred SDK imports, and optionally a fresh -X importtime breakdown
+# (that one spawns an interpreter, so it needs the admin key)
+@app.get("/debug/startup", tags=["meta"])
+def debug_startup(request: Request, importtime: bool = False, top: int = 25):
+    report = boot.report()
+    if importtime:
+        require_admin(request)
+        report["importTime"] = boot.import_breakdown(top=max(1, min(top, 200)))
+    return report
+
+# Upstream client registry: reuse (hit) vs construction (miss) counts per pooled client
+@app.get("/debug/clients", tags=["meta"])
+def debug_clients():
+    return clients.stats()
+
+# Prompt tokens before/after windowing, summed over all turns served by this worker
+@app.get("/debug/context", tags=["meta"])
+def debug_context():
+    return context_mgr.stats()
+
+# Admission queue, quota buckets and upstream 429 retries for this worker
+@app.get("/debug/admission", tags=["meta"])
+def debug_admission():
+    return admission.stats()
+
+# Completion cache hit rate (memory + shared SQLite tier)
+@app.get("/debug/llm-cache", tags=["meta"])
+def debug_llm_cache():
+    return llm_cache.stats()
+
+@app.post("/debug/llm-cache/clear", tags=["meta"])
+def debug_llm_cache_clear(request: Request):
+    require_admin(request)
+    return {"cleared": llm_cache.clear()}
+
+# Gazetteer size, build time, match kinds and LRU hit rate
+@app.get("/debug/gazetteer", tags=["meta"])
+def debug_gazetteer():
+    return gazetteer.gazetteer().stats()
+
+# Session-state cache: shared/worker hits, SQL reads on a cold miss, sessions that skipped the insert
+@app.get("/debug/session-cache", tags=["meta"])
+def debug_session_cache():
+    return profiles.stats()
+
+# Tool calls, concurrent batches, invalid arguments
+@app.get("/debug/tools", tags=["meta"])
+def debug_tools():
+    return tools.stats()
+
+# Intake turns answered locally vs deferred to the model
+@app.get("/debug/intake", tags=["meta"])
+def debug_intake():
+    return intake.stats()
+
+# Write-behind queue depth, batch counts and flush lag (enqueue -> commit)
+@app.get("/debug/writer", tags=["meta"])
+def debug_writer():
+    return writer.stats()
+
 # Speech token for browser STT/Avatar
+def _issue_speech_token() -> Dict[str, Any]:
+    r = clients.http_session().post(SPEECH_TOKEN_URL, headers={"Ocp-Apim-Subscription-Key": SPEECH_KEY, "Content-Length": "0"}, timeout=(clients.HTTP_CONNECT_TIMEOUT, 10))
+    if r.status_code != 200:
+        raise HTTPException(r.status_code, f"Failed to issue token: {r.text}")
+    return {"token": r.text, "issuedAt": time.time()}
+
+# One STS token is shared by all browsers; on a brief upstream failure the last good one is served until it really expires.
+speech_token_cache = RefreshAheadCache("speech-token", ttl=SPEECH_TOKEN_CACHE_TTL, refresh_ahead=TOKEN_REFRESH_AHEAD,
+                                       stale_if_error=max(SPEECH_TOKEN_LIFETIME - SPEECH_TOKEN_CACHE_TTL - 15, 0), max_entries=1)
+
 @app.get("/speech/token", tags=["speech"])
 def speech_token():
     if not (SPEECH_KEY and SPEECH_REGION):
         raise HTTPException(500, "SPEECH_KEY and SPEECH_REGION must be set.")
-    url = f"https://{SPEECH_REGION}.api.cognitive.microsoft.com/sts/v1.0/issueToken"
-    r = requests.post(url, headers={"Ocp-Apim-Subscription-Key": SPEECH_KEY, "Content-Length": "0"}, timeout=10)
-    if r.status_code != 200:
-        raise HTTPException(r.status_code, f"Failed to issue token: {r.text}")
+    cached = speech_token_cache.get("sts", _issue_speech_token)
+    remaining = int(SPEECH_TOKEN_LIFETIME - (time.time() - cached["issuedAt"]))
     # Tokens last ~10 minutes; browser should renew. [1](https://learn.microsoft.com/en-us/azure/ai-services/speech-service/)[2](https://docs.azure.cn/en-us/ai-services/speech-service/troubleshooting)
-    return {"token": r.text, "region": SPEECH_REGION, "expiresInSeconds": 600}
+    return {"token": cached["token"], "region": SPEECH_REGION, "expiresInSeconds": max(remaining, 0)}
 
 # Avatar TURN/ICE relay token for WebRTC (Real-time Avatar)
+class UpstreamError(Exception):
+    def __init__(self, status_code: int, body: str, media_type: str):
+        super().__init__(f"upstream returned {status_code}")
+        self.status_code, self.body, self.media_type = status_code, body, media_type
+
+def _fetch_relay_token() -> Dict[str, Any]:
+    try:
+        r = clients.http_session().get(SPEECH_RELAY_URL, headers={"Ocp-Apim-Subscription-Key": SPEECH_KEY}, timeout=(clients.HTTP_CONNECT_TIMEOUT, 15))
+    except boot.lazy_import("requests").RequestException as e:
+        # Network or timeout error contacting the Speech service
+        raise HTTPException(status_code=500, detail=str(e))
+    if r.status_code >= 400:
+        raise UpstreamError(r.status_code, r.text, r.headers.get("content-type", "text/plain"))
+    # Contains urls, username, credential, ttl
+    return r.json()
+
+def _relay_cache_ttl(relay: Dict[str, Any]) -> float:
+    try:
+        ttl = float(relay.get("ttl") or 0)
+    except (TypeError, ValueError):
+        ttl = 0
+    # Hand out credentials with enough lifetime left for a full avatar session
+    return max(min(ttl - RELAY_TOKEN_MIN_REMAINING, RELAY_TOKEN_CACHE_MAX), 0) if ttl else RELAY_TOKEN_CACHE_MAX
+
+relay_token_cache = RefreshAheadCache("relay-token", ttl=RELAY_TOKEN_CACHE_MAX, refresh_ahead=TOKEN_REFRESH_AHEAD,
+                                      stale_if_error=RELAY_TOKEN_MIN_REMAINING / 2, max_entries=1, ttl_of=_relay_cache_ttl)
+
 @app.get("/api/avatar/relay-token", tags=["speech"])
 def avatar_relay_token():
     if not (SPEECH_KEY and SPEECH_REGION):
         raise HTTPException(status_code=500, detail="SPEECH_KEY and SPEECH_REGION must be set.")
-
-    url = f"https://{SPEECH_REGION}.tts.speech.microsoft.com/cognitiveservices/avatar/relay/token/v1"
     try:
-        r = requests.get(url, headers={"Ocp-Apim-Subscription-Key": SPEECH_KEY}, timeout=15)
-    except requests.RequestException as e:
-        # Network or timeout error contacting the Speech service
-        raise HTTPException(status_code=500, detail=str(e))
+        return relay_token_cache.get("relay", _fetch_relay_token)
+    except UpstreamError as e:
+        # If the upstream returns an error, mirror the body and status
+        return Response(content=e.body, status_code=e.status_code, media_type=e.media_type)
 
-    # If the upstream returns an error, mirror the body and status
-    if r.status_code >= 400:
-        return Response(
-            content=r.text,
-            status_code=r.status_code,
-            media_type=r.headers.get("content-type", "text/plain")
-        )
+@app.get("/debug/token-cache", tags=["meta"])
+def debug_token_cache():
+    return {"speech": speech_token_cache.stats(), "relay": relay_token_cache.stats()}
 
-    # On success, proxy the JSON through (contains urls, username, credential, ttl)
-    return r.json()
-    
 # Market: top stocks via Azure AI Search with curated fallback
 @app.get("/market/top-stocks", tags=["market"])
-def market_top_stocks(sector: str):
-    search = search_top5(sector)  # Azure AI Search client usage. [6](https://learn.microsoft.com/en-us/python/api/azure-search-documents/azure.search.documents.searchclient?view=azure-python)[8](https://learn.microsoft.com/en-us/python/api/overview/azure/search-documents-readme?view=azure-python)
+def market_top_stocks(sector: str, limit: int = 5, minScore: Optional[float] = None, exclude: Optional[str] = None):
+    limit = max(1, min(limit, MARKET_TOP_MAX))
+    held = [s.strip() for s in (exclude or "").split(",") if s.strip()]  # e.g. symbols already in the portfolio
+    local = snapshots.top(sector, limit, minScore, held)
+    if local is not None:
+        return {"sector": sector, "top5": local, "source": "snapshot"}
+    search = cached_top5(sector)  # Azure AI Search client usage. [6](https://learn.microsoft.com/en-us/python/api/azure-search-documents/azure.search.documents.searchclient?view=azure-python)[8](https://learn.microsoft.com/en-us/python/api/overview/azure/search-documents-readme?view=azure-python)
+    skip = {h.upper() for h in held}
     if search:
-        return {"sector": sector, "top5": search}
+        rows = [r for r in search if str(r["symbol"]).upper() not in skip
+                and (minScore is None or (r["score"] is not None and r["score"] >= minScore))]
+        return {"sector": sector, "top5": rows[:limit], "source": "search"}
     # fallback: curated 4 (used along with Cognizant in final split)
-    return {"sector": sector, "top5": [{"symbol": s} for s in curated_four(sector)[:5]]}
-
-# Core chat with Azure OpenAI (+ tool: UpdatePortfolioTool)
+    curated = [{"symbol": s} for s in curated_four(sector) if s.upper() not in skip]
+    return {"sector": sector, "top5": curated[:limit], "source": "curated"}
+
+# Local snapshot: version, rows per sector, hot-swaps
+@app.get("/market/snapshot", tags=["market"])
+def market_snapshot():
+    return snapshots.stats()
+
+# Publish a fresh snapshot from Azure AI Search; other workers pick it up on their next pointer check
+@app.post("/market/snapshot/refresh", tags=["market"])
+def market_snapshot_refresh(request: Request):
+    require_admin(request)
+    if not MARKET_SNAPSHOT_DIR:
+        raise HTTPException(status_code=503, detail="MARKET_SNAPSHOT_DIR is not set")
+    try:
+        rows = search_all()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    version = write_snapshot(rows, source="azure-search")
+    return {"published": version, "loaded": snapshots.refresh(), "rows": len(rows)}
+
+@app.post("/market/top-stocks/invalidate", tags=["market"])
+def market_top_stocks_invalidate(request: Request, sector: Optional[str] = None):
+    require_admin(request)
+    # Drop one sector's cached leaderboard (or all of them) so the next request queries Search
+    removed = sector_cache.invalidate(normalize_sector(sector) if sector else None)
+    return {"invalidated": removed}
+
+@app.get("/market/top-stocks/cache", tags=["market"])
+def market_top_stocks_cache():
+    return sector_cache.stats()
+
+class AllocationRequest(BaseModel):
+    cashInflow: float
+    cashOutflow: float
+    liabilities: float = 0
+    riskAppetite: str
+    preferredSector: str
+    investmentPeriod: int
+    currency: Optional[str] = None
+    city: Optional[str] = None  # used to infer the currency when none is given
+
+class GeoLookupRequest(BaseModel):
+    cities: List[str]
+
+# Batch city -> country/currency resolution (e.g. backfilling profiles); repeated names are resolved once
+@app.post("/geo/lookup", tags=["geo"])
+def geo_lookup(req: GeoLookupRequest):
+    if len(req.cities) > GEO_LOOKUP_MAX:
+        raise HTTPException(status_code=413, detail=f"at most {GEO_LOOKUP_MAX} cities per request")
+    return {"results": gazetteer.lookup_many(req.cities)}
+
+# Same computation as the ComputeAllocation tool, without the model
+@app.post("/portfolio/allocate", tags=["portfolio"])
+def portfolio_allocate(req: AllocationRequest):
+    currency = req.currency
+    if not currency and req.city:
+        place = gazetteer.country_currency(req.city)
+        if place is None:
+            raise HTTPException(status_code=400, detail=f"Unknown city {req.city!r}; pass currency instead")
+        currency = place[1]
+    return build_roadmap(req.cashInflow, req.cashOutflow, req.liabilities, req.riskAppetite,
+                         req.preferredSector, req.investmentPeriod, currency or "$")
+
+# Bulk what-if sweeps: columnar JSON, CSV or Arrow in; results streamed back in chunks (NDJSON or CSV)
+@app.post("/portfolio/allocate/batch", tags=["portfolio"])
+async def portfolio_allocate_batch(request: Request, format: Literal["ndjson", "csv"] = "ndjson", chunkSize: int = 10000):
+    allocation_batch = boot.lazy_import("app.allocation_batch")  # pulls in numpy
+    ctype = request.headers.get("content-type", "")
+    try:
+        if ctype.startswith("multipart/form-data"):
+            upload = (await request.form()).get("file")
+            if upload is None:
+                raise ValueError("Multipart uploads need a 'file' field")
+            data, name = await upload.read(), (upload.filename or "").lower()
+            decode = allocation_batch.columns_from_arrow if name.endswith((".arrow", ".arrows", ".feather")) else allocation_batch.columns_from_csv
+            cols = await run_in_threadpool(decode, data)
+        elif "arrow" in ctype:
+            cols = await run_in_threadpool(allocation_batch.columns_from_arrow, await request.body())
+        elif "csv" in ctype:
+            cols = await run_in_threadpool(allocation_batch.columns_from_csv, await request.body())
+        else:
+            body = await request.json()
+            cols = allocation_batch.columns_from_mapping(body.get("columns", body))
+        result = await run_in_threadpool(allocation_batch.calc_allocation_batch, cols["riskAppetite"], cols["liabilities"],
+                                         cols["investmentPeriod"], cols["netSurplus"])
+    except (ValueError, TypeError) as e:
+        raise HTTPException(400, f"Invalid batch input: {e}")
+    chunk = max(1, min(chunkSize, 100000))
+    if format == "csv":
+        return StreamingResponse(allocation_batch.stream_csv(result, chunk), media_type="text/csv")
+    return StreamingResponse(allocation_batch.stream_ndjson(result, chunk), media_type="application/x-ndjson")
+
+# Analytics export: keyset-paginated, streamed in constant memory; pass the X-Export-Watermark of one run as
+# ?after= on the next to get only newer rows
+@app.get("/export/{table}", tags=["export"])
+def export_table(table: str, request: Request, format: Literal["ndjson", "csv", "parquet"] = "ndjson",
+                 after: Optional[str] = None, sessionId: Optional[str] = None):
+    if not export.EXPORT_API_KEY:
+        raise HTTPException(status_code=404, detail="Export is not enabled")
+    if not hmac.compare_digest(request.headers.get("x-export-key", ""), export.EXPORT_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid export key")
+    try:
+        run = export.Export(table, after=after, session_id=sessionId)
+        body = export.stream(run, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    headers = {"X-Export-Watermark": run.watermark or "", "Cache-Control": "no-store",
+               "Content-Disposition": f'attachment; filename="{table}.{format}"'}
+    return StreamingResponse(body, media_type=export.FORMATS[format], headers=headers)
+
+# Core chat with Azure OpenAI (+ tools from app.tools: UpdatePortfolioTool, ComputeAllocation)
 @app.post("/chat", response_model=ChatResponse, tags=["ai"])
-def chat(req: ChatRequest):
-    session_id = ensure_session(req.sessionId)
-    save_message(session_id, "user", json.dumps([m.model_dump() for m in req.messages]))
+@metrics.profiled
+async def chat(req: ChatRequest):
+    # Async so a turn queued for admission waits on the event loop, not on one of the threadpool's threads
+    # (which /health, /speech/token and every other sync route share); DB/CPU steps still run in the pool
+    session_id = await run_in_threadpool(ensure_session, req.sessionId)
+    history = await run_in_threadpool(conversation_for, req, session_id)
 
     # Handle '#fetch-top-stocks:' control message (model trigger)
     if req.messages and req.messages[-1].content.strip().startswith("#fetch-top-stocks:"):
         sector = req.messages[-1].content.split(":",1)[1].strip()
-        payload = market_top_stocks(sector)
-        return ChatResponse(content=json.dumps({"marketTopStocks": payload["top5"]}), sessionId=session_id, finish_reason="tool")
-
-    client = aoai_client()
-
-    # Define tool (function) for DB update; Azure OpenAI supports tools/function-calling. 
-    tools = [{
-        "type": "function",
-        "function": {
-            "name": "UpdatePortfolioTool",
-            "description": "Persist portfolio to corporate DB (Azure SQL) and return status.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "userName": {"type":"string"},
-                    "userEmail": {"type":"string"},
-                    "region": {"type":"string"},
-                    "monthlyInflow": {"type":"number"},
-                    "monthlyOutflow": {"type":"number"},
-                    "totalDebt": {"type":"number"},
-                    "riskAppetite": {"type":"string"},
-                    "preferredSector": {"type":"string"},
-                    "investmentAmount": {"type":"number"},
-                    "investmentPeriod": {"type":"number"},
-                    "futureGoals": {"type":"string"},
-                    "assetAllocation": {"type":"string"},
-                    "equityRecommendation": {"type":"string"},
-                    "alternateEquities": {"type":"string"},
-                    "debtRecommendation": {"type":"string"},
-                    "portfolioSummary": {"type":"string"}
-                },
-                "required": ["userName","region","monthlyInflow","monthlyOutflow","totalDebt",
-                             "riskAppetite","preferredSector","investmentAmount","investmentPeriod",
-                             "futureGoals","assetAllocation","equityRecommendation",
-                             "alternateEquities","debtRecommendation","portfolioSummary"]
-            }
-        }
-    }]
-
-    # Prepend system prompt
-    messages = [{"role": "system", "content": INNOVIYA_SYSTEM_PROMPT}]
-    messages.extend([m.model_dump() for m in req.messages])
-
-    # First call: allow tool calling
-    resp = client.chat.completions.create(
-        model=AZURE_OPENAI_DEPLOYMENT,
-        messages=messages,
-        temperature=req.temperature,
-        max_tokens=req.max_tokens,
-        tools=tools
-    )
-    choice = resp.choices[0]
-
-    # If model requests tool call, execute it then respond
-    if getattr(choice.message, "tool_calls", None):
-        for call in choice.message.tool_calls:
-            if call.function.name == "UpdatePortfolioTool":
-                args = json.loads(call.function.arguments or "{}")
-                db = SessionLocal()
-                try:
-                    db.add(Portfolio(
-                        sessionId=session_id,
-                        userName=args.get("userName",""),
-                        userEmail=args.get("userEmail",""),
-                        region=args.get("region",""),
-                        monthlyInflow=float(args.get("monthlyInflow",0)),
-                        monthlyOutflow=float(args.get("monthlyOutflow",0)),
-                        totalDebt=float(args.get("totalDebt",0)),
-                        riskAppetite=args.get("riskAppetite",""),
-                        preferredSector=args.get("preferredSector",""),
-                        investmentAmount=float(args.get("investmentAmount",0)),
-                        investmentPeriod=int(args.get("investmentPeriod",0)),
-                        futureGoals=args.get("futureGoals",""),
-                        assetAllocation=args.get("assetAllocation",""),
-                        equityRecommendation=args.get("equityRecommendation",""),
-                        alternateEquities=args.get("alternateEquities",""),
-                        debtRecommendation=args.get("debtRecommendation",""),
-                        portfolioSummary=args.get("portfolioSummary","")
-                    )); db.commit()
-                    tool_result = {"status":"success","message":"Portfolio updated"}
-                except Exception as e:
-                    db.rollback(); tool_result = {"status":"error","message":str(e)}
-                finally:
-                    db.close()
-
-                # Send tool result back to model
-                tool_messages = messages + [
-                    {"role":"assistant","content":choice.message.content or "", "tool_calls":[call.model_dump()]},
-                    {"role":"tool","tool_call_id":call.id,"name":"UpdatePortfolioTool","content":json.dumps(tool_result)}
-                ]
-                resp2 = client.chat.completions.create(
+        payload = await run_in_threadpool(market_top_stocks, sector)
+        content = json.dumps({"marketTopStocks": payload["top5"]})
+        if req.history == "server":
+            await run_in_threadpool(save_message, session_id, "assistant", content)
+        return ChatResponse(content=content, sessionId=session_id, finish_reason="tool")
+
+    # Structured intake answers are handled locally; only free-text/off-script turns reach the model
+    reply, profile = await run_in_threadpool(intake_turn, session_id, history)
+    if reply is not None:
+        return ChatResponse(content=reply, sessionId=session_id, finish_reason="stop")
+
+    # System prompt + known profile + rolling summary + latest turns, within the token budget
+    with stage("context"):
+        messages, prompt_tokens = await run_in_threadpool(context_mgr.build, session_id, INNOVIYA_SYSTEM_PROMPT, history, profile_notes(profile))
+
+    # Identical low-temperature turns replay a cached tool-free completion
+    cache_key = llm_cache.key_for(messages, req.temperature, req.max_tokens, AZURE_OPENAI_DEPLOYMENT, INNOVIYA_PROMPT_VERSION)
+    with stage("llm_cache"):
+        cached = await run_in_threadpool(llm_cache.get, cache_key)
+    if cached:
+        await run_in_threadpool(save_message, session_id, "assistant", cached["content"])
+        return ChatResponse(content=cached["content"], sessionId=session_id, finish_reason=cached["finish_reason"], promptTokens=prompt_tokens)
+
+    client = aoai_async_client()
+
+    # One admission slot per turn; the token estimate is reconciled with actual usage on release
+    async with admission.aslot(session_id, prompt_tokens["windowed"] + req.max_tokens) as ticket:
+        # Tool rounds: every call in an assistant message runs concurrently and all results go back in one
+        # follow-up; after TOOL_MAX_DEPTH rounds the model has to answer in text
+        convo, called, max_tokens = messages, [], req.max_tokens
+        for depth in range(TOOL_MAX_DEPTH + 1):
+            with stage(f"completion.{depth + 1}"):
+                resp = await admission.acall(client.chat.completions.create,
                     model=AZURE_OPENAI_DEPLOYMENT,
-                    messages=tool_messages,
+                    messages=convo,
                     temperature=req.temperature,
-                    max_tokens=400
+                    max_tokens=max_tokens,
+                    tools=tools.specs(),
+                    tool_choice="auto" if depth < TOOL_MAX_DEPTH else "none"
                 )
-                final = resp2.choices[0].message.content
-                save_message(session_id, "assistant", final)
-                return ChatResponse(content=final, sessionId=session_id, finish_reason=resp2.choices[0].finish_reason)
+            choice = resp.choices[0]
+            if resp.usage and (depth == 0 or ticket.used is not None):
+                ticket.used = (ticket.used or 0) + resp.usage.total_tokens
+            calls = getattr(choice.message, "tool_calls", None) or []
+            if not calls:
+                break
+            results = await tools.arun_all(session_id, [(c.function.name, c.function.arguments) for c in calls])
+            convo = convo + [{"role":"assistant","content":choice.message.content or "", "tool_calls":[c.model_dump() for c in calls]}] + [
+                {"role":"tool","tool_call_id":c.id,"name":c.function.name,"content":json.dumps(r)} for c, r in zip(calls, results)]
+            called += [c.function.name for c in calls]
+            max_tokens = followup_max_tokens(called, req.max_tokens)
+
+    final = choice.message.content or ""
+    await run_in_threadpool(save_message, session_id, "assistant", final)
+    if not called:  # replies that depend on tool results (DB writes, profile) are never replayed
+        await run_in_threadpool(llm_cache.put, cache_key, final, choice.finish_reason)
+    return ChatResponse(content=final, sessionId=session_id, finish_reason=choice.finish_reason, promptTokens=prompt_tokens)
+
+def sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def relay_deltas(stream, parts: List[str], calls: Dict[int, Dict[str, str]], state: Dict[str, Any]):
+    """Yield SSE 'delta' events from a streamed completion, accumulating text and tool-call fragments."""
+    async for chunk in stream:
+        if not chunk.choices:  # Azure emits prompt-filter chunks with no choices
+            continue
+        ch = chunk.choices[0]
+        delta = ch.delta
+        if delta and delta.content:
+            if state["ttft_ms"] is None:
+                state["ttft_ms"] = round((time.perf_counter() - state["t0"]) * 1000, 1)
+                metrics.record("ttft", state["ttft_ms"] / 1000)
+                yield sse("ttft", {"ms": state["ttft_ms"]})
+            parts.append(delta.content)
+            yield sse("delta", {"content": delta.content})
+        for tc in (delta.tool_calls or []) if delta else []:
+            # Tool calls arrive as fragments keyed by index; id/name come once, arguments are concatenated.
+            slot = calls.setdefault(tc.index, {"id": "", "name": "", "arguments": ""})
+            if tc.id: slot["id"] = tc.id
+            if tc.function and tc.function.name: slot["name"] += tc.function.name
+            if tc.function and tc.function.arguments: slot["arguments"] += tc.function.arguments
+        if ch.finish_reason:
+            state["finish_reason"] = ch.finish_reason
+
+# Streaming chat over SSE: events ttft, delta, tool, done (or error)
+@app.post("/chat/stream", tags=["ai"])
+@metrics.profiled
+async def chat_stream(req: ChatRequest):
+    session_id = await run_in_threadpool(ensure_session, req.sessionId)
+    history = await run_in_threadpool(conversation_for, req, session_id)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
-    # Normal response
-    final = choice.message.content
-    save_message(session_id, "assistant", final)
-    return ChatResponse(content=final, sessionId=session_id, finish_reason=choice.finish_reason)
-
-# Optional: server-side STT file transcription (browser uses SDK directly)
+    if req.messages and req.messages[-1].content.strip().startswith("#fetch-top-stocks:"):
+        sector = req.messages[-1].content.split(":",1)[1].strip()
+        payload = await run_in_threadpool(market_top_stocks, sector)
+        content = json.dumps({"marketTopStocks": payload["top5"]})
+        if req.history == "server":
+            await run_in_threadpool(save_message, session_id, "assistant", content)
+        async def control():
+            yield sse("delta", {"content": content})
+            yield sse("done", {"sessionId": session_id, "finish_reason": "tool", "ttft_ms": None})
+        return StreamingResponse(control(), media_type="text/event-stream", headers=headers)
+
+    reply, profile = await run_in_threadpool(intake_turn, session_id, history)
+    if reply is not None:
+        async def scripted():
+            yield sse("delta", {"content": reply})
+            yield sse("done", {"sessionId": session_id, "finish_reason": "stop", "ttft_ms": None})
+        return StreamingResponse(scripted(), media_type="text/event-stream", headers=headers)
+
+    with stage("context"):
+        messages, prompt_tokens = await run_in_threadpool(context_mgr.build, session_id, INNOVIYA_SYSTEM_PROMPT, history, profile_notes(profile))
+    cache_key = llm_cache.key_for(messages, req.temperature, req.max_tokens, AZURE_OPENAI_DEPLOYMENT, INNOVIYA_PROMPT_VERSION)
+    with stage("llm_cache"):
+        cached = await run_in_threadpool(llm_cache.get, cache_key)
+    if cached:
+        await run_in_threadpool(save_message, session_id, "assistant", cached["content"])
+        async def replay():
+            yield sse("delta", {"content": cached["content"]})
+            yield sse("done", {"sessionId": session_id, "finish_reason": cached["finish_reason"], "ttft_ms": None,
+                               "promptTokens": prompt_tokens, "cached": True})
+        return StreamingResponse(replay(), media_type="text/event-stream", headers=headers)
+
+    client = aoai_async_client()
+    # Taken before the response starts so saturation is a real 429, released when the stream ends
+    ticket = await admission.acquire(session_id, prompt_tokens["windowed"] + req.max_tokens)
+
+    async def events():
+        state = {"t0": time.perf_counter(), "ttft_ms": None, "finish_reason": None}
+        parts: List[str] = []
+        convo, called, rounds = messages, [], 0
+        try:
+            for depth in range(TOOL_MAX_DEPTH + 1):
+                # Only the last round's text is the reply; earlier text rides along with its tool calls
+                parts.clear()
+                calls: Dict[int, Dict[str, str]] = {}
+                t = time.perf_counter()
+                stream = await admission.acall(client.chat.completions.create,
+                    model=AZURE_OPENAI_DEPLOYMENT,
+                    messages=convo,
+                    temperature=req.temperature,
+                    max_tokens=followup_max_tokens(called, req.max_tokens) if called else req.max_tokens,
+                    tools=tools.specs(),
+                    tool_choice="auto" if depth < TOOL_MAX_DEPTH else "none",
+                    stream=True
+                )
+                rounds += 1
+                async for ev in relay_deltas(stream, parts, calls, state):
+                    yield ev
+                metrics.record(f"completion.{depth + 1}", time.perf_counter() - t)
+                if not calls:
+                    break
+
+                tool_calls = [{"id": c["id"], "type": "function", "function": {"name": c["name"], "arguments": c["arguments"]}}
+                              for _, c in sorted(calls.items())]
+                results = await tools.arun_all(session_id, [(c["name"], c["arguments"]) for _, c in sorted(calls.items())])
+                convo = convo + [{"role":"assistant","content":"".join(parts), "tool_calls":tool_calls}]
+                for c, result in zip(tool_calls, results):
+                    yield sse("tool", {"name": c["function"]["name"], "result": result})
+                    convo.append({"role":"tool","tool_call_id":c["id"],"name":c["function"]["name"],"content":json.dumps(result)})
+                called += [c["function"]["name"] for c in tool_calls]
+        except Rejected as e:
+            yield sse("error", {"message": "Too many requests, please retry shortly.", "retryAfter": e.retry_after})
+            return
+        except Exception as e:
+            log.exception("chat stream failed")
+            yield sse("error", {"message": str(e)})
+            return
+        finally:
+            ticket.used = prompt_tokens["windowed"] * max(1, rounds) + count_tokens("".join(parts))
+            admission.release(ticket)
+
+        final = "".join(parts)
+        await run_in_threadpool(save_message, session_id, "assistant", final)
+        if not called:
+            await run_in_threadpool(llm_cache.put, cache_key, final, state["finish_reason"])
+        total_ms = round((time.perf_counter() - state["t0"]) * 1000, 1)
+        log.info("chat stream session=%s ttft_ms=%s total_ms=%s tools=%s", session_id, state["ttft_ms"], total_ms, called)
+        yield sse("done", {"sessionId": session_id, "finish_reason": state["finish_reason"],
+                           "ttft_ms": state["ttft_ms"], "total_ms": total_ms, "promptTokens": prompt_tokens})
+
+    # release() is idempotent; the background task covers a client that disconnects before the body starts
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers,
+                             background=BackgroundTask(admission.release, ticket))
+
+# Optional: server-side STT transcription (browser uses SDK directly).
+# Accepts a multipart upload (file, language, mode) or a raw audio body (?language=&mode=). Both are read
+# straight off the request stream (multipart fields must come before the file) and pushed into the recognizer
+# chunk by chunk; SDK setup and recognition run in the bounded STT pool, never on the event loop.
 @app.post("/stt", tags=["speech"])
-async def stt(file: UploadFile = File(...), language: str = Form("en-US")):
+async def stt(request: Request, language: str = "en-US", mode: Literal["continuous", "once"] = "continuous"):
     if not SPEECH_KEY or not SPEECH_REGION:
         raise HTTPException(500, "SPEECH_KEY and SPEECH_REGION must be set.")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.filename}") as tmp:
-        tmp.write(await file.read()); tmp_path = tmp.name
-    try:
-        speech_config = speechsdk.SpeechConfig(subscription=SPEECH_KEY, region=SPEECH_REGION)
-        speech_config.speech_recognition_language = language
-        audio_config = speechsdk.audio.AudioConfig(filename=tmp_path)
-        recognizer = speechsdk.SpeechRecognizer(speech_config, audio_config)
-        result = recognizer.recognize_once_async().get()
-        if result.reason == speechsdk.ResultReason.RecognizedSpeech:
-            return {"text": result.text, "language": language}
-        elif result.reason == speechsdk.ResultReason.NoMatch:
-            return JSONResponse({"error": "No speech recognized."}, status_code=422)
-        else:
-            raise HTTPException(500, f"STT failed: {result.cancellation_details}")
-    finally:
-        try: os.unlink(tmp_path)
-        except: pass
+    ctype = request.headers.get("content-type", "")
+    if ctype.startswith("multipart/form-data"):
+        try:
+            form = stt_engine.MultipartStream(ctype, request.stream())
+            found = await form.start()
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        if not found:
+            raise HTTPException(400, "Multipart uploads need a 'file' field.")
+        language, mode = form.fields.get("language") or language, form.fields.get("mode") or mode
+        chunks, filename, ctype = form.file_chunks(), form.filename, form.content_type
+    else:
+        chunks, filename = request.stream(), ""
+
+    async with stt_engine.slots():
+        head, rest = await stt_engine.head_and_rest(chunks)
+        # The first call imports the Speech SDK (native libraries), so format and recognizer are built in the pool
+        fmt, offset = await stt_engine.run_in_pool(stt_engine.stream_format, head, filename, ctype)
+        recognizer, stream = await stt_engine.run_in_pool(stt_engine.make_recognizer, SPEECH_KEY, SPEECH_REGION, language, fmt)
+        recognize = stt_engine.recognize_once if mode == "once" else stt_engine.recognize_continuous
+        job = asyncio.ensure_future(stt_engine.run_in_pool(recognize, recognizer))
+        try:
+            stream.write(head[offset:])
+            async for chunk in rest:
+                stream.write(chunk)
+        finally:
+            stream.close()  # end of audio: continuous recognition stops once the stream drains
+        result = await job
+
+    if result.get("error"):
+        raise HTTPException(500, f"STT failed: {result['error']}")
+    if not result["segments"]:
+        return JSONResponse({"error": "No speech recognized."}, status_code=422)
+    return {"text": " ".join(result["segments"]), "language": language, "segments": result["segments"]}
+
+# Live transcription: binary frames of 16-bit mono PCM in, {"type": "partial"|"final"|"done", "text"} out.
+# Send the text frame "end" to finish.
+@app.websocket("/stt/ws")
+async def stt_ws(ws: WebSocket, language: str = "en-US", sampleRate: int = 16000):
+    await ws.accept()
+    if not SPEECH_KEY or not SPEECH_REGION:
+        await ws.send_json({"type": "error", "text": "SPEECH_KEY and SPEECH_REGION must be set."})
+        await ws.close(code=1011); return
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    emit = lambda kind, text: loop.call_soon_threadsafe(events.put_nowait, {"type": kind, "text": text})
+
+    async with stt_engine.slots():
+        fmt = await stt_engine.run_in_pool(stt_engine.pcm_format, sampleRate)
+        recognizer, stream = await stt_engine.run_in_pool(stt_engine.make_recognizer, SPEECH_KEY, SPEECH_REGION, language, fmt)
+        job = asyncio.ensure_future(stt_engine.run_in_pool(stt_engine.recognize_continuous, recognizer, stt_engine.STT_TIMEOUT, emit))
+
+        async def pump():
+            try:
+                while True:
+                    msg = await ws.receive()
+                    if msg["type"] == "websocket.disconnect":
+                        break
+                    if msg.get("bytes"):
+                        stream.write(msg["bytes"])
+                    elif (msg.get("text") or "").strip().lower() in ("end", "stop", "eos"):
+                        break
+            finally:
+                stream.close()
+        reader = asyncio.ensure_future(pump())
+
+        try:
+            while not (job.done() and events.empty()):
+                getter = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait({getter, job}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    await ws.send_json(getter.result())
+                else:
+                    getter.cancel()
+            result = job.result()
+            await ws.send_json({"type": "done", "text": " ".join(result["segments"]), "error": result.get("error")})
+            await ws.close()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            reader.cancel()
@@ -1,12 +1,20 @@
-import os
-from typing import List, Dict
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
+import os, time
+from typing import TYPE_CHECKING, List, Dict
+from app import clients, metrics, startup
+from app.cache import RefreshAheadCache
+
+if TYPE_CHECKING:
+    from azure.search.documents import SearchClient
 
 SEARCH_ENDPOINT = os.getenv("AZURE_SEARCH_ENDPOINT")   # e.g., https://<service>.search.windows.net
 SEARCH_API_KEY  = os.getenv("AZURE_SEARCH_API_KEY")
 SEARCH_INDEX    = os.getenv("AZURE_SEARCH_INDEX", "market-index")
 
+# Leaderboards move slowly: serve cached rankings, and stale ones while a single background refresh runs.
+SECTOR_CACHE_TTL         = float(os.getenv("SECTOR_CACHE_TTL", "900"))
+SECTOR_CACHE_STALE       = float(os.getenv("SECTOR_CACHE_STALE", "3600"))
+SECTOR_CACHE_MAX_ENTRIES = int(os.getenv("SECTOR_CACHE_MAX_ENTRIES", "64"))
+
 CURATED_2026 = {
     "tech":        ["TCS", "Infosys", "HCL Tech", "LTIMindtree"],
     "finance":     ["HDFC Bank", "ICICI Bank", "Axis Bank", "SBI"],
@@ -15,11 +23,49 @@ CURATED_2026 = {
     "consumer goods": ["Hindustan Unilever", "ITC", "Nestle India", "Britannia"]
 }
 
+SECTOR_LABELS = {"tech": "Tech", "finance": "Finance", "energy": "Energy",
+                 "healthcare": "Healthcare", "consumer goods": "Consumer Goods"}
+
+SECTOR_ALIASES = {
+    "technology": "tech", "it": "tech", "health": "healthcare", "fmcg": "consumer goods"
+}
+
+sector_cache = RefreshAheadCache("sector-top5", ttl=SECTOR_CACHE_TTL, stale_while_revalidate=SECTOR_CACHE_STALE,
+                                 stale_if_error=SECTOR_CACHE_STALE, max_entries=SECTOR_CACHE_MAX_ENTRIES)
+
+def normalize_sector(sector: str) -> str:
+    """Canonical sector key; aliases such as "it" and "technology" map to "tech"."""
+    key = " ".join((sector or "").lower().split())
+    return SECTOR_ALIASES.get(key, key)
+
+def sector_label(sector: str) -> str:
+    return SECTOR_LABELS.get(normalize_sector(sector), (sector or "").strip())
+
+def search_client() -> "SearchClient":
+    # One pooled client per worker; azure-core keeps its HTTP session alive between queries.
+    return clients.get_client("search", _build_search_client)
+
+def _build_search_client() -> "SearchClient":
+    # SDK imported on first use so workers that never query Search don't load it
+    documents = startup.lazy_import("azure.search.documents")
+    credentials = startup.lazy_import("azure.core.credentials")
+    return documents.SearchClient(  # Client to an existing index [6](https://learn.microsoft.com/en-us/python/api/azure-search-documents/azure.search.documents.searchclient?view=azure-python)
+        SEARCH_ENDPOINT, SEARCH_INDEX, credentials.AzureKeyCredential(SEARCH_API_KEY),
+        connection_timeout=clients.HTTP_CONNECT_TIMEOUT, read_timeout=clients.HTTP_READ_TIMEOUT,
+        raw_request_hook=_stamp_request, raw_response_hook=_count_response)
+
+def _stamp_request(request):
+    request.context["t0"] = time.perf_counter()
+
+def _count_response(response):
+    t0 = response.context.get("t0")
+    metrics.upstream("search", response.http_response.status_code, time.perf_counter() - t0 if t0 else None)
+
 def search_top5(sector: str) -> List[Dict]:
     """Query Azure AI Search for recent leaders by sector, order by a score like performanceScore desc."""
     if not (SEARCH_ENDPOINT and SEARCH_API_KEY and SEARCH_INDEX):
         return []
-    client = SearchClient(SEARCH_ENDPOINT, SEARCH_INDEX, AzureKeyCredential(SEARCH_API_KEY))  # Client to an existing index [6](https://learn.microsoft.com/en-us/python/api/azure-search-documents/azure.search.documents.searchclient?view=azure-python)
+    client = search_client()
     # Order by a numeric field (e.g., performanceScore) using OData $orderby; top=5. [7](https://learn.microsoft.com/en-us/azure/search/search-query-odata-orderby)
     results = client.search(
         search_text=sector,
@@ -27,14 +73,21 @@ def search_top5(sector: str) -> List[Dict]:
         order_by=["performanceScore desc"],
         select=["symbol", "name", "performanceScore", "sector"]
     )  # SearchClient usage & options per SDK docs/samples. [8](https://learn.microsoft.com/en-us/python/api/overview/azure/search-documents-readme?view=azure-python)[9](https://github.com/Azure/azure-sdk-for-python/blob/main/sdk/search/azure-search-documents/samples/README.md)
-    out = []
-    for r in results:
-        sym = getattr(r, "symbol", None) or getattr(r, "name", None)
-        out.append({"symbol": sym, "score": getattr(r, "performanceScore", None)})
-    return out
+    # Results are dicts keyed by field name
+    return [{"symbol": r.get("symbol") or r.get("name"), "score": r.get("performanceScore")} for r in results]
+
+def search_all() -> List[Dict]:
+    """Every scored document in the index, for publishing a local market snapshot (app.market_snapshot)."""
+    if not (SEARCH_ENDPOINT and SEARCH_API_KEY and SEARCH_INDEX):
+        raise RuntimeError("Azure AI Search is not configured")
+    results = search_client().search(search_text="*", filter="performanceScore ne null",
+                                     select=["symbol", "name", "performanceScore", "sector"])
+    return [dict(r) for r in results]
+
+def cached_top5(sector: str) -> List[Dict]:
+    """search_top5 behind the per-sector cache; all aliases of a sector share one entry."""
+    key = normalize_sector(sector)
+    return sector_cache.get(key, lambda: search_top5(key))
 
 def curated_four(sector: str) -> List[str]:
-    key = sector.lower().strip()
-    return CURATED_2026.get(key, CURATED_2026.get({
-        "technology": "tech", "it": "tech", "health": "healthcare", "fmcg": "consumer goods"
-    }.get(key, key), []))
+    return CURATED_2026.get(normalize_sector(sector), [])
@@ -0,0 +1,203 @@
+import os, csv, json, time, bisect, shutil, threading, logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from app import startup
+from app.market_search import normalize_sector
+
+log = logging.getLogger("invest-soul.market")
+
+MARKET_SNAPSHOT_DIR  = os.getenv("MARKET_SNAPSHOT_DIR")                       # unset: Search/curated lists only
+MARKET_SNAPSHOT_TOPK = int(os.getenv("MARKET_SNAPSHOT_TOPK", "20"))           # leaders precomputed per sector
+MARKET_SNAPSHOT_POLL = float(os.getenv("MARKET_SNAPSHOT_POLL", "5"))          # seconds between CURRENT pointer checks
+MARKET_SNAPSHOT_KEEP = int(os.getenv("MARKET_SNAPSHOT_KEEP", "3"))            # old versions kept for in-flight readers
+
+POINTER = "CURRENT"
+
+# On-disk layout, one directory per version, switched by rewriting CURRENT (os.replace, so readers never see
+# a half-written snapshot):
+#   <dir>/CURRENT             -> "20260101T120000-ab12cd"
+#   <dir>/<version>/meta.json    sectors, row count, source, createdAt
+#   <dir>/<version>/<col>.npy    rows ordered by (sector, score desc); symbol/name fixed-width UTF-8, score float32
+#   <dir>/<version>/offsets.npy  sector i owns rows offsets[i]:offsets[i + 1]
+
+class Snapshot:
+    """One immutable snapshot version, memory-mapped; per-sector leaders are materialised at load."""
+    def __init__(self, path: str):
+        np = startup.lazy_import("numpy")
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.version, self.path = self.meta["version"], path
+        cols = {c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode="r") for c in ("symbol", "name", "score")}
+        self.symbol, self.name, self.score = cols["symbol"], cols["name"], cols["score"]
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.sectors = {s: i for i, s in enumerate(self.meta["sectors"])}
+        self.leaders = {s: [self._row(j) for j in range(self.offsets[i], min(self.offsets[i + 1], self.offsets[i] + MARKET_SNAPSHOT_TOPK))]
+                        for s, i in self.sectors.items()}
+        self.loaded_at = time.time()
+
+    def _row(self, j: int) -> Dict[str, Any]:
+        return {"symbol": self.symbol[j].decode(), "name": self.name[j].decode(), "score": round(float(self.score[j]), 4)}
+
+    def top(self, sector: str, k: int = 5, min_score: Optional[float] = None,
+            exclude: Sequence[str] = ()) -> Optional[List[Dict[str, Any]]]:
+        """Sector leaders, best first; None when the snapshot has no such sector."""
+        key = normalize_sector(sector)
+        i = self.sectors.get(key)
+        if i is None:
+            return None
+        leaders = self.leaders[key]
+        skip = {s.strip().upper() for s in exclude if s and s.strip()}
+        if min_score is None and not skip and k <= len(leaders):
+            return leaders[:k]  # the common case: a slice of a precomputed list
+        lo, hi = int(self.offsets[i]), int(self.offsets[i + 1])
+        if min_score is not None:
+            # Scores are descending inside a sector: binary-search the first row below min_score
+            hi = bisect.bisect_right(self.score, -min_score, lo, hi, key=lambda v: -v)
+        out = []
+        for j in range(lo, hi):
+            if len(out) >= k:
+                break
+            if skip and (self.symbol[j].decode().upper() in skip or self.name[j].decode().upper() in skip):
+                continue
+            out.append(self._row(j))
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.meta, loadedAt=self.loaded_at, topK=MARKET_SNAPSHOT_TOPK,
+                    sectorRows={s: int(self.offsets[i + 1] - self.offsets[i]) for s, i in self.sectors.items()})
+
+# ---------- Build / publish ----------
+def write_snapshot(rows: Iterable[Dict[str, Any]], root: Optional[str] = None, source: str = "file") -> str:
+    """Write rows ({symbol, name, sector, performanceScore}) as a new version and point CURRENT at it."""
+    np = startup.lazy_import("numpy")
+    root = root or MARKET_SNAPSHOT_DIR
+    if not root:
+        raise RuntimeError("MARKET_SNAPSHOT_DIR is not set")
+    seen, clean = set(), []
+    for r in rows:
+        symbol = str(r.get("symbol") or r.get("name") or "").strip()
+        sector = normalize_sector(r.get("sector") or "")
+        score = r.get("performanceScore", r.get("score"))
+        if not symbol or not sector or score is None or (sector, symbol.upper()) in seen:
+            continue
+        seen.add((sector, symbol.upper()))
+        clean.append((sector, -float(score), symbol, str(r.get("name") or symbol).strip()))
+    if not clean:
+        raise ValueError("snapshot has no usable rows (need symbol, sector and performanceScore)")
+    clean.sort()
+    sectors = sorted({r[0] for r in clean})
+    counts = [sum(1 for r in clean if r[0] == s) for s in sectors]
+
+    # Microseconds in the name keep versions published within one second in order for _prune
+    now = time.time()
+    version = time.strftime("%Y%m%dT%H%M%S", time.gmtime(now)) + f"{int(now * 1e6) % 1000000:06d}-" + os.urandom(3).hex()
+    tmp = os.path.join(root, f".{version}.tmp")
+    os.makedirs(tmp)
+    encode = lambda values: np.array([v.encode("utf-8") for v in values], dtype=f"S{max(1, max(len(v.encode('utf-8')) for v in values))}")
+    np.save(os.path.join(tmp, "symbol.npy"), encode([r[2] for r in clean]))
+    np.save(os.path.join(tmp, "name.npy"), encode([r[3] for r in clean]))
+    np.save(os.path.join(tmp, "score.npy"), np.array([-r[1] for r in clean], dtype=np.float32))
+    np.save(os.path.join(tmp, "offsets.npy"), np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": version, "createdAt": time.time(), "source": source, "rows": len(clean), "sectors": sectors}, f)
+    os.rename(tmp, os.path.join(root, version))
+
+    pointer_tmp = os.path.join(root, f".{POINTER}.{version}")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush(); os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(root, POINTER))
+    _prune(root, keep=version)
+    log.info("market snapshot %s published: %d rows, %d sectors (%s)", version, len(clean), len(sectors), source)
+    return version
+
+def _prune(root: str, keep: str):
+    versions = sorted(d for d in os.listdir(root) if not d.startswith(".") and d != POINTER and d != keep)
+    for old in versions[:max(0, len(versions) - (MARKET_SNAPSHOT_KEEP - 1))]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+def read_rows(path: str) -> List[Dict[str, Any]]:
+    """Rows from a CSV, JSON array or NDJSON export with symbol, name, sector and performanceScore."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            return list(csv.DictReader(f))
+        text = f.read().strip()
+    return json.loads(text) if text.startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()]
+
+# ---------- Current version, hot-swapped ----------
+class SnapshotStore:
+    """The worker's view of CURRENT; re-checked at most every poll seconds and swapped without blocking readers."""
+    def __init__(self, root: Optional[str], poll: float = MARKET_SNAPSHOT_POLL):
+        self.root, self.poll = root, poll
+        self._snapshot: Optional[Snapshot] = None
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+        self._stats = {"swaps": 0, "loadErrors": 0, "queries": 0, "filtered": 0}
+
+    def current(self) -> Optional[Snapshot]:
+        if self.root and time.monotonic() - self._checked >= self.poll and self._lock.acquire(blocking=self._snapshot is None):
+            try:
+                self._checked = time.monotonic()
+                self._maybe_swap()
+            finally:
+                self._lock.release()
+        return self._snapshot
+
+    def _maybe_swap(self):
+        try:
+            with open(os.path.join(self.root, POINTER), encoding="utf-8") as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return
+        if self._snapshot is not None and self._snapshot.version == version:
+            return
+        try:
+            snap = Snapshot(os.path.join(self.root, version))
+        except Exception:
+            self._stats["loadErrors"] += 1
+            log.exception("market snapshot %s failed to load; keeping %s", version,
+                          self._snapshot.version if self._snapshot else "none")
+            return
+        self._snapshot = snap  # a single reference swap: in-flight readers finish on the old version
+        self._stats["swaps"] += 1
+        log.info("market snapshot %s loaded (%d rows)", version, snap.meta["rows"])
+
+    def top(self, sector: str, k: int = 5, min_score: Optional[float] = None,
+            exclude: Sequence[str] = ()) -> Optional[List[Dict[str, Any]]]:
+        snap = self.current()
+        if snap is None:
+            return None
+        self._stats["queries"] += 1
+        self._stats["filtered"] += bool(min_score is not None or exclude)
+        return snap.top(sector, k, min_score, exclude)
+
+    def refresh(self) -> Optional[str]:
+        """Force a pointer check now (after publishing) instead of waiting for the poll interval."""
+        self._checked = float("-inf")
+        snap = self.current()
+        return snap.version if snap else None
+
+    def stats(self) -> Dict[str, Any]:
+        snap = self._snapshot
+        return dict(self._stats, enabled=bool(self.root), dir=self.root, pollSeconds=self.poll,
+                    snapshot=snap.stats() if snap else None)
+
+snapshots = SnapshotStore(MARKET_SNAPSHOT_DIR)
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Publish a market snapshot into MARKET_SNAPSHOT_DIR")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    load = sub.add_parser("load", help="from a CSV/JSON/NDJSON file")
+    load.add_argument("path")
+    sub.add_parser("refresh", help="from Azure AI Search")
+    ap.add_argument("--dir", default=MARKET_SNAPSHOT_DIR)
+    args = ap.parse_args()
+    if args.cmd == "load":
+        print(write_snapshot(read_rows(args.path), args.dir, source=os.path.basename(args.path)))
+    else:
+        from app.market_search import search_all
+        print(write_snapshot(search_all(), args.dir, source="azure-search"))
+
+if __name__ == "__main__":
+    main()
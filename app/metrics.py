@@ -0,0 +1,207 @@
+import os, io, time, random, inspect, functools, threading, cProfile, pstats
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.db import engine
+
+# In-process metrics for this worker: stage/request histograms, upstream counters, DB pool gauges.
+# Rendered as Prometheus text on /metrics; per-request stage timings also go out as Server-Timing.
+SERVER_TIMING      = os.getenv("SERVER_TIMING", "1") == "1"
+PROFILE_SAMPLE_PCT = float(os.getenv("PROFILE_SAMPLE_PCT", "0"))   # % of requests run under cProfile
+PROFILE_KEEP       = int(os.getenv("PROFILE_KEEP", "20"))           # most recent profiles kept for /debug/profiles
+PROFILE_TOP        = int(os.getenv("PROFILE_TOP", "30"))            # functions listed per profile
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], le: Optional[str] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name, self.help, self.labels = name, help, labels
+        self.series: Dict[Tuple[str, ...], List[float]] = {}  # label values -> bucket counts + [sum, count]
+
+    def observe(self, seconds: float, *values: str):
+        with _lock:
+            s = self.series.get(values)
+            if s is None:
+                s = self.series[values] = [0.0] * (len(BUCKETS) + 2)
+            for i, b in enumerate(BUCKETS):
+                if seconds <= b:
+                    s[i] += 1
+            s[-2] += seconds; s[-1] += 1
+
+    def render(self, out: List[str]):
+        out += [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, s in sorted(self.series.items()):
+            for i, b in enumerate(BUCKETS):
+                out.append(f"{self.name}_bucket{_labels(self.labels, values, f'{b:g}')} {int(s[i])}")
+            out.append(f"{self.name}_bucket{_labels(self.labels, values, '+Inf')} {int(s[-1])}")
+            out.append(f"{self.name}_sum{_labels(self.labels, values)} {s[-2]:.6f}")
+            out.append(f"{self.name}_count{_labels(self.labels, values)} {int(s[-1])}")
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name, self.help, self.labels = name, help, labels
+        self.series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *values: str, by: float = 1):
+        with _lock:
+            self.series[values] = self.series.get(values, 0) + by
+
+    def render(self, out: List[str]):
+        out += [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_labels(self.labels, v)} {n:g}" for v, n in sorted(self.series.items())]
+
+REQUESTS = Histogram("invest_soul_request_duration_seconds", "HTTP request latency by route.", ("route", "method", "status"))
+STAGES = Histogram("invest_soul_stage_duration_seconds", "Latency of individual request stages.", ("stage",))
+UPSTREAM = Counter("invest_soul_upstream_requests_total", "Upstream HTTP responses by status.", ("upstream", "status"))
+UPSTREAM_LATENCY = Histogram("invest_soul_upstream_duration_seconds", "Upstream time to response headers.", ("upstream",))
+DB_ROWS = Counter("invest_soul_db_rows_written_total", "Rows committed by the write-behind flusher.", ("kind",))
+DB_DEAD_LETTERS = Counter("invest_soul_db_dead_letters_total", "Rows the flusher dropped after per-row retries.", ("kind",))
+_gauges: Dict[str, Tuple[str, Callable[[], Optional[float]]]] = {}
+
+def gauge(name: str, help: str, fn: Callable[[], Optional[float]]):
+    """Register a value read at scrape time (queue depths, in-flight counts)."""
+    _gauges[name] = (help, fn)
+
+def upstream(name: str, status: int, seconds: Optional[float] = None):
+    UPSTREAM.inc(name, str(status))
+    if seconds is not None:
+        UPSTREAM_LATENCY.observe(seconds, name)
+
+# ---------- per-request stages ----------
+_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("stage_timings", default=None)
+_sampled: ContextVar[bool] = ContextVar("profile_sampled", default=False)
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - t0)
+
+def record(name: str, seconds: float):
+    STAGES.observe(seconds, name)
+    # The list is shared by reference, so stages timed in the threadpool land in the request's header too
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+def server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings]
+    return ", ".join(parts + [f"total;dur={total * 1000:.1f}"])
+
+class MetricsMiddleware:
+    """Pure ASGI so streamed responses pass through untouched; Server-Timing covers stages done before the first byte."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings: List[Tuple[str, float]] = []
+        token = _timings.set(timings)
+        sampled = _sampled.set(PROFILE_SAMPLE_PCT > 0 and random.random() * 100 < PROFILE_SAMPLE_PCT)
+        t0, status = time.perf_counter(), [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if SERVER_TIMING:
+                    header = server_timing(timings, time.perf_counter() - t0).encode("latin-1")
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", header)])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            endpoint = scope.get("endpoint")
+            route = getattr(endpoint, "__name__", None) or "unmatched"  # endpoint names keep label cardinality bounded
+            REQUESTS.observe(time.perf_counter() - t0, route, scope.get("method", ""), str(status[0]))
+            _sampled.reset(sampled)
+            _timings.reset(token)
+
+# ---------- sampling profiler ----------
+_profiles: "deque[Dict[str, Any]]" = deque(maxlen=PROFILE_KEEP)
+
+def profiled(fn: Callable) -> Callable:
+    """Run the handler under cProfile for the sampled share of requests.
+
+    Sync handlers are profiled on their worker thread; for async handlers the profile also
+    includes whatever else the event loop ran meanwhile."""
+    def keep(prof: cProfile.Profile, t0: float):
+        buf = io.StringIO()
+        pstats.Stats(prof, stream=buf).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        with _lock:
+            _profiles.append({"route": fn.__name__, "at": time.time(), "ms": round((time.perf_counter() - t0) * 1000, 1),
+                              "stats": buf.getvalue()})
+
+    def start() -> Optional[cProfile.Profile]:
+        if not _sampled.get():
+            return None
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # another profiler is already active on this thread
+            return None
+        return prof
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            prof, t0 = start(), time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                if prof:
+                    prof.disable(); keep(prof, t0)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        prof, t0 = start(), time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if prof:
+                prof.disable(); keep(prof, t0)
+    return wrapper
+
+def profiles() -> List[Dict[str, Any]]:
+    with _lock:
+        return list(_profiles)
+
+# ---------- exposition ----------
+def db_pool() -> Dict[str, Optional[int]]:
+    pool = getattr(engine, "pool", None)
+    read = lambda attr: getattr(pool, attr)() if hasattr(pool, attr) else None
+    return {"size": read("size"), "checked_out": read("checkedout"), "checked_in": read("checkedin"), "overflow": read("overflow")}
+
+def render() -> str:
+    out: List[str] = []
+    with _lock:
+        for metric in (REQUESTS, STAGES, UPSTREAM, UPSTREAM_LATENCY, DB_ROWS, DB_DEAD_LETTERS):
+            metric.render(out)
+    for key, value in db_pool().items():
+        if value is not None:
+            out += [f"# TYPE invest_soul_db_pool_{key} gauge", f"invest_soul_db_pool_{key} {value}"]
+    for name, (help, fn) in sorted(_gauges.items()):
+        try:
+            value = fn()
+        except Exception:
+            value = None
+        if value is not None:
+            out += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value:g}"]
+    return "\n".join(out) + "\n"
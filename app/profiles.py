@@ -0,0 +1,205 @@
+import os, json, time, sqlite3, tempfile, threading, logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.db import SessionLocal, SessionState
+from app.writer import writer
+
+log = logging.getLogger("invest-soul.profiles")
+
+PROFILE_FIELDS = ("userName", "userEmail", "userCity", "userCountry", "currency", "cashInflow", "cashOutflow",
+                  "liabilities", "riskAppetite", "preferredSector", "futureGoals", "investmentPeriod", "netSurplus")
+PROFILE_CACHE_SESSIONS    = int(os.getenv("PROFILE_CACHE_SESSIONS", "2000"))
+# Shared by all gunicorn workers on the node, so a session's turns can land on any worker; empty disables it
+SESSION_CACHE_PATH        = os.getenv("SESSION_CACHE_PATH", os.path.join(tempfile.gettempdir(), "invest-soul-sessions.sqlite"))
+SESSION_CACHE_TTL         = float(os.getenv("SESSION_CACHE_TTL", "86400"))        # seconds since last use
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "100000"))
+SESSION_CACHE_PRUNE_EVERY = int(os.getenv("SESSION_CACHE_PRUNE_EVERY", "500"))    # shared writes between pruning passes
+
+class _SharedTier:
+    """SessionState rows known on this node: existence plus profile fields, in a WAL-mode SQLite file.
+
+    Expiry slides with use (reads push it forward once half the TTL has gone), so pruning by expiry
+    drops the least recently used sessions first.
+    """
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.path, self.ttl, self.max_entries = path, ttl, max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._conn() as c:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("CREATE TABLE IF NOT EXISTS session_cache (sessionId TEXT PRIMARY KEY, profile TEXT NOT NULL, expires REAL NOT NULL)")
+            c.execute("CREATE INDEX IF NOT EXISTS ix_session_cache_expires ON session_cache (expires)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        c, now = self._conn(), time.time()
+        row = c.execute("SELECT profile, expires FROM session_cache WHERE sessionId = ? AND expires > ?", (session_id, now)).fetchone()
+        if row is None:
+            return None
+        if row[1] - now < self.ttl / 2:
+            c.execute("UPDATE session_cache SET expires = ? WHERE sessionId = ?", (now + self.ttl, session_id))
+        return json.loads(row[0])
+
+    def put(self, session_id: str, fields: Dict[str, Any], replace: bool = False):
+        """Store a session; partial fields are merged into what another worker may already have written."""
+        c = self._conn()
+        merge = "excluded.profile" if replace else "json_patch(profile, excluded.profile)"
+        c.execute("INSERT INTO session_cache (sessionId, profile, expires) VALUES (?, ?, ?) "
+                  f"ON CONFLICT(sessionId) DO UPDATE SET profile = {merge}, expires = excluded.expires",
+                  (session_id, json.dumps(fields, default=str), time.time() + self.ttl))
+        self._writes += 1
+        if self._writes % SESSION_CACHE_PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self) -> int:
+        c = self._conn()
+        n = c.execute("DELETE FROM session_cache WHERE expires <= ?", (time.time(),)).rowcount
+        n += c.execute("DELETE FROM session_cache WHERE sessionId IN (SELECT sessionId FROM session_cache "
+                       "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,)).rowcount
+        return n
+
+    def size(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM session_cache WHERE expires > ?", (time.time(),)).fetchone()[0]
+
+class ProfileStore:
+    """SessionState profile fields and session existence, so a chat turn needs no SQL read.
+
+    Every worker on the node shares one cache file (SESSION_CACHE_PATH) and it is authoritative; the per-worker
+    LRU mirrors it and is only consulted when the file can't be read or is disabled. Writes go to both and on to
+    SQL through the write-behind queue; SQL is read for a session neither tier has seen, or with fresh=True when
+    the caller has evidence its copy is behind (e.g. the shared tier is off and another worker took a turn).
+    """
+    def __init__(self, max_sessions: int = PROFILE_CACHE_SESSIONS, shared_path: Optional[str] = SESSION_CACHE_PATH):
+        self.max_sessions = max_sessions
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memoryHits": 0, "sharedHits": 0, "sqlReads": 0, "knownSessions": 0, "newSessions": 0,
+                       "rereads": 0, "errors": 0}
+        self.shared: Optional[_SharedTier] = None
+        if shared_path:
+            try:
+                self.shared = _SharedTier(shared_path, SESSION_CACHE_TTL, SESSION_CACHE_MAX_ENTRIES)
+            except sqlite3.Error:
+                log.exception("profiles: shared session cache disabled")
+
+    def get(self, session_id: str, fresh: bool = False) -> Dict[str, Any]:
+        profile = self._cached(session_id)
+        if profile is not None and not fresh:
+            return profile
+        stored = self._read(session_id)
+        if profile is None:
+            profile = dict(dict.fromkeys(PROFILE_FIELDS), **stored)
+            self._store(session_id, profile, replace=True)
+            return dict(profile)
+        # Re-read: fill in what SQL has and the cached copy lacks; cached values may be newer than the queued writes
+        self._count("rereads")
+        missing = {f: v for f, v in stored.items() if v is not None and profile.get(f) is None}
+        if missing:
+            self._merge(session_id, missing)
+            profile.update(missing)
+        return profile
+
+    def ensure(self, session_id: str, new: bool = False):
+        """Make sure a SessionState row exists: queue the insert unless this node already knows the session."""
+        if new:
+            self._store(session_id, dict.fromkeys(PROFILE_FIELDS), replace=True)  # nothing to look up yet
+            self._count("newSessions")
+        elif self._cached(session_id) is not None:
+            self._count("knownSessions")
+            return
+        # Insert-if-missing happens in the write-behind flusher; no DB round trip on the request path
+        writer.submit("session", {"sessionId": session_id})
+
+    def start(self, session_id: str):
+        """A freshly minted session has an empty profile; skip the DB lookup."""
+        self.ensure(session_id, new=True)
+
+    def update(self, session_id: str, fields: Dict[str, Any]):
+        self._merge(session_id, fields)
+        writer.submit("profile", dict(fields, sessionId=session_id))
+
+    def _merge(self, session_id: str, fields: Dict[str, Any]):
+        """Merge fields into both cache tiers without writing them to SQL."""
+        with self._lock:
+            profile = self._cache.get(session_id)
+            if profile is not None:
+                profile.update(fields)
+        if self.shared:
+            try:
+                self.shared.put(session_id, fields)
+            except sqlite3.Error:
+                self._count("errors")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            st = dict(self._stats, memorySessions=len(self._cache), maxSessions=self.max_sessions)
+        reads = st["memoryHits"] + st["sharedHits"] + st["sqlReads"]
+        st["hitRate"] = round(1 - st["sqlReads"] / reads, 4) if reads else None
+        st["shared"] = None
+        if self.shared:
+            try:
+                st["shared"] = {"path": self.shared.path, "sessions": self.shared.size(), "ttl": self.shared.ttl,
+                                "maxEntries": self.shared.max_entries}
+            except sqlite3.Error:
+                st["shared"] = {"path": self.shared.path, "error": True}
+        return st
+
+    def _cached(self, session_id: str) -> Optional[Dict[str, Any]]:
+        # The shared file wins over the worker's copy: the previous turn may have run on another worker
+        if self.shared:
+            try:
+                fields = self.shared.get(session_id)
+            except sqlite3.Error:
+                self._count("errors")  # fall back to the worker's copy
+            else:
+                if fields is None:
+                    return None  # expired or evicted node-wide; the worker's copy may be older than another worker's write
+                profile = dict(dict.fromkeys(PROFILE_FIELDS), **fields)
+                with self._lock:
+                    self._remember(session_id, profile)
+                    self._stats["sharedHits"] += 1
+                return dict(profile)
+        with self._lock:
+            if session_id in self._cache:
+                self._cache.move_to_end(session_id)
+                self._stats["memoryHits"] += 1
+                return dict(self._cache[session_id])
+        return None
+
+    def _read(self, session_id: str) -> Dict[str, Any]:
+        if not SessionLocal:
+            return {}
+        self._count("sqlReads")
+        db = SessionLocal()
+        try:
+            row = db.get(SessionState, session_id)
+            return {f: getattr(row, f) for f in PROFILE_FIELDS} if row else {}
+        finally:
+            db.close()
+
+    def _store(self, session_id: str, profile: Dict[str, Any], replace: bool = False):
+        with self._lock:
+            self._remember(session_id, profile)
+        if self.shared:
+            try:
+                self.shared.put(session_id, profile, replace=replace)
+            except sqlite3.Error:
+                self._count("errors")
+
+    def _count(self, key: str):
+        with self._lock: self._stats[key] += 1
+
+    def _remember(self, session_id: str, profile: Dict[str, Any]):
+        self._cache[session_id] = profile
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.max_sessions:
+            self._cache.popitem(last=False)
+
+profiles = ProfileStore()
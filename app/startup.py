@@ -0,0 +1,97 @@
+import os, re, sys, time, logging, importlib, subprocess, threading
+from typing import Any, Callable, Dict, List, Optional
+
+log = logging.getLogger("invest-soul.startup")
+
+# Imported first by app.main, so T0 is "worker starts importing the app".
+T0 = time.perf_counter()
+
+STARTUP_READY_TARGET_MS = float(os.getenv("STARTUP_READY_TARGET_MS", "1500"))  # import -> startup hook done
+STARTUP_PREWARM         = os.getenv("STARTUP_PREWARM", "1") == "1"              # warm deferred SDKs after ready
+
+# Deferred until first use; listed so the report shows which ones a worker has actually paid for
+HEAVY_MODULES = ("openai", "azure.search.documents", "azure.cognitiveservices.speech", "requests", "numpy", "tiktoken")
+
+_lock = threading.Lock()
+_phases: Dict[str, float] = {}
+_deferred: Dict[str, Dict[str, Any]] = {}
+
+def _since_t0_ms() -> float:
+    return round((time.perf_counter() - T0) * 1000, 1)
+
+def _process_age_ms() -> Optional[float]:
+    # Linux only: process start from /proc, to include interpreter and gunicorn fork time before T0
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = float(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return round((uptime - start_ticks / os.sysconf("SC_CLK_TCK")) * 1000, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+_BEFORE_T0_MS = _process_age_ms()
+
+def mark(phase: str):
+    with _lock:
+        _phases[phase] = _since_t0_ms()
+
+def lazy_import(name: str):
+    """importlib.import_module that records what the first (cold) import cost this worker."""
+    module = sys.modules.get(name)
+    if module is not None and not getattr(module.__spec__, "_initializing", False):
+        return module  # still initialising means another thread (e.g. prewarm) is importing it: wait below
+    t0 = time.perf_counter()
+    module = importlib.import_module(name)
+    with _lock:
+        _deferred.setdefault(name, {"ms": round((time.perf_counter() - t0) * 1000, 1), "atMs": _since_t0_ms(),
+                                    "thread": threading.current_thread().name})
+    return module
+
+def prewarm(tasks: List[Callable[[], Any]]):
+    """Run deferred imports/initialisers on a background thread once the worker is serving."""
+    if not STARTUP_PREWARM:
+        return
+    def run():
+        for task in tasks:
+            try:
+                task()
+            except Exception:
+                log.debug("prewarm task failed", exc_info=True)
+        mark("prewarmed")
+    threading.Thread(target=run, name="prewarm", daemon=True).start()
+
+def ready():
+    mark("ready")
+    ms = _phases["ready"]
+    if ms > STARTUP_READY_TARGET_MS:
+        log.warning("worker ready in %.0f ms (target %.0f ms)", ms, STARTUP_READY_TARGET_MS)
+    else:
+        log.info("worker ready in %.0f ms", ms)
+
+def report() -> Dict[str, Any]:
+    with _lock:
+        phases, deferred = dict(_phases), {k: dict(v) for k, v in _deferred.items()}
+    ready_ms = phases.get("ready")
+    return {"pid": os.getpid(), "phasesMs": phases, "beforeImportMs": _BEFORE_T0_MS,
+            "readyTargetMs": STARTUP_READY_TARGET_MS,
+            "withinTarget": ready_ms <= STARTUP_READY_TARGET_MS if ready_ms is not None else None,
+            "deferredImports": deferred,
+            "heavyModulesLoaded": {m: m in sys.modules for m in HEAVY_MODULES},
+            "modulesLoaded": len(sys.modules)}
+
+_IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def import_breakdown(module: str = "app.main", top: int = 25, max_depth: int = 3) -> List[Dict[str, Any]]:
+    """Fresh-interpreter `python -X importtime` of the app, largest cumulative import times first."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True,
+                          text=True, timeout=60, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME.match(line)
+        if m:
+            depth = (len(m.group(3)) - 1) // 2
+            if depth <= max_depth:
+                rows.append({"module": m.group(4), "depth": depth, "selfMs": int(m.group(1)) / 1000,
+                             "cumulativeMs": int(m.group(2)) / 1000})
+    return sorted(rows, key=lambda r: -r["cumulativeMs"])[:top]
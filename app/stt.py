@@ -0,0 +1,217 @@
+import os, struct, asyncio, threading, logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from app import startup
+
+if TYPE_CHECKING:
+    import azure.cognitiveservices.speech as speechsdk
+
+log = logging.getLogger("invest-soul.stt")
+
+# Recognition blocks a thread for the length of the clip, so it runs in its own bounded pool.
+STT_MAX_CONCURRENCY = int(os.getenv("STT_MAX_CONCURRENCY", "4"))
+STT_CHUNK_BYTES     = int(os.getenv("STT_CHUNK_BYTES", str(64 * 1024)))
+STT_TIMEOUT         = float(os.getenv("STT_TIMEOUT", "300"))
+STT_FIELD_MAX_BYTES = 1024  # text fields (language, mode) sent alongside the audio
+
+_pool = ThreadPoolExecutor(max_workers=STT_MAX_CONCURRENCY, thread_name_prefix="stt")
+_slots: Optional[asyncio.Semaphore] = None
+
+def slots() -> asyncio.Semaphore:
+    # Waiting callers queue here, on the event loop, before any audio is buffered
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(STT_MAX_CONCURRENCY)
+    return _slots
+
+def sdk():
+    # The Speech SDK loads native libraries; only workers that actually serve /stt pay for it
+    return startup.lazy_import("azure.cognitiveservices.speech")
+
+def pcm_format(sample_rate: int) -> "speechsdk.audio.AudioStreamFormat":
+    return sdk().audio.AudioStreamFormat(samples_per_second=sample_rate, bits_per_sample=16, channels=1)
+
+COMPRESSED_SUFFIXES = (".mp3", ".ogg", ".opus", ".flac", ".webm", ".m4a", ".mp4", ".aac", ".amr")
+
+def wav_format(head: bytes) -> Optional[Tuple["speechsdk.audio.AudioStreamFormat", int]]:
+    """Parse a RIFF/WAVE header; returns (PCM stream format, offset of the sample data)."""
+    if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        return None
+    pos, fmt = 12, None
+    while pos + 8 <= len(head):
+        cid, size = head[pos:pos + 4], struct.unpack("<I", head[pos + 4:pos + 8])[0]
+        if cid == b"fmt " and pos + 24 <= len(head):
+            _, channels, rate, _, _, bits = struct.unpack("<HHIIHH", head[pos + 8:pos + 24])
+            fmt = sdk().audio.AudioStreamFormat(samples_per_second=rate, bits_per_sample=bits, channels=channels)
+        elif cid == b"data":
+            return (fmt, pos + 8) if fmt else None
+        pos += 8 + size + (size & 1)
+    return None
+
+def stream_format(head: bytes, filename: str = "", content_type: str = "") -> Tuple["speechsdk.audio.AudioStreamFormat", int]:
+    """Stream format for an upload from its first bytes; raw PCM (16 kHz, 16-bit, mono) otherwise."""
+    wav = wav_format(head)
+    if wav:
+        return wav
+    speechsdk = sdk()
+    name, ctype = (filename or "").lower(), (content_type or "").lower()
+    if name.endswith(COMPRESSED_SUFFIXES) or (ctype.startswith("audio/") and "wav" not in ctype and "pcm" not in ctype):
+        # Compressed containers are decoded by the SDK through GStreamer
+        return speechsdk.audio.AudioStreamFormat(compressed_stream_format=speechsdk.AudioStreamContainerFormat.ANY), 0
+    return speechsdk.audio.AudioStreamFormat(), 0
+
+def make_recognizer(key: str, region: str, language: str, fmt: "speechsdk.audio.AudioStreamFormat"):
+    speechsdk = sdk()
+    speech_config = speechsdk.SpeechConfig(subscription=key, region=region)
+    speech_config.speech_recognition_language = language
+    stream = speechsdk.audio.PushAudioInputStream(stream_format=fmt)
+    recognizer = speechsdk.SpeechRecognizer(speech_config, speechsdk.audio.AudioConfig(stream=stream))
+    return recognizer, stream
+
+def recognize_once(recognizer) -> Dict[str, Any]:
+    speechsdk = sdk()
+    result = recognizer.recognize_once_async().get()
+    if result.reason == speechsdk.ResultReason.RecognizedSpeech:
+        return {"segments": [result.text]}
+    if result.reason == speechsdk.ResultReason.NoMatch:
+        return {"segments": []}
+    return {"error": str(result.cancellation_details)}
+
+def recognize_continuous(recognizer, timeout: float = STT_TIMEOUT,
+                         on_event: Optional[Callable[[str, str], None]] = None) -> Dict[str, Any]:
+    """Recognise until the input stream is closed and drained; returns every final segment."""
+    speechsdk = sdk()
+    segments: List[str] = []
+    done, error = threading.Event(), []
+    def recognized(evt):
+        if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech and evt.result.text:
+            segments.append(evt.result.text)
+            if on_event: on_event("final", evt.result.text)
+    def recognizing(evt):
+        if on_event and evt.result.text: on_event("partial", evt.result.text)
+    def canceled(evt):
+        details = evt.cancellation_details
+        if details.reason == speechsdk.CancellationReason.Error:
+            error.append(details.error_details)
+        done.set()
+    recognizer.recognized.connect(recognized)
+    recognizer.recognizing.connect(recognizing)
+    recognizer.canceled.connect(canceled)
+    recognizer.session_stopped.connect(lambda evt: done.set())
+    recognizer.start_continuous_recognition_async().get()
+    try:
+        if not done.wait(timeout):
+            error.append(f"recognition timed out after {timeout:.0f}s")
+    finally:
+        recognizer.stop_continuous_recognition_async().get()
+    return {"segments": segments, "error": error[0]} if error else {"segments": segments}
+
+async def run_in_pool(fn: Callable, *args) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(_pool, fn, *args)
+
+async def head_and_rest(chunks, min_head: int = 4096):
+    """Split an async byte stream into a header-sized first block and the remaining chunks."""
+    it, head = chunks.__aiter__(), b""
+    while len(head) < min_head:
+        try:
+            head += await it.__anext__()
+        except StopAsyncIteration:
+            break
+    return head, it
+
+def _multipart():
+    try:
+        import python_multipart as multipart
+    except ImportError:  # releases before 0.0.13
+        import multipart
+    return multipart
+
+class MultipartStream:
+    """Incremental multipart/form-data reader over the raw request body.
+
+    Text fields sent before the audio part are collected; the audio part's bytes are handed out as they
+    arrive, so nothing is spooled to a temporary file. Fields after the audio part are read and ignored.
+    """
+    def __init__(self, content_type: str, body: AsyncIterator[bytes], file_field: str = "file"):
+        mp = _multipart()
+        _, params = mp.multipart.parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("multipart body without a boundary")
+        self.file_field = file_field
+        self.fields: Dict[str, str] = {}
+        self.filename = self.content_type = ""
+        self._body = body.__aiter__()
+        self._error = mp.exceptions.MultipartParseError
+        self._pending: List[bytes] = []  # audio parsed but not handed out yet
+        self._header, self._value, self._headers, self._data, self._name = b"", b"", {}, [], ""
+        self._in_file = self._file_started = self._file_done = False
+        self._parser = mp.MultipartParser(boundary, {
+            "on_part_begin": self._part_begin, "on_header_field": self._header_field,
+            "on_header_value": self._header_value, "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished, "on_part_data": self._part_data,
+            "on_part_end": self._part_end})
+
+    async def start(self) -> bool:
+        """Read up to the start of the audio part; False when the body has none."""
+        while not self._file_started:
+            if not await self._feed():
+                return False
+        return True
+
+    async def file_chunks(self) -> AsyncIterator[bytes]:
+        while True:
+            if self._pending:
+                data = b"".join(self._pending); self._pending.clear()
+                yield data
+            if self._file_done or not await self._feed():
+                break
+        while await self._feed():  # drain trailing fields
+            pass
+
+    async def _feed(self) -> bool:
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            self._parser.finalize()
+            return False
+        try:
+            self._parser.write(chunk)
+        except self._error as e:
+            raise ValueError(f"malformed multipart body: {e}")
+        return True
+
+    # ---------- parser callbacks ----------
+    def _part_begin(self):
+        self._headers, self._data = {}, []
+
+    def _header_field(self, data: bytes, start: int, end: int):
+        self._header += data[start:end]
+
+    def _header_value(self, data: bytes, start: int, end: int):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        self._headers[self._header.lower()] = self._value
+        self._header = self._value = b""
+
+    def _headers_finished(self):
+        _, opts = _multipart().multipart.parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._name = opts.get(b"name", b"").decode("utf-8", "replace")
+        if self._name == self.file_field and not self._file_started:
+            self._in_file = self._file_started = True
+            self.filename = opts.get(b"filename", b"").decode("utf-8", "replace")
+            self.content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+
+    def _part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._pending.append(data[start:end])
+        elif not self._file_started and sum(map(len, self._data)) < STT_FIELD_MAX_BYTES:
+            self._data.append(data[start:end])
+
+    def _part_end(self):
+        if self._in_file:
+            self._in_file, self._file_done = False, True
+        elif not self._file_started and self._name:
+            self.fields[self._name] = b"".join(self._data)[:STT_FIELD_MAX_BYTES].decode("utf-8", "replace")
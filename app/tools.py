@@ -0,0 +1,179 @@
+import os, asyncio, logging, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Type
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from app.allocation import build_roadmap
+from app.metrics import stage
+from app.profiles import profiles
+from app.writer import writer
+
+log = logging.getLogger("invest-soul.tools")
+
+TOOL_MAX_DEPTH   = int(os.getenv("TOOL_MAX_DEPTH", "3"))      # tool-call rounds per chat turn; then the model must answer
+TOOL_MAX_WORKERS = int(os.getenv("TOOL_MAX_WORKERS", "8"))    # calls from one assistant message run side by side
+TOOL_TIMEOUT     = float(os.getenv("TOOL_TIMEOUT", "20"))     # per call, seconds
+
+class Tool:
+    def __init__(self, name: str, description: str, args: Type[BaseModel], fn: Callable[[str, BaseModel], Dict[str, Any]]):
+        self.name, self.description, self.args, self.fn = name, description, args, fn
+        self.spec = {"type": "function", "function": {"name": name, "description": description,
+                                                      "parameters": _parameters(args)}}
+
+def _parameters(model: Type[BaseModel]) -> Dict[str, Any]:
+    # Pydantic's JSON schema minus the titles, which only cost prompt tokens
+    schema = model.model_json_schema()
+    schema.pop("title", None)
+    for prop in schema.get("properties", {}).values():
+        prop.pop("title", None)
+        if "anyOf" in prop:  # Optional[X] -> X; a missing field already means "not given"
+            prop.update(next(s for s in prop.pop("anyOf") if s.get("type") != "null"))
+            prop.pop("default", None)
+    return schema
+
+class ToolRegistry:
+    """Function tools offered to the model: typed argument validation and concurrent execution.
+
+    All calls from one assistant message run at once on a small thread pool (the tools are DB/CPU bound and
+    synchronous), and their results go back to the model together in a single follow-up completion.
+    """
+    def __init__(self, max_workers: int = TOOL_MAX_WORKERS):
+        self._tools: Dict[str, Tool] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "batches": 0, "parallel": 0, "invalid": 0, "errors": 0, "timeouts": 0, "unknown": 0}
+
+    def register(self, name: str, description: str, args: Type[BaseModel]):
+        def wrap(fn: Callable[[str, BaseModel], Dict[str, Any]]):
+            self._tools[name] = Tool(name, description, args, fn)
+            return fn
+        return wrap
+
+    def specs(self) -> List[Dict[str, Any]]:
+        return [t.spec for t in self._tools.values()]
+
+    def run(self, session_id: str, name: str, arguments: str) -> Dict[str, Any]:
+        """Validate the model's JSON arguments and run one tool; failures become results the model can read."""
+        tool = self._tools.get(name)
+        if tool is None:
+            self._count("unknown")
+            return {"status":"error","message":f"Unknown tool: {name}"}
+        try:
+            args = tool.args.model_validate_json(arguments or "{}")
+        except ValidationError as e:
+            self._count("invalid")
+            problems = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'arguments'}: {err['msg']}" for err in e.errors())
+            return {"status":"error","message":f"Invalid arguments for {name}: {problems}"}
+        self._count("calls")
+        try:
+            with stage(f"tool.{name}"):
+                return tool.fn(session_id, args)
+        except Exception as e:
+            self._count("errors")
+            log.exception("tool %s failed", name)
+            return {"status":"error","message":f"{name} failed: {e}"}
+
+    async def arun_all(self, session_id: str, calls: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Run (name, arguments) pairs concurrently; results are in call order."""
+        self._count_batch(len(calls))
+        loop = asyncio.get_running_loop()
+        # copy_context so per-request stage timings (Server-Timing) still see the tool stages
+        futures = [asyncio.wait_for(loop.run_in_executor(self._pool, contextvars.copy_context().run,
+                                                         self.run, session_id, name, arguments), TOOL_TIMEOUT)
+                   for name, arguments in calls]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        return [r if not isinstance(r, BaseException) else self._unfinished(name, r) for (name, _), r in zip(calls, results)]
+
+    def _unfinished(self, name: str, err: BaseException) -> Dict[str, Any]:
+        if not isinstance(err, asyncio.TimeoutError):
+            self._count("errors")
+            log.warning("tool %s did not complete: %r", name, err)
+            return {"status":"error","message":f"{name} did not complete: {err!r}"}
+        # wait_for stops waiting but the pool thread runs on, so a write may still commit: the outcome is unknown
+        self._count("timeouts")
+        log.warning("tool %s still running after %.0fs", name, TOOL_TIMEOUT)
+        return {"status":"pending","message":f"{name} is still running after {TOOL_TIMEOUT:.0f}s, so its outcome is unknown. "
+                                             "Do not tell the user it failed or succeeded; say it is still being processed."}
+
+    def _count_batch(self, n: int):
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["parallel"] += n > 1
+
+    def _count(self, key: str):
+        with self._lock: self._stats[key] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, tools=list(self._tools), maxDepth=TOOL_MAX_DEPTH)
+
+tools = ToolRegistry()
+
+def followup_max_tokens(tool_names: List[str], requested: int) -> int:
+    # A roadmap reply renders the computed tables; a DB confirmation needs only a short answer
+    return requested if "ComputeAllocation" in tool_names else 400
+
+# ---------- Tools ----------
+class UpdatePortfolioArgs(BaseModel):
+    userName: str
+    userEmail: str = ""
+    region: str
+    monthlyInflow: float
+    monthlyOutflow: float
+    totalDebt: float
+    riskAppetite: str
+    preferredSector: str
+    investmentAmount: float
+    investmentPeriod: float
+    futureGoals: str
+    assetAllocation: str
+    equityRecommendation: str
+    alternateEquities: str
+    debtRecommendation: str
+    portfolioSummary: str
+
+# Tool (function) for DB update; Azure OpenAI supports tools/function-calling.
+@tools.register("UpdatePortfolioTool", "Persist portfolio to corporate DB (Azure SQL) and return status.", UpdatePortfolioArgs)
+def update_portfolio(session_id: str, args: UpdatePortfolioArgs) -> Dict[str, Any]:
+    row = args.model_dump()
+    row["investmentPeriod"] = int(row["investmentPeriod"])
+    # Written inline, not behind: one row per session, and the model must not confirm a save that failed
+    try:
+        writer.write_now("portfolio", dict(sessionId=session_id, **row))
+    except Exception as e:
+        log.warning("portfolio save failed for session %s: %s", session_id, e)
+        return {"status":"error","message":f"Portfolio was not saved: {str(getattr(e, 'orig', None) or e)[:300]}"}
+    return {"status":"success","message":"Portfolio updated"}
+
+class ComputeAllocationArgs(BaseModel):
+    cashInflow: Optional[float] = None
+    cashOutflow: Optional[float] = None
+    liabilities: Optional[float] = None
+    riskAppetite: Optional[Literal["Conservative", "Moderate", "Aggressive"]] = None
+    preferredSector: Optional[str] = None
+    investmentPeriod: Optional[float] = None
+    currency: Optional[str] = Field(None, description="Currency symbol, e.g. ₹, $, £, €")
+
+    @field_validator("riskAppetite", mode="before")
+    @classmethod
+    def _risk_case(cls, v):
+        return v.strip().capitalize() if isinstance(v, str) else v
+
+@tools.register("ComputeAllocation",
+                "Compute net surplus, asset allocation, instrument distribution and stock amounts, "
+                "and return ready-to-render roadmap tables. Omitted fields are taken from the intake profile.",
+                ComputeAllocationArgs)
+def compute_allocation(session_id: str, args: ComputeAllocationArgs) -> Dict[str, Any]:
+    profile = profiles.get(session_id)
+    given = args.model_dump(exclude_none=True)
+    pick = lambda key: given.get(key, profile.get(key))
+    missing = [k for k in ("cashInflow","cashOutflow","riskAppetite","preferredSector","investmentPeriod") if pick(k) is None]
+    if pick("currency") is None and profile.get("userCity"):
+        missing.append("currency")  # the city didn't resolve to a country; don't assume dollars
+    if missing:
+        return {"status":"error","message":f"Missing inputs: {', '.join(missing)}"}
+    roadmap = build_roadmap(float(pick("cashInflow")), float(pick("cashOutflow")), float(pick("liabilities") or 0),
+                            pick("riskAppetite"), pick("preferredSector"), int(pick("investmentPeriod")),
+                            pick("currency") or "$")
+    return {"status":"success", **roadmap}
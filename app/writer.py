@@ -0,0 +1,244 @@
+import os, time, queue, threading, logging
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import insert, select, update, bindparam
+
+from app.db import engine, SessionState, MessageLog, Portfolio, SessionSummary
+from app import metrics
+
+log = logging.getLogger("invest-soul.writer")
+
+# Write-behind persistence: request handlers enqueue rows, a background thread commits them in batches.
+DB_WRITE_MODE         = os.getenv("DB_WRITE_MODE", "async")   # "sync" writes inline (tests, local SQLite)
+WRITE_QUEUE_MAX       = int(os.getenv("WRITE_QUEUE_MAX", "5000"))
+WRITE_BATCH_SIZE      = int(os.getenv("WRITE_BATCH_SIZE", "200"))
+WRITE_FLUSH_INTERVAL  = float(os.getenv("WRITE_FLUSH_INTERVAL", "0.25"))
+WRITE_ENQUEUE_TIMEOUT = float(os.getenv("WRITE_ENQUEUE_TIMEOUT", "2.0"))
+WRITE_DRAIN_TIMEOUT   = float(os.getenv("WRITE_DRAIN_TIMEOUT", "10"))
+WRITE_SESSION_WAIT    = float(os.getenv("WRITE_SESSION_WAIT", "1.0"))   # max wait for one session's queued rows
+
+TABLES = {"message": MessageLog.__table__, "portfolio": Portfolio.__table__, "session": SessionState.__table__}
+UPSERTS = {"summary": (SessionSummary.__table__, "sessionId"),   # kind -> (table, primary key)
+           "profile": (SessionState.__table__, "sessionId")}
+
+def _upsert(conn, table, key: str, rows: List[Dict[str, Any]]):
+    # Partial rows for the same key are merged in order; existing keys become executemany UPDATEs, the rest one INSERT
+    latest: Dict[Any, Dict[str, Any]] = {}
+    for r in rows:
+        latest.setdefault(r[key], {}).update(r)
+    existing = set(conn.scalars(select(table.c[key]).where(table.c[key].in_(list(latest)))))
+    shapes: Dict[frozenset, List[Dict[str, Any]]] = {}
+    for k, r in latest.items():
+        if k in existing:
+            shapes.setdefault(frozenset(c for c in r if c != key), []).append(dict(r, _key=k))
+    for cols, updates in shapes.items():
+        # SET columns come from the parameter keys; "_key" only feeds the WHERE clause
+        conn.execute(update(table).where(table.c[key] == bindparam("_key")), updates)
+    inserts = [r for k, r in latest.items() if k not in existing]
+    if inserts:
+        conn.execute(insert(table), inserts)
+
+class WriteBehind:
+    def __init__(self, mode: str = DB_WRITE_MODE):
+        self.mode = mode
+        self._q: "queue.Queue[Tuple[str, Dict[str, Any], float]]" = queue.Queue(maxsize=WRITE_QUEUE_MAX)
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._pending: "Counter[str]" = Counter()  # sessionId -> rows queued or in flight
+        self._stats = {"enqueued": 0, "written": 0, "batches": 0, "salvaged": 0, "deadLetters": 0, "syncFallbacks": 0, "dropped": 0,
+                       "sessionWaitTimeouts": 0,
+                       "lastFlushLagMs": None, "maxFlushLagMs": 0.0, "avgFlushLagMs": None}
+
+    # ---------- lifecycle ----------
+    def start(self):
+        if self.mode != "async" or not engine or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = WRITE_DRAIN_TIMEOUT):
+        """Drain whatever is queued, then stop the flusher."""
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            log.warning("write-behind: %d rows left undrained after %.1fs", self._q.qsize(), timeout)
+        self._thread = None
+
+    def flush(self):
+        """Block until everything enqueued so far is committed (or failed)."""
+        if self._thread:
+            self._q.join()
+
+    def wait_session(self, session_id: str, timeout: float = WRITE_SESSION_WAIT) -> bool:
+        """Wait until one session's queued rows are committed (or failed), at most `timeout` seconds.
+
+        Unlike flush(), this doesn't wait on other sessions' writes, which never drain under steady traffic.
+        """
+        with self._drained:
+            if self._drained.wait_for(lambda: not self._pending[session_id], timeout):
+                return True
+            self._stats["sessionWaitTimeouts"] += 1
+            return False
+
+    # ---------- producers ----------
+    def submit(self, kind: str, row: Dict[str, Any]):
+        if not engine:
+            with self._lock: self._stats["dropped"] += 1
+            return
+        _stamp(kind, row)
+        item = (kind, row, time.monotonic())
+        with self._lock: self._stats["enqueued"] += 1
+        if not (self._thread and self._thread.is_alive()):
+            self._commit([item]); return
+        sid = row.get("sessionId")
+        with self._lock: self._pending[sid] += 1
+        try:
+            # Backpressure: callers wait for room; past the timeout they pay for the write themselves
+            self._q.put(item, timeout=WRITE_ENQUEUE_TIMEOUT)
+        except queue.Full:
+            with self._lock: self._stats["syncFallbacks"] += 1
+            try:
+                self._commit([item])
+            finally:
+                self._settle([item])
+
+    def write_now(self, kind: str, row: Dict[str, Any]):
+        """Commit one row inline, bypassing the queue, for writes whose outcome the caller must report."""
+        if not engine:
+            raise RuntimeError("no database configured")
+        _stamp(kind, row)
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            _write(conn, kind, [row])
+        metrics.record("db.write_now", time.perf_counter() - t0)
+        metrics.DB_ROWS.inc(kind)
+        with self._lock: self._stats["written"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, mode=self.mode if self._thread else "sync", queueDepth=self._q.qsize(),
+                        queueMax=WRITE_QUEUE_MAX, batchSize=WRITE_BATCH_SIZE, flushInterval=WRITE_FLUSH_INTERVAL)
+
+    # ---------- flusher ----------
+    def _run(self):
+        while True:
+            batch: List[Tuple[str, Dict[str, Any], float]] = []
+            deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+            while len(batch) < WRITE_BATCH_SIZE:
+                wait = deadline - time.monotonic()
+                if wait <= 0 and batch:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=max(wait, 0.05)))
+                except queue.Empty:
+                    if batch or self._stop.is_set():
+                        break
+            if batch:
+                try:
+                    self._commit(batch)
+                finally:
+                    self._settle(batch)
+                    for _ in batch: self._q.task_done()
+            elif self._stop.is_set():
+                return
+
+    def _settle(self, batch: List[Tuple[str, Dict[str, Any], float]]):
+        with self._drained:
+            for _, row, _ in batch:
+                sid = row.get("sessionId")
+                self._pending[sid] -= 1
+                if not self._pending[sid]:
+                    del self._pending[sid]
+            self._drained.notify_all()
+
+    def _commit(self, batch: List[Tuple[str, Dict[str, Any], float]]):
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for kind, row, _ in batch:
+            groups.setdefault(kind, []).append(row)
+        counts = {kind: len(rows) for kind, rows in groups.items()}
+        t0 = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                for kind, rows in _ordered(groups):
+                    _write(conn, kind, rows)
+        except Exception:
+            if not self._thread:
+                with self._lock: self._stats["deadLetters"] += len(batch)
+                raise  # inline write: the caller sees the error
+            log.exception("write-behind: batch of %d rows failed; retrying per table, then per row", len(batch))
+            counts = self._salvage(groups)
+        metrics.record("db.flush", time.perf_counter() - t0)
+        for kind, n in counts.items():
+            metrics.DB_ROWS.inc(kind, by=n)
+        lag_ms = (time.monotonic() - min(t for _, _, t in batch)) * 1000
+        with self._lock:
+            st = self._stats
+            st["written"] += sum(counts.values()); st["batches"] += 1
+            st["lastFlushLagMs"] = round(lag_ms, 2)
+            st["maxFlushLagMs"] = round(max(st["maxFlushLagMs"], lag_ms), 2)
+            st["avgFlushLagMs"] = round(lag_ms if st["avgFlushLagMs"] is None else 0.9 * st["avgFlushLagMs"] + 0.1 * lag_ms, 2)
+
+    def _salvage(self, groups: Dict[str, List[Dict[str, Any]]]) -> Dict[str, int]:
+        """Retry a failed batch one table at a time, then one row at a time, so a bad row only loses itself."""
+        with self._lock: self._stats["salvaged"] += 1
+        written: Dict[str, int] = {}
+        for kind, rows in _ordered(groups):
+            try:
+                with engine.begin() as conn:
+                    _write(conn, kind, rows)
+                written[kind] = len(rows)
+                continue
+            except Exception:
+                if len(rows) == 1:
+                    self._dead_letter(kind, rows[0])
+                    continue
+            for row in rows:
+                try:
+                    with engine.begin() as conn:
+                        _write(conn, kind, [row])
+                    written[kind] = written.get(kind, 0) + 1
+                except Exception:
+                    self._dead_letter(kind, row)
+        return written
+
+    def _dead_letter(self, kind: str, row: Dict[str, Any]):
+        log.exception("write-behind: dropped %s row for session %s", kind, row.get("sessionId"))
+        metrics.DB_DEAD_LETTERS.inc(kind)
+        with self._lock: self._stats["deadLetters"] += 1
+
+def _stamp(kind: str, row: Dict[str, Any]):
+    # Timestamps are taken at submit time, not flush time; updatedAt drives the incremental sessions export
+    table = TABLES.get(kind) if kind in TABLES else UPSERTS[kind][0]
+    now = datetime.utcnow()
+    if kind in TABLES and "createdAt" in table.c:
+        row.setdefault("createdAt", now)
+    if "updatedAt" in table.c:
+        row.setdefault("updatedAt", now)
+
+def _ordered(groups: Dict[str, List[Dict[str, Any]]]):
+    # Session rows first, so profile upserts and messages land on an existing UserSessions row
+    return sorted(groups.items(), key=lambda kv: kv[0] != "session")
+
+def _write(conn, kind: str, rows: List[Dict[str, Any]]):
+    if kind == "session":
+        # Insert-if-missing, so request handlers never read before writing
+        by_id: Dict[str, Dict[str, Any]] = {}
+        for r in rows:
+            by_id.setdefault(r["sessionId"], r)  # the first submit's createdAt is when the session started
+        existing = set(conn.scalars(select(SessionState.sessionId).where(SessionState.sessionId.in_(list(by_id)))))
+        missing = [r for sid, r in by_id.items() if sid not in existing]
+        if missing:
+            conn.execute(insert(SessionState.__table__), missing)
+    elif kind in UPSERTS:
+        _upsert(conn, *UPSERTS[kind], rows)
+    else:
+        conn.execute(insert(TABLES[kind]), rows)  # one executemany per table
+
+writer = WriteBehind()
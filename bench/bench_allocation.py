@@ -0,0 +1,61 @@
+"""Equivalence check and throughput benchmark: calc_allocation_batch vs scalar calc_allocation.
+
+    python -m bench.bench_allocation --rows 200000 --seed 7
+"""
+import argparse, time
+
+import numpy as np
+
+from app.allocation import calc_allocation
+from app.allocation_batch import calc_allocation_batch
+
+RISKS = np.array(["Conservative", "Moderate", "Aggressive", "aggr", "MOD", "cons", "", "unknown"])
+
+def random_profiles(rows: int, rng: np.random.Generator):
+    surplus = np.round(rng.uniform(-5_000, 500_000, rows), 2)
+    liabilities = np.round(rng.uniform(0, 1, rows) * np.abs(surplus) * rng.choice([0.1, 0.3, 0.6, 2.0], rows), 2)
+    period = rng.integers(0, 30, rows)
+    risk = rng.choice(RISKS, rows)
+    return risk, liabilities, period, surplus
+
+def check_equivalence(risk, liabilities, period, surplus) -> int:
+    batch = calc_allocation_batch(risk, liabilities, period, surplus)
+    mismatches = 0
+    for i in range(len(risk)):
+        s = calc_allocation(str(risk[i]), float(liabilities[i]), int(period[i]), float(surplus[i]))
+        got = {k: batch[k][i] for k in batch}
+        exact = (s["equity_pct"], s["savings_pct"], s["eq_split"]["direct_stocks"], s["eq_split"]["mutual_funds"],
+                 s["eq_split"]["debt"]) == (got["equity_pct"], got["savings_pct"], got["direct_stocks"],
+                                            got["mutual_funds"], got["debt"])
+        # np.round and round() may disagree on binary half-cent ties; allow one cent
+        close = abs(s["funds_equity"] - got["funds_equity"]) <= 0.0100001 and abs(s["funds_saving"] - got["funds_saving"]) <= 0.0100001
+        if not (exact and close):
+            mismatches += 1
+            if mismatches <= 5:
+                print("mismatch", i, risk[i], liabilities[i], period[i], surplus[i], s, got)
+    return mismatches
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--check-rows", type=int, default=50_000)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    bad = check_equivalence(*random_profiles(args.check_rows, rng))
+    print(f"equivalence: {args.check_rows - bad}/{args.check_rows} rows match")
+
+    risk, liabilities, period, surplus = random_profiles(args.rows, rng)
+    t0 = time.perf_counter()
+    for i in range(args.rows):
+        calc_allocation(str(risk[i]), float(liabilities[i]), int(period[i]), float(surplus[i]))
+    scalar = args.rows / (time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    calc_allocation_batch(risk, liabilities, period, surplus)
+    batch = args.rows / (time.perf_counter() - t0)
+    print(f"scalar: {scalar:,.0f} rows/s  batch: {batch:,.0f} rows/s  speedup: {batch / scalar:,.1f}x")
+    raise SystemExit(1 if bad else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""City -> country/currency lookup cost as the gazetteer grows.
+
+Pads the bundled cities with synthetic names (up to a GeoNames-sized dump) and times uncached lookups per match
+kind, next to the old approach of substring-scanning a list of names. Exact/alias/in-sentence lookups should
+stay flat; the substring scan grows linearly.
+
+    python -m bench.bench_gazetteer --sizes 0,10000,100000,300000
+"""
+import argparse, random, time
+
+from app.gazetteer import Gazetteer, read_cities, read_countries
+
+QUERIES = {
+    "exact":    ["Mumbai", "Pune", "London", "Singapore", "Austin", "Lyon"],
+    "alias":    ["Bombay", "Gurgaon", "Köln", "St. Louis", "Trivandrum", "NYC"],
+    "contains": ["I live in Navi Mumbai, Maharashtra", "based out of Hyderabad, Pakistan", "moved to Pune last year"],
+    "fuzzy":    ["Bangalor", "Hydrabad", "Chenai", "Ahmedabd"],
+    "miss":     ["xyzzy", "somewhere quiet"],
+}
+SYLLABLES = "ka ra ma ti lo ne su va do pi ha ze ku mo ri sa ba le no ga ya wu fe ch th sh".split()
+
+def synthetic(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    isos = list(read_countries())
+    for i in range(n):
+        name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+        yield (f"{name} {rng.choice(['Nagar', 'Pur', 'Ville', 'Town', 'City'])}" if i % 3 == 0 else name,
+               rng.choice(isos), rng.randint(1000, 200000), [])
+
+def per_call_us(fn, queries, rounds: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for q in queries:
+            fn(q)
+    return (time.perf_counter() - t0) / (rounds * len(queries)) * 1e6
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="0,10000,100000", help="synthetic cities added on top of the bundled set")
+    ap.add_argument("--rounds", type=int, default=200)
+    args = ap.parse_args()
+
+    countries, base = read_countries(), list(read_cities())
+    kinds = list(QUERIES) + ["substring scan"]
+    print(f"{'cities':>8} {'build ms':>9} {'nodes':>9}  " + "  ".join(f"{k:>14}" for k in kinds) + "   (us/call, uncached)")
+    rows = []
+    for extra in (int(s) for s in args.sizes.split(",")):
+        g = Gazetteer(base + list(synthetic(extra)), countries, cache_size=0)
+        names = [k for k in g.exact]  # the old heuristic: any(name in text) over a list of names
+        scan = lambda q, names=names: next((n for n in names if n in q.lower()), None)
+        cost = {k: per_call_us(g.lookup, qs, args.rounds) for k, qs in QUERIES.items()}
+        cost["substring scan"] = per_call_us(scan, QUERIES["miss"], max(1, args.rounds // 20))
+        rows.append((len(g.city_name), cost))
+        print(f"{len(g.city_name):>8} {g.build_ms:>9.0f} {len(g._goto):>9}  " + "  ".join(f"{cost[k]:>14.1f}" for k in kinds))
+
+    (n0, first), (n1, last) = rows[0], rows[-1]
+    print(f"\n{n0} -> {n1} cities ({n1 / n0:.0f}x): " + ", ".join(f"{k} {last[k] / first[k]:.1f}x" for k in kinds))
+
+if __name__ == "__main__":
+    main()
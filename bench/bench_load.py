@@ -0,0 +1,241 @@
+"""Offline load test: the API on SQLite against local Azure stand-ins (bench/stubs.py).
+
+Starts the stubs and the app as subprocesses, drives scripted intake conversations through
+/speech/token, /chat and /market/top-stocks at the given concurrency, and writes p50/p95/p99,
+requests/s, per-stage Server-Timing percentiles and DB writes per chat turn to a JSON file.
+
+    python -m bench.bench_load --conversations 200 --concurrency 32
+    python -m bench.bench_load --compare bench/results/load-<previous>.json
+"""
+import argparse, asyncio, json, os, platform, random, re, subprocess, sys, tempfile, time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from bench import stubs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NAMES = ["Priya Sharma", "Arjun", "Meera Iyer", "Rahul Verma", "Ananya", "Vikram Rao", "Sara Khan", "Rohan"]
+CITIES = ["Pune", "Mumbai", "Bengaluru", "Hyderabad", "Chennai", "London", "Austin", "Berlin"]
+RISKS = ["conservative", "moderate", "aggressive", "medium", "high"]
+SECTORS = ["Tech", "Finance", "Energy", "Healthcare", "Consumer Goods"]
+GOALS = ["Buy a house and retire early", "Children's education", "Retirement", "Build an emergency fund and travel"]
+QUESTIONS = ["What is the difference between a mutual fund and an index fund?",
+             "Should I pay off my loans before investing more?",
+             "How often should I rebalance my portfolio?"]
+
+def script(rng: random.Random) -> Dict[str, Any]:
+    """One scripted intake conversation: greeting, nine answers, an off-script question, the final period."""
+    inflow, sector = rng.choice([80_000, 1.5e5, 2.5e5, 4e5]), rng.choice(SECTORS)
+    answers = ["hi", f"My name is {rng.choice(NAMES)}", f"I live in {rng.choice(CITIES)}",
+               rng.choice([f"{inflow:,.0f}", f"{inflow / 1e5:g} lakh"]), f"{inflow * rng.uniform(0.3, 0.7):,.0f}",
+               rng.choice(["none", "0", f"{inflow * 2:,.0f}"]), rng.choice(RISKS), sector, rng.choice(GOALS)]
+    answers.insert(rng.randrange(2, len(answers)), rng.choice(QUESTIONS))
+    answers.append(f"{rng.randint(2, 15)} years")
+    return {"answers": answers, "sector": sector}
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[k], 2)
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    v = sorted(values)
+    return {"count": len(v), "mean": round(sum(v) / len(v), 2) if v else None, "p50": percentile(v, 50),
+            "p95": percentile(v, 95), "p99": percentile(v, 99), "max": round(v[-1], 2) if v else None}
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in header.split(","):
+        m = re.match(r"\s*([^;]+);dur=([\d.]+)", part)
+        if m:
+            out[m.group(1)] = out.get(m.group(1), 0.0) + float(m.group(2))
+    return out
+
+def db_rows(metrics_text: str) -> Dict[str, float]:
+    return {m.group(1): float(m.group(2))
+            for m in re.finditer(r'^invest_soul_db_rows_written_total\{kind="([^"]+)"\} ([\d.e+]+)$', metrics_text, re.M)}
+
+class Recorder:
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.stages: Dict[str, List[float]] = {}
+        self.chat_turns = 0
+
+    async def call(self, client: httpx.AsyncClient, label: str, method: str, url: str, **kw) -> Optional[httpx.Response]:
+        t0 = time.perf_counter()
+        try:
+            r = await client.request(method, url, **kw)
+        except httpx.HTTPError as e:
+            self.errors.setdefault(label, {}).setdefault(type(e).__name__, 0)
+            self.errors[label][type(e).__name__] += 1
+            return None
+        self.latency.setdefault(label, []).append((time.perf_counter() - t0) * 1000)
+        if r.status_code >= 400:
+            self.errors.setdefault(label, {}).setdefault(str(r.status_code), 0)
+            self.errors[label][str(r.status_code)] += 1
+            return None
+        if label == "chat":
+            self.chat_turns += 1
+            for name, ms in parse_server_timing(r.headers.get("server-timing", "")).items():
+                self.stages.setdefault(name, []).append(ms)
+        return r
+
+async def conversation(client: httpx.AsyncClient, rec: Recorder, rng: random.Random, history_mode: str):
+    convo = script(rng)
+    await rec.call(client, "speech_token", "GET", "/speech/token")
+    history: List[Dict[str, str]] = []
+    session_id = None
+    for answer in convo["answers"]:
+        history.append({"role": "user", "content": answer})
+        body = {"messages": history if history_mode == "client" else history[-1:], "sessionId": session_id,
+                "history": history_mode}
+        r = await rec.call(client, "chat", "POST", "/chat", json=body)
+        if r is None:
+            return
+        data = r.json()
+        session_id = data["sessionId"]
+        history.append({"role": "assistant", "content": data["content"]})
+        if answer == convo["sector"]:
+            await rec.call(client, "market_top_stocks", "GET", "/market/top-stocks", params={"sector": answer})
+
+async def drive(base_url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    rec = Recorder()
+    seeds = random.Random(args.seed)
+    jobs: asyncio.Queue = asyncio.Queue()
+    for _ in range(args.conversations):
+        jobs.put_nowait(random.Random(seeds.random()))
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        async def worker():
+            while not jobs.empty():
+                await conversation(client, rec, jobs.get_nowait(), args.history)
+        before = db_rows((await client.get("/metrics")).text)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - t0
+        await asyncio.sleep(1.0)  # let the write-behind flusher commit the tail
+        after = db_rows((await client.get("/metrics")).text)
+        server = {name: (await client.get(f"/debug/{name}")).json() for name in ("admission", "llm-cache", "writer", "intake")}
+
+    rows = {k: after.get(k, 0) - before.get(k, 0) for k in after}
+    requests = sum(len(v) for v in rec.latency.values())
+    return {
+        "summary": {
+            "elapsedSeconds": round(elapsed, 3), "requests": requests,
+            "errors": sum(n for e in rec.errors.values() for n in e.values()),
+            "rps": round(requests / elapsed, 2), "chatTurns": rec.chat_turns,
+            "chatTurnsPerSecond": round(rec.chat_turns / elapsed, 2),
+            # /metrics is per process, so the row count is only complete with a single worker
+            "dbRowsPerTurn": round(sum(rows.values()) / rec.chat_turns, 3) if rec.chat_turns and args.workers == 1 else None,
+            "dbRowsByKind": rows if args.workers == 1 else None,
+        },
+        "endpoints": {label: summarize(v) for label, v in sorted(rec.latency.items())},
+        "errors": rec.errors,
+        "stages": {name: summarize(v) for name, v in sorted(rec.stages.items())},
+        "server": server,
+    }
+
+def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout:.0f}s")
+
+def git_commit() -> Dict[str, Any]:
+    run = lambda *cmd: subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return {"commit": run("git", "rev-parse", "--short", "HEAD") or None,
+            "dirty": bool(run("git", "status", "--porcelain", "--untracked-files=no"))}
+
+def compare(current: Dict[str, Any], previous_path: str):
+    with open(previous_path) as f:
+        prev = json.load(f)
+    print(f"\nvs {previous_path} ({prev['meta'].get('commit')})")
+    pct = lambda new, old: f"{(new - old) / old * 100:+.1f}%" if new is not None and old else "n/a"
+    s, p = current["summary"], prev["summary"]
+    print(f"  rps {p['rps']} -> {s['rps']} ({pct(s['rps'], p['rps'])})")
+    print(f"  dbRowsPerTurn {p.get('dbRowsPerTurn')} -> {s.get('dbRowsPerTurn')}")
+    for label, cur in current["endpoints"].items():
+        old = prev["endpoints"].get(label)
+        if old:
+            print(f"  {label:<18} " + "  ".join(f"{q} {old[q]} -> {cur[q]} ({pct(cur[q], old[q])})" for q in ("p50", "p95", "p99")))
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--conversations", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--history", choices=["client", "server"], default="client")
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn workers for the app")
+    ap.add_argument("--port", type=int, default=8800)
+    ap.add_argument("--stub-port", type=int, default=8799)
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--out", default=os.path.join(ROOT, "bench", "results"))
+    ap.add_argument("--label", default="", help="free-form tag stored with the results")
+    ap.add_argument("--compare", help="previous results JSON to diff against")
+    ap.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="extra env for the app, repeatable")
+    stubs.add_arguments(ap)
+    args = ap.parse_args()
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    app_url = f"http://127.0.0.1:{args.port}"
+    tmp = tempfile.mkdtemp(prefix="invest-soul-bench-")
+    env = dict(os.environ,
+               LOCAL_SQLITE_PATH=os.path.join(tmp, "bench.db"),
+               SESSION_CACHE_PATH=os.path.join(tmp, "sessions.sqlite"),
+               AZURE_OPENAI_ENDPOINT=stub_url, AZURE_OPENAI_API_KEY="bench", AZURE_OPENAI_DEPLOYMENT="bench",
+               AZURE_SEARCH_ENDPOINT=stub_url, AZURE_SEARCH_API_KEY="bench", AZURE_SEARCH_INDEX="market-index",
+               SPEECH_KEY="bench", SPEECH_REGION="bench",
+               SPEECH_TOKEN_URL=f"{stub_url}/sts/v1.0/issueToken",
+               SPEECH_RELAY_URL=f"{stub_url}/cognitiveservices/avatar/relay/token/v1")
+    env.update(kv.split("=", 1) for kv in args.app_env)
+    stub_args = [f"--first-token-ms={args.first_token_ms}", f"--tokens-per-sec={args.tokens_per_sec}",
+                 f"--reply-tokens={args.reply_tokens}", f"--tool-calls={args.tool_calls}",
+                 f"--throttle-rate={args.throttle_rate}", f"--retry-after-ms={args.retry_after_ms}",
+                 f"--search-ms={args.search_ms}", f"--sts-ms={args.sts_ms}", f"--seed={args.seed}"]
+
+    # Same order as startup.sh: migrate once, then start the workers (which only check the schema version)
+    subprocess.run([sys.executable, "-m", "app.db", "migrate"], cwd=ROOT, env=env, check=True)
+    procs = [subprocess.Popen([sys.executable, "-m", "bench.stubs", f"--port={args.stub_port}", *stub_args], cwd=ROOT),
+             subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(args.port),
+                               "--workers", str(args.workers), "--log-level", "warning"], cwd=ROOT, env=env)]
+    try:
+        wait_ready(f"{stub_url}/stats", procs[0])
+        wait_ready(f"{app_url}/healthy", procs[1])
+        result = asyncio.run(drive(app_url, args))
+        result["stubs"] = httpx.get(f"{stub_url}/stats").json()
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(10)
+
+    result["meta"] = dict(git_commit(), label=args.label, timestamp=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                          python=platform.python_version(), args=vars(args))
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"load-{datetime.now():%Y%m%d-%H%M%S}-{result['meta']['commit'] or 'nogit'}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+
+    s = result["summary"]
+    print(f"{s['requests']} requests in {s['elapsedSeconds']}s: {s['rps']} req/s, {s['chatTurnsPerSecond']} chat turns/s, "
+          f"{s['errors']} errors, {s['dbRowsPerTurn']} DB rows/turn")
+    for label, st in result["endpoints"].items():
+        print(f"  {label:<18} n={st['count']:<6} p50={st['p50']}ms p95={st['p95']}ms p99={st['p99']}ms")
+    print(f"results: {path}")
+    if args.compare:
+        compare(result, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Local market snapshot: per-query latency of /market/top-stocks lookups as the universe grows.
+
+Publishes synthetic snapshots into a temp directory and times top-5 queries served from the precomputed
+leaders, filtered queries (minScore + exclude) walking the memory-mapped columns, and a hot swap.
+
+    python -m bench.bench_market --sizes 1000,100000,1000000
+"""
+import argparse, random, tempfile, time
+
+from app.market_snapshot import SnapshotStore, write_snapshot
+
+SECTORS = ["tech", "finance", "energy", "healthcare", "consumer goods"]
+
+def per_call_us(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="1000,100000,1000000")
+    ap.add_argument("--calls", type=int, default=20000)
+    args = ap.parse_args()
+
+    rng = random.Random(7)
+    print(f"{'rows':>9} {'publish ms':>11} {'swap ms':>8} {'top5 us':>8} {'filtered us':>12}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        rows = [{"symbol": f"SYM{i}", "name": f"Company {i}", "sector": rng.choice(SECTORS),
+                 "performanceScore": rng.uniform(0, 100)} for i in range(n)]
+        root = tempfile.mkdtemp(prefix="invest-soul-market-")
+        t0 = time.perf_counter()
+        write_snapshot(rows, root, source="bench")
+        publish_ms = (time.perf_counter() - t0) * 1000
+        store = SnapshotStore(root, poll=3600)
+        t0 = time.perf_counter()
+        store.refresh()
+        swap_ms = (time.perf_counter() - t0) * 1000
+        held = [r["symbol"] for r in store.top("tech", 3)]
+        top5 = per_call_us(lambda: store.top("tech", 5), args.calls)
+        filtered = per_call_us(lambda: store.top("tech", 5, min_score=40, exclude=held), args.calls // 10)
+        print(f"{n:>9} {publish_ms:>11.0f} {swap_ms:>8.1f} {top5:>8.2f} {filtered:>12.2f}")
+
+if __name__ == "__main__":
+    main()
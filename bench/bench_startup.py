@@ -0,0 +1,61 @@
+"""Worker cold start: spawn the app N times and time process start -> first 200 from /healthy.
+
+Compares the worker's own import -> ready time (/debug/startup) against STARTUP_READY_TARGET_MS
+and prints the slowest imports from a fresh `python -X importtime`.
+
+    python -m bench.bench_startup --runs 5
+"""
+import argparse, os, statistics, subprocess, sys, tempfile, time
+
+import httpx
+
+from app.startup import STARTUP_READY_TARGET_MS, import_breakdown
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def time_to_ready(port: int, env: dict, timeout: float = 60):
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=ROOT, env=env)
+    try:
+        while time.perf_counter() - t0 < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"app exited with {proc.returncode}")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/healthy", timeout=0.5).status_code == 200:
+                    ready_ms = (time.perf_counter() - t0) * 1000
+                    return ready_ms, httpx.get(f"http://127.0.0.1:{port}/debug/startup").json()
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.02)
+        raise RuntimeError(f"not ready after {timeout:.0f}s")
+    finally:
+        proc.terminate(); proc.wait(10)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--port", type=int, default=8810)
+    ap.add_argument("--top", type=int, default=12)
+    args = ap.parse_args()
+
+    # One SQLite file for all runs: the first run migrates it, later ones only check the schema version
+    env = dict(os.environ, LOCAL_SQLITE_PATH=os.path.join(tempfile.mkdtemp(prefix="invest-soul-startup-"), "startup.db"))
+    spawned, ready, report = [], [], {}
+    for i in range(args.runs):
+        ms, report = time_to_ready(args.port, env)
+        spawned.append(ms); ready.append(report["phasesMs"]["ready"])
+        print(f"run {i + 1}: spawn -> serving {ms:.0f} ms, worker import -> ready {ready[-1]:.0f} ms ({report['phasesMs']})")
+
+    median = statistics.median(ready)
+    verdict = "OK" if median <= STARTUP_READY_TARGET_MS else "OVER TARGET"
+    print(f"\nspawn -> serving median {statistics.median(spawned):.0f} ms")
+    print(f"import -> ready median {median:.0f} ms, min {min(ready):.0f} ms, target {STARTUP_READY_TARGET_MS:.0f} ms: {verdict}")
+    print("heavy modules loaded (prewarm included):", {k: v for k, v in report["heavyModulesLoaded"].items() if v} or "none")
+    print("\nslowest imports (fresh interpreter):")
+    for row in import_breakdown(top=args.top):
+        print(f"  {row['cumulativeMs']:8.1f} ms  {'  ' * row['depth']}{row['module']}")
+    sys.exit(0 if median <= STARTUP_READY_TARGET_MS else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Local stand-ins for the Azure services the API calls, for offline load tests.
+
+One FastAPI app serves:
+  - Azure OpenAI chat completions (plain and streamed) with configurable latency, token rate and tool calls
+  - an Azure AI Search index (search.post.search, $count)
+  - Speech STS issueToken and the avatar relay token
+
+    python -m bench.stubs --port 8799 --first-token-ms 300 --tokens-per-sec 80
+"""
+import argparse, asyncio, json, random, re, time, uuid
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+SECTORS = {"tech": ["TCS", "Infosys", "HCL Tech", "LTIMindtree", "Wipro", "Tech Mahindra"],
+           "finance": ["HDFC Bank", "ICICI Bank", "Axis Bank", "SBI", "Kotak Bank"],
+           "energy": ["Reliance Industries", "NTPC", "Tata Power", "Adani Green", "ONGC"],
+           "healthcare": ["Sun Pharma", "Dr Reddy's", "Cipla", "Apollo Hospitals", "Divi's Labs"],
+           "consumer goods": ["HUL", "ITC", "Nestle India", "Britannia", "Dabur"]}
+FILLER = ("Based on your profile, a balanced plan keeps an emergency fund, spreads equity across quality "
+          "large caps and adds debt funds for stability. Review the allocation every year. ").split()
+
+def build_app(cfg: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="invest-soul bench stubs")
+    rng = random.Random(cfg.seed)
+    stats = {"completions": 0, "toolCalls": 0, "searches": 0, "tokens": 0, "throttled": 0}
+
+    def reply_words() -> List[str]:
+        n = max(1, int(rng.gauss(cfg.reply_tokens, cfg.reply_tokens * 0.2)))
+        return [FILLER[i % len(FILLER)] for i in range(n)]
+
+    def wants_tools(body: Dict[str, Any]) -> List[str]:
+        # Profile complete (last answer is the investment period) -> ComputeAllocation; "save" -> UpdatePortfolioTool;
+        # both in one answer -> both calls in one assistant message
+        if not cfg.tool_calls or not body.get("tools") or body.get("tool_choice") == "none" \
+                or any(m.get("role") == "tool" for m in body["messages"]):
+            return []
+        last = next((m.get("content") or "" for m in reversed(body["messages"]) if m.get("role") == "user"), "")
+        names = []
+        if re.search(r"\b\d+\s*(years?|yrs?)\b", last, re.I):
+            names.append("ComputeAllocation")
+        if re.search(r"\bsave\b", last, re.I):
+            names.append("UpdatePortfolioTool")
+        return names
+
+    def usage(body: Dict[str, Any], completion_tokens: int) -> Dict[str, int]:
+        prompt = sum(len(m.get("content") or "") for m in body["messages"]) // 4
+        return {"prompt_tokens": prompt, "completion_tokens": completion_tokens, "total_tokens": prompt + completion_tokens}
+
+    def tool_call(name: str) -> Dict[str, Any]:
+        args = {} if name == "ComputeAllocation" else {
+            "userName": "Bench", "region": "India", "monthlyInflow": 150000, "monthlyOutflow": 60000, "totalDebt": 0,
+            "riskAppetite": "Moderate", "preferredSector": "Tech", "investmentAmount": 90000, "investmentPeriod": 7,
+            "futureGoals": "House", "assetAllocation": "60/40", "equityRecommendation": "TCS", "alternateEquities": "Infosys",
+            "debtRecommendation": "Debt funds", "portfolioSummary": "Bench portfolio"}
+        return {"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+
+    def throttled() -> JSONResponse | None:
+        if cfg.throttle_rate and rng.random() < cfg.throttle_rate:
+            stats["throttled"] += 1
+            return JSONResponse({"error": {"code": "429", "message": "Rate limit is exceeded."}}, status_code=429,
+                                headers={"retry-after-ms": str(cfg.retry_after_ms), "retry-after": str(max(1, cfg.retry_after_ms // 1000))})
+        return None
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def completions(deployment: str, request: Request):
+        body = await request.json()
+        if (resp := throttled()) is not None:
+            return resp
+        stats["completions"] += 1
+        tool = wants_tools(body)
+        words = [] if tool else reply_words()
+        stats["tokens"] += len(words)
+        stats["toolCalls"] += len(tool)
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:12]}", "created": int(time.time()), "model": deployment}
+        finish = "tool_calls" if tool else ("length" if len(words) >= body.get("max_tokens", 10**6) else "stop")
+        words = words[:body.get("max_tokens", len(words))]
+
+        if not body.get("stream"):
+            await asyncio.sleep(cfg.first_token_ms / 1000 + len(words) / cfg.tokens_per_sec)
+            message = {"role": "assistant", "content": None if tool else " ".join(words)}
+            if tool:
+                message["tool_calls"] = [tool_call(t) for t in tool]
+            return dict(base, object="chat.completion", usage=usage(body, len(words)),
+                        choices=[{"index": 0, "message": message, "finish_reason": finish}])
+
+        async def events():
+            await asyncio.sleep(cfg.first_token_ms / 1000)
+            chunk = lambda delta, fr=None: "data: " + json.dumps(dict(base, object="chat.completion.chunk",
+                choices=[{"index": 0, "delta": delta, "finish_reason": fr}])) + "\n\n"
+            if tool:
+                yield chunk({"role": "assistant", "tool_calls": [dict(tool_call(t), index=i) for i, t in enumerate(tool)]})
+            for i, w in enumerate(words):
+                yield chunk({"content": (" " if i else "") + w})
+                await asyncio.sleep(1 / cfg.tokens_per_sec)
+            yield chunk({}, finish)
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/openai/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "bench", "object": "model"}]}
+
+    @app.post("/indexes('{index}')/docs/search.post.search")
+    async def search(index: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(cfg.search_ms / 1000)
+        stats["searches"] += 1
+        sector = (body.get("search") or "").lower()
+        doc = lambda sec, i, n: {"@search.score": 1.0, "symbol": n, "name": n, "sector": sec, "performanceScore": round(95 - 3.5 * i, 1)}
+        if sector == "*":  # full export, as used to publish a market snapshot
+            return {"value": [doc(sec, i, n) for sec, names in SECTORS.items() for i, n in enumerate(names)]}
+        names = SECTORS.get(sector, SECTORS["tech"])
+        return {"value": [doc(sector, i, n) for i, n in enumerate(names)][:body.get("top", 5)]}
+
+    @app.get("/indexes('{index}')/docs/$count")
+    async def count(index: str):
+        return PlainTextResponse(str(sum(len(v) for v in SECTORS.values())))
+
+    @app.post("/sts/v1.0/issueToken")
+    async def issue_token():
+        await asyncio.sleep(cfg.sts_ms / 1000)
+        return PlainTextResponse(f"bench-token-{uuid.uuid4().hex}")
+
+    @app.get("/cognitiveservices/avatar/relay/token/v1")
+    async def relay_token():
+        await asyncio.sleep(cfg.sts_ms / 1000)
+        return {"Urls": ["turn:127.0.0.1:3478"], "Username": "bench", "Password": uuid.uuid4().hex, "ttl": 86400}
+
+    @app.get("/stats")
+    async def stub_stats():
+        return stats
+
+    return app
+
+def add_arguments(ap: argparse.ArgumentParser):
+    ap.add_argument("--first-token-ms", type=float, default=300)
+    ap.add_argument("--tokens-per-sec", type=float, default=80)
+    ap.add_argument("--reply-tokens", type=int, default=60)
+    ap.add_argument("--tool-calls", type=int, default=1, help="1: answer tool-eligible turns with tool calls")
+    ap.add_argument("--throttle-rate", type=float, default=0.0, help="share of completions answered with 429")
+    ap.add_argument("--retry-after-ms", type=int, default=500)
+    ap.add_argument("--search-ms", type=float, default=40)
+    ap.add_argument("--sts-ms", type=float, default=60)
+    ap.add_argument("--seed", type=int, default=7)
+
+def main():
+    import uvicorn
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8799)
+    add_arguments(ap)
+    cfg = ap.parse_args()
+    uvicorn.run(build_app(cfg), host=cfg.host, port=cfg.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
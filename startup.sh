@@ -5,6 +5,9 @@ PORT="${PORT:-8000}"
 WORKERS="${WORKERS:-2}"
 TIMEOUT="${TIMEOUT:-600}"
 
+# Schema changes run once per deployment, not in every worker's startup hook
+python -m app.db migrate
+
 exec gunicorn main:app \
   --workers "${WORKERS}" \
   --worker-class uvicorn.workers.UvicornWorker \
@@ -0,0 +1,15 @@
+import os, sys, tempfile
+
+# The app reads its configuration at import time: point it at a throwaway SQLite file and write synchronously
+_tmp = tempfile.mkdtemp(prefix="invest-soul-tests-")
+os.environ.setdefault("LOCAL_SQLITE_PATH", os.path.join(_tmp, "test.db"))
+os.environ.setdefault("SESSION_CACHE_PATH", os.path.join(_tmp, "sessions.sqlite"))
+os.environ.setdefault("DB_WRITE_MODE", "sync")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    from app import db
+    db.migrate()
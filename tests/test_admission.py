@@ -0,0 +1,153 @@
+import asyncio, time
+
+import pytest
+
+import app.admission as adm
+from app.admission import Admission, Rejected, retry_hint
+
+@pytest.fixture
+def limits(monkeypatch):
+    def set_(**kw):
+        for k, v in kw.items():
+            monkeypatch.setattr(adm, k, v)
+    set_(AOAI_MAX_CONCURRENCY=1, ADMISSION_QUEUE_MAX=8, ADMISSION_MAX_WAIT=2.0, ADMISSION_SESSION_MAX=3,
+         AOAI_RETRY_BASE=0.01)
+    return set_
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_concurrency_is_bounded(limits):
+    limits(AOAI_MAX_CONCURRENCY=2)
+    a, peak = Admission(), 0
+
+    async def turn(i):
+        nonlocal peak
+        async with a.aslot(f"s{i}", 10):
+            peak = max(peak, a.active)
+            await asyncio.sleep(0.02)
+
+    async def main():
+        await asyncio.gather(*(turn(i) for i in range(6)))
+    run(main())
+    assert peak == 2
+    assert a.stats()["admitted"] == 6 and a.active == 0 and a.queued == 0
+
+def test_sessions_are_served_round_robin(limits):
+    a, order = Admission(), []
+
+    async def turn(session, tag):
+        async with a.aslot(session, 10):
+            order.append(tag)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        holder = await a.acquire("other", 10)  # the only slot is taken, so everything below queues
+        tasks = [asyncio.create_task(turn("chatty", "c1")), asyncio.create_task(turn("chatty", "c2")),
+                 asyncio.create_task(turn("chatty", "c3"))]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(turn("quiet", "q1")))
+        await asyncio.sleep(0.01)
+        a.release(holder)
+        await asyncio.gather(*tasks)
+    run(main())
+    # The quiet session queued last but goes second, not behind all of the chatty session's turns
+    assert order == ["c1", "q1", "c2", "c3"]
+
+def test_per_session_limit(limits):
+    limits(ADMISSION_SESSION_MAX=1)
+    a = Admission()
+
+    async def main():
+        t = await a.acquire("s", 10)
+        with pytest.raises(Rejected) as e:
+            await a.acquire("s", 10)
+        a.release(t)
+        return e.value
+    err = run(main())
+    assert err.reason == "session" and err.retry_after >= 1
+    assert a.per_session == {}
+
+def test_full_queue_sheds_load(limits):
+    limits(ADMISSION_QUEUE_MAX=1)
+    a = Admission()
+
+    async def main():
+        holder = await a.acquire("h", 10)
+        waiter = asyncio.create_task(a.acquire("w", 10))
+        await asyncio.sleep(0.01)
+        with pytest.raises(Rejected) as e:
+            await a.acquire("x", 10)
+        a.release(holder)
+        a.release(await waiter)
+        return e.value
+    assert run(main()).reason == "queue"
+    assert a.stats()["rejectedQueue"] == 1
+
+def test_wait_is_bounded_and_cancellation_gives_the_place_back(limits):
+    limits(ADMISSION_MAX_WAIT=0.05)
+    a = Admission()
+
+    async def main():
+        holder = await a.acquire("h", 10)
+        with pytest.raises(Rejected) as e:
+            await a.acquire("w", 10)
+        task = asyncio.create_task(a.acquire("c", 10))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        a.release(holder)
+        return e.value
+    assert run(main()).reason == "timeout"
+    assert a.queued == 0 and a.active == 0 and a.per_session == {}
+
+def test_token_bucket_paces_admission(limits):
+    a = Admission()
+    a.tpm = adm.TokenBucket(6000)  # 100 tokens/s
+    limits(AOAI_MAX_CONCURRENCY=4)
+
+    async def main():
+        async with a.aslot("s1", 6000):
+            pass
+        t0 = time.monotonic()
+        async with a.aslot("s2", 10):  # the first turn drained the bucket; 10 tokens take ~0.1s to refill
+            return time.monotonic() - t0
+    assert 0.05 <= run(main()) < 1.0
+
+class _RateLimited(Exception):
+    status_code = 429
+    def __init__(self, headers):
+        super().__init__("429")
+        self.response = type("R", (), {"headers": headers})()
+
+def test_upstream_429_is_retried_then_surfaced(limits):
+    a, calls = Admission(), []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise _RateLimited({"retry-after-ms": "20"})
+        return "ok"
+    assert run(a.acall(flaky)) == "ok"
+    assert a.stats()["retries"] == 2
+
+    async def always():
+        raise _RateLimited({})
+    with pytest.raises(Rejected) as e:
+        run(a.acall(always))
+    assert e.value.reason == "upstream"
+    assert a.stats()["gaveUp"] == 1
+
+def test_long_upstream_hint_is_passed_on(limits):
+    async def throttled():
+        raise _RateLimited({"retry-after": "90"})
+    with pytest.raises(Rejected) as e:
+        run(Admission().acall(throttled))
+    assert e.value.retry_after == 90
+
+def test_retry_hint():
+    assert retry_hint(_RateLimited({"retry-after-ms": "1500"})) == 1.5
+    assert retry_hint(_RateLimited({"retry-after": "3"})) == 3.0
+    assert retry_hint(_RateLimited({"retry-after": "soon"})) is None
+    assert retry_hint(ValueError()) is None
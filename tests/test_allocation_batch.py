@@ -0,0 +1,113 @@
+import io, json
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app.allocation import calc_allocation
+from app.allocation_batch import calc_allocation_batch
+
+RISKS = ["Conservative", "Moderate", "Aggressive", "aggr", "MOD", "cons", "", "unknown"]
+SPLIT = ("direct_stocks", "mutual_funds", "debt")
+
+def random_profiles(rows, seed=7):
+    rng = np.random.default_rng(seed)
+    surplus = np.round(rng.uniform(-5_000, 500_000, rows), 2)
+    liabilities = np.round(rng.uniform(0, 1, rows) * np.abs(surplus) * rng.choice([0.1, 0.3, 0.6, 2.0], rows), 2)
+    return list(rng.choice(RISKS, rows)), liabilities.tolist(), rng.integers(0, 30, rows).tolist(), surplus.tolist()
+
+def boundary_profiles():
+    # Liability thresholds (20% / 50% of surplus), the 2-year override and non-positive surpluses, for every risk label
+    cases = []
+    for risk in RISKS + [None]:
+        for surplus in (0.0, -100.0, 10_000.0):
+            for liabilities in (0.0, 0.2 * surplus, 0.2 * surplus + 0.01, 0.5 * surplus, 0.5 * surplus + 0.01, 50_000.0):
+                for period in (0, 1, 2, 3):
+                    cases.append((risk, liabilities, period, surplus))
+    return [list(c) for c in zip(*cases)]
+
+def scalar(risk, liabilities, period, surplus):
+    out = []
+    for r, l, p, s in zip(risk, liabilities, period, surplus):
+        a = calc_allocation(r, l, p, s)
+        out.append(dict(a["eq_split"], equity_pct=a["equity_pct"], savings_pct=a["savings_pct"],
+                        funds_equity=a["funds_equity"], funds_saving=a["funds_saving"]))
+    return out
+
+def assert_matches(expected, got):
+    for i, e in enumerate(expected):
+        row = {k: got[k][i] for k in got}
+        assert (row["equity_pct"], row["savings_pct"]) == (e["equity_pct"], e["savings_pct"]), i
+        assert tuple(row[k] for k in SPLIT) == tuple(e[k] for k in SPLIT), i
+        # np.round and round() can land on different sides of a binary half-cent tie
+        assert row["funds_equity"] == pytest.approx(e["funds_equity"], abs=0.0100001), i
+        assert row["funds_saving"] == pytest.approx(e["funds_saving"], abs=0.0100001), i
+
+@pytest.mark.parametrize("profiles", [random_profiles(20_000), boundary_profiles()], ids=["random", "boundary"])
+def test_batch_matches_scalar(profiles):
+    assert_matches(scalar(*profiles), calc_allocation_batch(*profiles))
+
+def test_overrides():
+    got = calc_allocation_batch(["Aggressive", "Aggressive", "Moderate", "Aggressive", "Conservative"],
+                                [1_000, 3_000, 0, 0, 0], [10, 10, 10, 1, 10], [10_000] * 5)
+    splits = list(zip(*(got[k].tolist() for k in SPLIT)))
+    # aggressive + low liabilities, aggressive + medium liabilities, moderate, under 2 years, conservative
+    assert splits == [(70, 20, 10), (50, 30, 20), (50, 30, 20), (30, 40, 30), (30, 40, 30)]
+    assert got["equity_pct"].tolist() == [85, 85, 60, 85, 30]
+
+# ---------- HTTP entry points ----------
+@pytest.fixture(scope="module")
+def client():
+    from app.main import app
+    with TestClient(app) as c:
+        yield c
+
+def _decode_ndjson(body: bytes):
+    cols = {}
+    for line in body.decode().splitlines():
+        for k, v in json.loads(line).items():
+            if k != "offset":
+                cols.setdefault(k, []).extend(v)
+    return cols
+
+def _decode_csv(body: bytes):
+    lines = body.decode().splitlines()
+    names = lines[0].split(",")
+    rows = [[float(v) for v in line.split(",")] for line in lines[1:]]
+    return {n: [r[i] for r in rows] for i, n in enumerate(names)}
+
+def test_columnar_json(client):
+    risk, liabilities, period, surplus = random_profiles(2_500, seed=11)
+    resp = client.post("/portfolio/allocate/batch?chunkSize=1000", json={"columns": {
+        "riskAppetite": risk, "liabilities": liabilities, "investmentPeriod": period, "netSurplus": surplus}})
+    assert resp.status_code == 200
+    assert_matches(scalar(risk, liabilities, period, surplus), _decode_ndjson(resp.content))
+
+def test_csv(client):
+    risk, liabilities, period, surplus = random_profiles(2_500, seed=12)
+    inflow = [s + 50_000 for s in surplus]
+    buf = io.StringIO()
+    buf.write("riskAppetite,liabilities,investmentPeriod,cashInflow,cashOutflow\n")
+    for row in zip(risk, liabilities, period, inflow):
+        buf.write(",".join(map(str, row)) + ",50000\n")
+    resp = client.post("/portfolio/allocate/batch?format=csv&chunkSize=700", content=buf.getvalue(),
+                       headers={"content-type": "text/csv"})
+    assert resp.status_code == 200
+    surplus = [i - 50_000 for i in inflow]
+    assert_matches(scalar(risk, liabilities, period, surplus), _decode_csv(resp.content))
+
+def test_arrow(client):
+    pa = pytest.importorskip("pyarrow")
+    risk, liabilities, period, surplus = random_profiles(2_500, seed=13)
+    table = pa.table({"riskAppetite": risk, "liabilities": liabilities, "investmentPeriod": period, "netSurplus": surplus})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as w:
+        w.write_table(table)
+    resp = client.post("/portfolio/allocate/batch", content=sink.getvalue().to_pybytes(),
+                       headers={"content-type": "application/vnd.apache.arrow.stream"})
+    assert resp.status_code == 200
+    assert_matches(scalar(risk, liabilities, period, surplus), _decode_ndjson(resp.content))
+
+def test_invalid_input_is_a_400(client):
+    resp = client.post("/portfolio/allocate/batch", json={"columns": {"liabilities": [1]}})
+    assert resp.status_code == 400
@@ -0,0 +1,91 @@
+import threading, time
+
+import pytest
+
+from app.cache import RefreshAheadCache
+
+class Loader:
+    def __init__(self, delay=0.0):
+        self.calls, self.delay, self.fail = 0, delay, False
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+            n = self.calls
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return f"v{n}"
+
+def _wait_for(cond, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+def test_concurrent_misses_share_one_load():
+    cache, load = RefreshAheadCache("t", ttl=10), Loader(delay=0.1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("k", load))) for _ in range(10)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert load.calls == 1 and results == ["v1"] * 10
+
+def test_followers_see_the_leaders_error():
+    cache, load = RefreshAheadCache("t", ttl=10), Loader(delay=0.1)
+    load.fail = True
+    errors = []
+    def call():
+        try:
+            cache.get("k", load)
+        except RuntimeError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert load.calls == 1 and len(errors) == 5
+
+def test_late_hit_refreshes_once_in_the_background():
+    cache, load = RefreshAheadCache("t", ttl=0.2, refresh_ahead=0.5), Loader(delay=0.05)
+    assert cache.get("k", load) == "v1"
+    time.sleep(0.12)
+    # Past the refresh point: callers keep getting the current value while one refresh runs
+    assert [cache.get("k", load) for _ in range(5)] == ["v1"] * 5
+    _wait_for(lambda: cache.peek("k") == "v2")
+    assert load.calls == 2 and cache.stats()["refreshes"] == 1
+
+def test_stale_while_revalidate():
+    cache, load = RefreshAheadCache("t", ttl=0.05, stale_while_revalidate=1.0), Loader(delay=0.05)
+    cache.get("k", load)
+    time.sleep(0.08)
+    assert cache.get("k", load) == "v1"  # stale but inside the window: served without waiting
+    _wait_for(lambda: cache.peek("k") == "v2")
+    assert cache.stats()["stale"] == 1
+
+def test_stale_if_error_serves_the_last_good_value_then_gives_up():
+    cache, load = RefreshAheadCache("t", ttl=0.05, stale_if_error=0.2), Loader()
+    cache.get("k", load)
+    load.fail = True
+    time.sleep(0.08)
+    assert cache.get("k", load) == "v1"
+    time.sleep(0.2)
+    with pytest.raises(RuntimeError):
+        cache.get("k", load)
+    assert cache.stats()["errors"] == 2
+
+def test_lru_eviction_and_invalidate():
+    cache = RefreshAheadCache("t", ttl=10, max_entries=2)
+    for k in "abc":
+        cache.put(k, k)
+    assert cache.peek("a") is None and cache.peek("c") == "c"
+    assert cache.stats()["evictions"] == 1
+    assert cache.invalidate("c") == 1 and cache.invalidate("c") == 0
+    assert cache.invalidate() == 1
+
+def test_ttl_of_sets_per_entry_lifetime():
+    cache = RefreshAheadCache("t", ttl=10, ttl_of=lambda v: v["expires_in"])
+    cache.put("short", {"expires_in": 0.03})
+    cache.put("long", {"expires_in": 5})
+    time.sleep(0.05)
+    assert cache.peek("short") is None and cache.peek("long") is not None
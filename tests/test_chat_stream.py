@@ -0,0 +1,93 @@
+import json, uuid
+from types import SimpleNamespace as NS
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.admission as adm
+import app.main as main
+from app.history import conversations
+
+def chunk(content=None, tool=None, finish=None):
+    calls = [NS(index=tool[0], id=tool[1], function=NS(name=tool[2], arguments=tool[3]))] if tool else None
+    return NS(choices=[NS(delta=NS(content=content, tool_calls=calls), finish_reason=finish)])
+
+class FakeAOAI:
+    """Streams one scripted list of chunks per completion call and records what it was sent."""
+    def __init__(self, rounds):
+        self.rounds, self.requests = list(rounds), []
+        self.chat = NS(completions=NS(create=self.create))
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        chunks = self.rounds.pop(0)
+        if isinstance(chunks, Exception):
+            raise chunks
+        async def gen():
+            yield NS(choices=[])  # prompt-filter chunk without choices
+            for c in chunks:
+                yield c
+        return gen()
+
+def events(body: str):
+    out = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        out.append((lines["event"], json.loads(lines["data"])))
+    return out
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+def post(client, fake, monkeypatch, text):
+    monkeypatch.setattr(main, "aoai_async_client", lambda: fake)
+    sid = str(uuid.uuid4())
+    resp = client.post("/chat/stream", json={"sessionId": sid, "messages": [{"role": "user", "content": text}]})
+    assert resp.status_code == 200 and resp.headers["content-type"].startswith("text/event-stream")
+    return sid, events(resp.text)
+
+def test_text_and_tool_deltas(client, monkeypatch):
+    ran = []
+    async def arun_all(session_id, calls):
+        ran.extend(calls)
+        return [{"status": "success", "equity": 60}]
+    monkeypatch.setattr(main.tools, "arun_all", arun_all)
+    fake = FakeAOAI([
+        [chunk("Let me work that out. "),
+         chunk(tool=(0, "call_1", "ComputeAllocation", '{"riskApp')),
+         chunk(tool=(0, None, None, 'etite": "Moderate"}')),
+         chunk(finish="tool_calls")],
+        [chunk("Put 60% "), chunk("in equity."), chunk(finish="stop")],
+    ])
+    sid, evs = post(client, fake, monkeypatch, "How should I split my savings between stocks and bonds today?")
+    kinds = [k for k, _ in evs]
+    assert kinds == ["ttft", "delta", "tool", "delta", "delta", "done"]
+    # Fragments of one call are joined before the tool runs
+    assert ran == [("ComputeAllocation", '{"riskAppetite": "Moderate"}')]
+    assert evs[2][1] == {"name": "ComputeAllocation", "result": {"status": "success", "equity": 60}}
+    assert evs[-1][1]["finish_reason"] == "stop" and evs[-1][1]["sessionId"] == sid
+    # The follow-up completion sees the assistant tool call and its result
+    followup = fake.requests[1]["messages"]
+    assert followup[-2]["tool_calls"][0]["function"]["arguments"] == '{"riskAppetite": "Moderate"}'
+    assert json.loads(followup[-1]["content"]) == {"status": "success", "equity": 60}
+    # Only the last round's text is stored as the reply
+    assert conversations.load(sid)[-1] == {"role": "assistant", "content": "Put 60% in equity."}
+    assert main.admission.active == 0
+
+class _RateLimited(Exception):
+    status_code = 429
+    response = NS(headers={"retry-after": "90"})
+
+def test_upstream_throttling_becomes_an_error_event(client, monkeypatch):
+    fake = FakeAOAI([_RateLimited()])
+    _, evs = post(client, fake, monkeypatch, "What do you think about gold as an investment right now?")
+    assert evs == [("error", {"message": "Too many requests, please retry shortly.", "retryAfter": 90})]
+    assert main.admission.active == 0
+
+def test_saturation_is_a_real_429(client, monkeypatch):
+    monkeypatch.setattr(adm, "ADMISSION_SESSION_MAX", 0)
+    monkeypatch.setattr(main, "aoai_async_client", lambda: FakeAOAI([]))
+    resp = client.post("/chat/stream", json={"messages": [{"role": "user", "content": "Is real estate a better bet than index funds?"}]})
+    assert resp.status_code == 429 and int(resp.headers["Retry-After"]) >= 1
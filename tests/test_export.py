@@ -0,0 +1,98 @@
+import csv, io, json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, insert, update
+
+import app.export as export_mod
+from app.db import Base, MessageLog, SessionState
+from app.export import Export, decode_watermark, stream
+
+T0 = datetime(2026, 1, 1, 9, 0, 0)
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_mod, "EXPORT_SAFETY_LAG", 0)
+    eng = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    Base.metadata.create_all(eng)
+    yield eng
+    eng.dispose()
+
+def add_messages(eng, times, session="s1"):
+    with eng.begin() as conn:
+        conn.execute(insert(MessageLog.__table__), [{"sessionId": session, "role": "user", "content": f"m{i}", "createdAt": t}
+                                                   for i, t in enumerate(times)])
+
+def ids(export):
+    return [r[export._pk] for rows in export.batches() for r in rows]
+
+def test_pages_cover_every_row_once_across_timestamp_ties(db):
+    # Runs of equal createdAt straddle the page boundaries, so the id tie-break has to carry the cursor
+    times = [T0] * 5 + [T0 + timedelta(seconds=1)] * 4 + [T0 + timedelta(seconds=2)]
+    add_messages(db, times)
+    e = Export("messages", page_size=3, db=db)
+    assert ids(e) == list(range(1, 11))
+    assert e.rows == 10
+    assert e.watermark == f"{(T0 + timedelta(seconds=2)).isoformat()}|10"
+
+def test_incremental_runs_resume_after_the_watermark(db):
+    add_messages(db, [T0 + timedelta(seconds=i) for i in range(4)])
+    first = Export("messages", page_size=2, db=db)
+    assert ids(first) == [1, 2, 3, 4]
+    add_messages(db, [T0 + timedelta(seconds=3), T0 + timedelta(seconds=10)])  # one ties with the watermark
+    second = Export("messages", after=first.watermark, page_size=2, db=db)
+    assert ids(second) == [5, 6]
+    third = Export("messages", after=second.watermark, db=db)
+    assert ids(third) == [] and third.watermark == second.watermark
+
+def test_rows_inside_the_safety_lag_wait_for_the_next_run(db, monkeypatch):
+    monkeypatch.setattr(export_mod, "EXPORT_SAFETY_LAG", 60)
+    now = datetime.utcnow()
+    add_messages(db, [now - timedelta(minutes=5), now - timedelta(minutes=2), now])
+    e = Export("messages", db=db)
+    assert ids(e) == [1, 2]
+    monkeypatch.setattr(export_mod, "EXPORT_SAFETY_LAG", 0)
+    assert ids(Export("messages", after=e.watermark, db=db)) == [3]
+
+def test_sessions_are_re_exported_when_their_profile_changes(db):
+    with db.begin() as conn:
+        conn.execute(insert(SessionState.__table__), [{"sessionId": sid, "createdAt": T0, "updatedAt": T0} for sid in "abc"])
+    first = Export("sessions", db=db)
+    assert ids(first) == ["a", "b", "c"]
+    with db.begin() as conn:
+        conn.execute(update(SessionState.__table__).where(SessionState.sessionId == "b")
+                     .values(userName="Asha", updatedAt=T0 + timedelta(minutes=1)))
+    second = Export("sessions", after=first.watermark, db=db)
+    assert ids(second) == ["b"]
+
+def test_session_filter(db):
+    add_messages(db, [T0, T0], session="s1")
+    add_messages(db, [T0], session="s2")
+    assert ids(Export("messages", session_id="s2", db=db)) == [3]
+
+def test_watermarks():
+    assert decode_watermark("messages", "2026-01-01T09:00:00|42") == (T0, 42)
+    assert decode_watermark("sessions", "2026-01-01T09:00:00|abc") == (T0, "abc")
+    assert decode_watermark("messages", None) is None
+    with pytest.raises(ValueError):
+        decode_watermark("messages", "yesterday|1")
+    with pytest.raises(ValueError):
+        decode_watermark("messages", "2026-01-01T09:00:00|x")
+
+def test_encoders(db):
+    add_messages(db, [T0 + timedelta(seconds=i) for i in range(5)])
+    lines = b"".join(stream(Export("messages", page_size=2, db=db), "ndjson")).decode().splitlines()
+    assert [json.loads(l)["content"] for l in lines] == [f"m{i}" for i in range(5)]
+    rows = list(csv.reader(io.StringIO(b"".join(stream(Export("messages", page_size=2, db=db), "csv")).decode())))
+    assert rows[0] == [c.name for c in MessageLog.__table__.columns] and len(rows) == 6
+    with pytest.raises(ValueError):
+        stream(Export("messages", db=db), "xml")
+    with pytest.raises(ValueError):
+        Export("users", db=db)
+
+def test_parquet(db):
+    pq = pytest.importorskip("pyarrow.parquet")
+    add_messages(db, [T0 + timedelta(seconds=i) for i in range(5)])
+    data = b"".join(stream(Export("messages", page_size=2, db=db), "parquet"))
+    table = pq.read_table(io.BytesIO(data))
+    assert table.column("content").to_pylist() == [f"m{i}" for i in range(5)]
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from app.gazetteer import Gazetteer, gazetteer, normalize, read_countries
+
+@pytest.fixture(scope="module")
+def gz():
+    return gazetteer()
+
+@pytest.mark.parametrize("query, city, iso, match", [
+    ("Mumbai", "Mumbai", "IN", "exact"),
+    ("Bombay", "Mumbai", "IN", "alias"),
+    ("Köln", "Cologne", "DE", "alias"),
+    ("St. Louis", "Saint Louis", "US", "exact"),
+    ("I live in Navi Mumbai, Maharashtra", "Navi Mumbai", "IN", "contains"),
+    ("based out of Hyderabad, Pakistan", "Hyderabad", "PK", "contains"),
+    ("Bangalor", "Bengaluru", "IN", "fuzzy"),
+    ("Hydrabad", "Hyderabad", "IN", "fuzzy"),
+])
+def test_lookup(gz, query, city, iso, match):
+    place = gz.lookup(query)
+    assert (place["city"], place["countryCode"], place["match"]) == (city, iso, match)
+
+@pytest.mark.parametrize("query", ["xyzzy", "somewhere quiet", "not sure yet", "", "Puna"])
+def test_misses_have_no_default_country(gz, query):
+    assert gz.lookup(query) is None
+    assert gz.country_currency(query) is None
+
+def test_country_currency(gz):
+    assert gz.country_currency("Pune") == ("India", "₹")
+
+def _levenshtein(a: str, b: str) -> int:
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        row = [i]
+        for j, cb in enumerate(b, 1):
+            row.append(min(row[j - 1] + 1, prev[j] + 1, prev[j - 1] + (ca != cb)))
+        prev = row
+    return prev[-1]
+
+def _typo(word: str, rng: random.Random, keep: int) -> str:
+    i = rng.randrange(keep, len(word))
+    op = rng.choice("dis")
+    c = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    return word[:i] + word[i + 1:] if op == "d" else word[:i] + c + word[i:] if op == "i" else word[:i] + c + word[i + 1:]
+
+def test_fuzzy_matches_brute_force_levenshtein():
+    rng = random.Random(3)
+    syllables = "ka ra ma ti lo ne su va do pi ha ze ku mo ri sa ba le no ga".split()
+    names = {"".join(rng.choice(syllables) for _ in range(rng.randint(3, 5))) for _ in range(1500)}
+    g = Gazetteer([(n, "IN", 1000, []) for n in names], read_countries())
+    keys = list(g.exact) + list(g.country_keys)
+    pool = sorted(names)
+    for _ in range(300):
+        word = rng.choice(pool)
+        edits = rng.choice([1, 2])
+        query = word
+        for _ in range(edits):
+            query = _typo(query, rng, keep=2)  # the walk is anchored on the leading letters
+        anchor = query[:2] if edits >= 2 and len(query) > 2 else query[:1]
+        expected = min(_levenshtein(query, k) for k in keys if k.startswith(anchor))
+        got = g.fuzzy(query, edits)
+        if expected > edits:
+            assert got == [], query
+        else:
+            assert got and {d for d, _ in got} == {expected}, query
+            assert all(_levenshtein(query, k) == expected for _, k in got), query
+
+def test_normalize():
+    assert normalize("  St. Louis ") == "saint louis"
+    assert normalize("Köln") == normalize("koln")
@@ -0,0 +1,80 @@
+import time, uuid
+
+from sqlalchemy import select
+
+from app.db import SessionLocal, MessageLog
+from app.history import ConversationStore
+from app.writer import WriteBehind
+
+def _stored(sid):
+    with SessionLocal() as db:
+        return [(r.role, r.content) for r in db.execute(
+            select(MessageLog.role, MessageLog.content).where(MessageLog.sessionId == sid).order_by(MessageLog.id))]
+
+def _turn(role, content):
+    return {"role": role, "content": content}
+
+def test_two_workers_record_each_turn_once(tmp_path):
+    sid, path = str(uuid.uuid4()), str(tmp_path / "sessions.sqlite")
+    a, b = ConversationStore(shared_path=path), ConversationStore(shared_path=path)
+    a.start(sid)
+    b.load(sid)  # b has seen the session before a records anything
+    u1, a1, u2, a2 = _turn("user", "hi"), _turn("assistant", "May I have your name?"), _turn("user", "Asha"), _turn("assistant", "Which city?")
+    assert a.append_new(sid, [u1]) == [u1]
+    a.record(sid, a1["role"], a1["content"])
+    # Next turn lands on the other worker with the full client-side history
+    assert b.append_new(sid, [u1, a1, u2]) == [u2]
+    b.record(sid, a2["role"], a2["content"])
+    assert a.append_new(sid, [u1, a1, u2, a2]) == []
+    assert _stored(sid) == [(t["role"], t["content"]) for t in (u1, a1, u2, a2)]
+
+def test_server_history_sees_the_other_workers_turns(tmp_path):
+    sid, path = str(uuid.uuid4()), str(tmp_path / "sessions.sqlite")
+    a, b = ConversationStore(shared_path=path), ConversationStore(shared_path=path)
+    a.start(sid)
+    assert b.load(sid) == []
+    a.record(sid, "user", "Asha")
+    a.record(sid, "assistant", "Which city?")
+    assert b.load(sid) == [_turn("user", "Asha"), _turn("assistant", "Which city?")]
+    b.record(sid, "user", "Pune")
+    assert [t["content"] for t in a.load(sid)] == ["Asha", "Which city?", "Pune"]
+
+def test_cold_session_is_seeded_from_sql(tmp_path):
+    sid = str(uuid.uuid4())
+    a = ConversationStore(shared_path=str(tmp_path / "a.sqlite"))
+    a.start(sid)
+    a.append_new(sid, [_turn("user", "hi"), _turn("assistant", "Hello!")])
+    # A node whose cache file has never seen the session
+    b = ConversationStore(shared_path=str(tmp_path / "b.sqlite"))
+    assert b.append_new(sid, [_turn("user", "hi"), _turn("assistant", "Hello!"), _turn("user", "Asha")]) == [_turn("user", "Asha")]
+    assert len(_stored(sid)) == 3
+    assert b.stats()["sqlReads"] == 1
+
+def test_node_copy_expires_so_a_returning_session_rebuilds_from_sql(tmp_path):
+    sid = str(uuid.uuid4())
+    a = ConversationStore(shared_path=str(tmp_path / "a.sqlite"))
+    b = ConversationStore(shared_path=str(tmp_path / "b.sqlite"))
+    a.shared.ttl = 0.05
+    a.start(sid)
+    a.append_new(sid, [_turn("user", "hi")])
+    # The session moves to node b for a while, then comes back to a
+    b.append_new(sid, [_turn("user", "hi"), _turn("assistant", "Name?"), _turn("user", "Asha")])
+    time.sleep(0.1)
+    history = [_turn("user", "hi"), _turn("assistant", "Name?"), _turn("user", "Asha"), _turn("user", "Pune")]
+    assert a.append_new(sid, history) == [_turn("user", "Pune")]
+    assert [c for _, c in _stored(sid)] == ["hi", "Name?", "Asha", "Pune"]
+
+def test_cold_read_waits_only_for_its_own_session():
+    w = WriteBehind(mode="async")
+    w.start()
+    try:
+        sid = str(uuid.uuid4())
+        w.submit("message", {"sessionId": sid, "role": "user", "content": "queued"})
+        assert w.wait_session(sid, timeout=5)
+        assert _stored(sid) == [("user", "queued")]
+        # Nothing pending for an unrelated session: no wait at all, however busy the queue is
+        t0 = time.monotonic()
+        assert w.wait_session(str(uuid.uuid4()), timeout=5)
+        assert time.monotonic() - t0 < 0.1
+    finally:
+        w.stop()
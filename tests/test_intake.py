@@ -0,0 +1,65 @@
+import pytest
+
+from app.intake import IntakeMachine, parse_name, parse_risk, question_for
+
+@pytest.mark.parametrize("text, level", [
+    ("Conservative", "Conservative"),
+    ("moderate", "Moderate"),
+    ("I'd say aggressive", "Aggressive"),
+    ("medium risk", "Moderate"),
+    ("I am cautious", "Conservative"),
+])
+def test_parse_risk(text, level):
+    assert parse_risk(text) == level
+
+@pytest.mark.parametrize("text", [
+    "not too risky",
+    "nothing aggressive",
+    "I don't want high risk",
+    "dont like risky stuff",
+    "less risky please",
+    "low to medium",
+    "high growth",
+    "safe but some growth",
+])
+def test_parse_risk_defers_negations_and_mixed_terms(text):
+    assert parse_risk(text) is None
+
+@pytest.mark.parametrize("text, name", [
+    ("Asha", "Asha"),
+    ("asha rao", "Asha Rao"),
+    ("my name is Ravi", "Ravi"),
+    ("Hi, my name is José", "José"),
+    ("O'Neil", "O'Neil"),
+])
+def test_parse_name(text, name):
+    assert parse_name(text) == name
+
+@pytest.mark.parametrize("text", ["hello", "Hey!", "hello there", "good morning", "hmm", "sure", "thanks", "k", "ok"])
+def test_parse_name_rejects_greetings_and_filler(text):
+    assert parse_name(text) is None
+
+def test_sector_answer_triggers_the_market_step():
+    machine = IntakeMachine(lambda city: ("India", "₹"))
+    profile = {"userName": "Asha", "userCity": "Mumbai", "cashInflow": 1e5, "cashOutflow": 6e4, "liabilities": 0.0,
+               "riskAppetite": "Moderate"}
+    history = [{"role": "assistant", "content": question_for("preferredSector", profile)},
+               {"role": "user", "content": "technology"}]
+    reply, fields = machine.handle(history, profile)
+    assert reply == "#fetch-top-stocks: Tech"
+    assert fields == {"preferredSector": "Tech"}
+
+@pytest.mark.parametrize("answer", ["not sure yet", "I don't know", "Atlantis"])
+def test_unresolved_city_is_not_stored(answer):
+    machine = IntakeMachine(lambda city: ("India", "₹") if city == "Mumbai" else None)
+    profile = {"userName": "Asha"}
+    history = [{"role": "assistant", "content": question_for("userCity", profile)}, {"role": "user", "content": answer}]
+    assert machine.handle(history, profile) == (None, {})
+
+def test_resolved_city_sets_country_and_currency():
+    machine = IntakeMachine(lambda city: ("India", "₹") if city == "Mumbai" else None)
+    profile = {"userName": "Asha"}
+    history = [{"role": "assistant", "content": question_for("userCity", profile)}, {"role": "user", "content": "mumbai"}]
+    reply, fields = machine.handle(history, profile)
+    assert fields == {"userCity": "Mumbai", "userCountry": "India", "currency": "₹"}
+    assert "inflow" in reply
@@ -0,0 +1,74 @@
+import os, threading
+
+import pytest
+
+import app.market_snapshot as ms
+from app.market_snapshot import Snapshot, SnapshotStore, write_snapshot
+
+def rows(tag: str, n: int = 8):
+    out = [{"symbol": f"{tag}T{i}", "name": f"{tag} Tech {i}", "sector": "Tech", "performanceScore": 100 - i} for i in range(n)]
+    out += [{"symbol": f"{tag}F{i}", "name": f"{tag} Fin {i}", "sector": "finance", "performanceScore": 50 + i} for i in range(n)]
+    return out
+
+def test_leaders_and_filters(tmp_path):
+    version = write_snapshot(rows("a") + [{"symbol": "aT0", "sector": "Tech", "performanceScore": 1}], str(tmp_path))
+    snap = Snapshot(str(tmp_path / version))
+    assert [r["symbol"] for r in snap.top("technology", 3)] == ["aT0", "aT1", "aT2"]  # aliases normalise; dupes dropped
+    assert [r["symbol"] for r in snap.top("Finance", 2)] == ["aF7", "aF6"]
+    assert [r["score"] for r in snap.top("Tech", 10, min_score=96)] == [100, 99, 98, 97, 96]
+    assert [r["symbol"] for r in snap.top("Tech", 2, exclude=["at0", " aT1 "])] == ["aT2", "aT3"]
+    assert snap.top("Energy") is None
+
+def test_rejects_unusable_input(tmp_path):
+    with pytest.raises(ValueError):
+        write_snapshot([{"symbol": "X"}], str(tmp_path))
+
+def test_hot_swap_waits_for_the_poll_or_a_refresh(tmp_path):
+    store = SnapshotStore(str(tmp_path), poll=3600)
+    assert store.top("Tech") is None  # nothing published yet
+    write_snapshot(rows("a"), str(tmp_path))
+    assert store.refresh() is not None
+    assert store.top("Tech", 1)[0]["symbol"] == "aT0"
+    old = store.current()
+    v2 = write_snapshot(rows("b"), str(tmp_path))
+    assert store.top("Tech", 1)[0]["symbol"] == "aT0"  # inside the poll interval: still the old version
+    assert store.refresh() == v2 and store.top("Tech", 1)[0]["symbol"] == "bT0"
+    # A reader still holding the previous version keeps working on it
+    assert old.top("Tech", 1)[0]["symbol"] == "aT0"
+    assert store.stats()["swaps"] == 2
+
+def test_a_broken_version_keeps_the_current_one(tmp_path):
+    store = SnapshotStore(str(tmp_path), poll=3600)
+    v1 = write_snapshot(rows("a"), str(tmp_path))
+    store.refresh()
+    (tmp_path / ms.POINTER).write_text("does-not-exist")
+    assert store.refresh() == v1
+    assert store.stats()["loadErrors"] == 1
+
+def test_old_versions_are_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(ms, "MARKET_SNAPSHOT_KEEP", 2)
+    versions = [write_snapshot(rows(t), str(tmp_path)) for t in "abcd"]
+    kept = sorted(d for d in os.listdir(tmp_path) if not d.startswith(".") and d != ms.POINTER)
+    assert kept == sorted(versions[-2:])
+
+def test_readers_never_see_a_mixed_version(tmp_path):
+    store = SnapshotStore(str(tmp_path), poll=0)
+    write_snapshot(rows("v0"), str(tmp_path))
+    errors, stop = [], threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                top = store.top("Tech", 5)
+                tags = {r["symbol"].split("T")[0] for r in top}
+                if len(tags) != 1:
+                    errors.append(tags)
+            except Exception as e:
+                errors.append(e)
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads: t.start()
+    for i in range(1, 15):
+        write_snapshot(rows(f"v{i}"), str(tmp_path))
+    stop.set()
+    for t in threads: t.join()
+    assert errors == []
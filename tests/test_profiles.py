@@ -0,0 +1,38 @@
+import uuid
+
+from app.intake import IntakeMachine, question_for
+from app.profiles import ProfileStore
+
+intake = IntakeMachine(lambda city: ("India", "₹"))
+
+def _turn(store, sid, history):
+    # Same steps as app.main.intake_turn
+    profile = store.get(sid)
+    if intake.stale(history, profile):
+        profile = store.get(sid, fresh=True)
+    reply, fields = intake.handle(history, profile)
+    if fields:
+        store.update(sid, fields)
+    return reply, dict(profile, **fields)
+
+def test_unshared_workers_reread_a_stale_profile():
+    sid = str(uuid.uuid4())
+    a, b = ProfileStore(shared_path=None), ProfileStore(shared_path=None)
+    a.start(sid)
+    b.get(sid)  # worker b caches the empty profile
+    history = [{"role": "assistant", "content": question_for("userName", {})}, {"role": "user", "content": "Asha"}]
+    reply, _ = _turn(a, sid, history)
+    history += [{"role": "assistant", "content": reply}, {"role": "user", "content": "Mumbai"}]
+    reply, profile = _turn(b, sid, history)
+    assert profile["userName"] == "Asha" and profile["userCity"] == "Mumbai"
+    assert "inflow" in reply
+    assert b.stats()["rereads"] == 1
+
+def test_shared_tier_serves_the_other_workers_answer(tmp_path):
+    sid, path = str(uuid.uuid4()), str(tmp_path / "sessions.sqlite")
+    a, b = ProfileStore(shared_path=path), ProfileStore(shared_path=path)
+    a.start(sid)
+    b.get(sid)
+    a.update(sid, {"userName": "Asha"})
+    assert b.get(sid)["userName"] == "Asha"
+    assert b.stats()["rereads"] == 0
@@ -0,0 +1,80 @@
+import asyncio, os
+
+import pytest
+
+from app.stt import STT_FIELD_MAX_BYTES, MultipartStream
+
+BOUNDARY = "----invest-soul-test-boundary"
+CTYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+def body(parts):
+    out = b""
+    for name, value, filename, ctype in parts:
+        disp = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        out += f"--{BOUNDARY}\r\nContent-Disposition: {disp}\r\n".encode()
+        if ctype:
+            out += f"Content-Type: {ctype}\r\n".encode()
+        out += b"\r\n" + value + b"\r\n"
+    return out + f"--{BOUNDARY}--\r\n".encode()
+
+class Chunks:
+    """Async body iterator that records how many chunks the parser has pulled."""
+    def __init__(self, data: bytes, size: int):
+        self.chunks = [data[i:i + size] for i in range(0, len(data), size)]
+        self.pulled = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.pulled == len(self.chunks):
+            raise StopAsyncIteration
+        self.pulled += 1
+        return self.chunks[self.pulled - 1]
+
+def read(data: bytes, size: int):
+    async def go():
+        src = Chunks(data, size)
+        stream = MultipartStream(CTYPE, src)
+        if not await stream.start():
+            return stream, None, None
+        got, first_at = [], None
+        async for part in stream.file_chunks():
+            if first_at is None:
+                first_at = src.pulled
+            got.append(part)
+        return stream, b"".join(got), (first_at, len(src.chunks))
+    return asyncio.run(go())
+
+# Audio that contains CRLFs and a near-miss of the boundary, so the parser can't split on either
+AUDIO = os.urandom(20_000) + b"\r\n--" + BOUNDARY[:-1].encode() + b"\r\n" + os.urandom(5_000)
+
+@pytest.mark.parametrize("size", [1, 7, 64, 4096, 1 << 20])
+def test_fields_and_audio_at_any_chunking(size):
+    data = body([("language", b"hi-IN", None, None), ("file", AUDIO, "clip.wav", "audio/wav"),
+                 ("after", b"ignored", None, None)])
+    stream, audio, _ = read(data, size)
+    assert audio == AUDIO
+    assert stream.fields == {"language": "hi-IN"}
+    assert (stream.filename, stream.content_type) == ("clip.wav", "audio/wav")
+
+def test_audio_is_handed_out_before_the_body_ends():
+    data = body([("file", AUDIO, "clip.wav", "audio/wav")])
+    _, audio, (first_at, total) = read(data, 1024)
+    assert audio == AUDIO
+    assert first_at < total // 2
+
+def test_body_without_the_file_part():
+    stream, audio, _ = read(body([("language", b"en-US", None, None)]), 64)
+    assert audio is None and stream.fields == {"language": "en-US"}
+
+def test_text_fields_are_capped():
+    stream, _, _ = read(body([("language", b"x" * (STT_FIELD_MAX_BYTES * 4), None, None),
+                              ("file", b"abc", "a.wav", None)]), 100)
+    assert len(stream.fields["language"]) == STT_FIELD_MAX_BYTES
+
+def test_missing_boundary_and_malformed_bodies_are_value_errors():
+    with pytest.raises(ValueError):
+        MultipartStream("multipart/form-data", Chunks(b"", 1))
+    with pytest.raises(ValueError):
+        read(b"--wrong-boundary\r\nnot a multipart body\r\n", 16)
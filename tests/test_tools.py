@@ -0,0 +1,44 @@
+import asyncio, threading, time
+
+from pydantic import BaseModel
+
+import app.tools as tools_mod
+from app.tools import ToolRegistry
+
+class Args(BaseModel):
+    seconds: float = 0.0
+
+def registry():
+    reg = ToolRegistry(max_workers=4)
+    done = threading.Event()
+
+    @reg.register("Sleep", "Sleeps, then reports.", Args)
+    def sleep(session_id, args):
+        time.sleep(args.seconds)
+        done.set()
+        return {"status": "success", "slept": args.seconds}
+    return reg, done
+
+def test_calls_run_concurrently_in_call_order():
+    reg, _ = registry()
+    t0 = time.monotonic()
+    results = asyncio.run(reg.arun_all("s", [("Sleep", '{"seconds": 0.3}'), ("Sleep", '{"seconds": 0.1}'), ("Sleep", "{}")]))
+    assert time.monotonic() - t0 < 0.55
+    assert [r["slept"] for r in results] == [0.3, 0.1, 0.0]
+
+def test_bad_calls_become_readable_results():
+    reg, _ = registry()
+    results = asyncio.run(reg.arun_all("s", [("Nope", "{}"), ("Sleep", '{"seconds": "soon"}')]))
+    assert [r["status"] for r in results] == ["error", "error"]
+    assert "Unknown tool" in results[0]["message"] and "seconds" in results[1]["message"]
+
+def test_timeout_is_reported_as_pending_not_failed(monkeypatch):
+    monkeypatch.setattr(tools_mod, "TOOL_TIMEOUT", 0.1)
+    reg, done = registry()
+    t0 = time.monotonic()
+    [result] = asyncio.run(reg.arun_all("s", [("Sleep", '{"seconds": 0.4}')]))
+    assert time.monotonic() - t0 < 0.35
+    assert result["status"] == "pending"
+    # The call itself still finishes in the background, which is why the model isn't told it failed
+    assert done.wait(2)
+    assert reg.stats()["timeouts"] == 1
@@ -0,0 +1,76 @@
+import uuid
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app.db import SessionLocal, MessageLog, SessionState
+from app.writer import WriteBehind
+
+@pytest.fixture
+def writer():
+    w = WriteBehind(mode="async")
+    w.start()
+    yield w
+    w.stop()
+
+def _messages(sid):
+    with SessionLocal() as db:
+        return list(db.scalars(select(MessageLog.content).where(MessageLog.sessionId == sid).order_by(MessageLog.id)))
+
+def _msg(sid, content):
+    return {"sessionId": sid, "role": "user", "content": content}
+
+def test_rows_are_written_in_batches(writer):
+    sid = str(uuid.uuid4())
+    writer.submit("session", {"sessionId": sid})
+    for i in range(50):
+        writer.submit("message", _msg(sid, f"m{i}"))
+    writer.flush()
+    assert _messages(sid) == [f"m{i}" for i in range(50)]
+    st = writer.stats()
+    assert st["written"] == 51 and st["batches"] < 51 and st["deadLetters"] == 0
+
+def test_a_bad_row_is_dead_lettered_and_the_rest_survive(writer):
+    sid = str(uuid.uuid4())
+    for i in range(4):
+        writer.submit("message", _msg(sid, f"ok{i}"))
+    writer.submit("message", _msg(sid, None))  # Messages.content is NOT NULL
+    for i in range(4, 8):
+        writer.submit("message", _msg(sid, f"ok{i}"))
+    writer.flush()
+    assert _messages(sid) == [f"ok{i}" for i in range(8)]
+    st = writer.stats()
+    assert st["deadLetters"] == 1 and st["salvaged"] >= 1
+
+def test_profile_updates_merge_into_the_session_row(writer):
+    sid = str(uuid.uuid4())
+    writer.submit("session", {"sessionId": sid})
+    writer.submit("profile", {"sessionId": sid, "userName": "Asha"})
+    writer.submit("profile", {"sessionId": sid, "userCity": "Pune"})
+    writer.submit("session", {"sessionId": sid})  # insert-if-missing: doesn't clobber the profile
+    writer.flush()
+    with SessionLocal() as db:
+        row = db.get(SessionState, sid)
+    assert (row.userName, row.userCity) == ("Asha", "Pune")
+    assert row.updatedAt >= row.createdAt
+
+def test_stop_drains_the_queue():
+    w = WriteBehind(mode="async")
+    w.start()
+    sid = str(uuid.uuid4())
+    for i in range(20):
+        w.submit("message", _msg(sid, f"m{i}"))
+    w.stop()
+    assert len(_messages(sid)) == 20 and w.stats()["queueDepth"] == 0
+
+def test_inline_writes_raise_to_the_caller():
+    w = WriteBehind(mode="sync")
+    sid = str(uuid.uuid4())
+    with pytest.raises(IntegrityError):
+        w.submit("message", _msg(sid, None))
+    with pytest.raises(IntegrityError):
+        w.write_now("message", _msg(sid, None))
+    w.write_now("message", _msg(sid, "saved"))
+    assert _messages(sid) == ["saved"]
+    assert w.stats()["deadLetters"] == 1